@@ -0,0 +1,188 @@
+"""Identify every image in a directory or ZIP archive
+
+    python batch_identify.py photos/ results.csv
+    python batch_identify.py field_trip.zip results.parquet --record
+"""
+import argparse
+import csv
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from image_processor import decode_image, preprocess_batch
+from perceptual_hash import image_hash
+from dataset_ingest import IMAGE_EXTENSIONS, is_image_member
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_WORKERS = 4
+DEFAULT_VISION_WORKERS = 8
+RESULT_FIELDS = ['path', 'plant_name', 'confidence', 'image_hash', 'error']
+
+
+def iter_images(source):
+    """Yield (name, image bytes) for every image file under a directory or inside a ZIP archive"""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if is_image_member(info):
+                    yield info.filename, archive.read(info)
+        return
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    yield path, f.read()
+
+
+def _prepare_chunk(chunk, fast, preprocess):
+    """Decode, hash and (for the local model) preprocess one chunk of (name, bytes) pairs"""
+    start = time.perf_counter()
+    decoded = []
+    failed = []
+    for name, data in chunk:
+        image = decode_image(data, fast)
+        if image is None:
+            failed.append(name)
+        else:
+            decoded.append((name, data, image))
+    hashes = [image_hash(image) for _, _, image in decoded]
+    batch = preprocess_batch([image for _, _, image in decoded], workers=1, fast=fast) if preprocess and decoded else None
+    return decoded, hashes, batch, failed, time.perf_counter() - start
+
+
+def _write_results(rows, output):
+    if output.endswith('.parquet'):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise RuntimeError("Writing Parquet requires pandas and pyarrow; use a .csv output instead")
+        pd.DataFrame(rows, columns=RESULT_FIELDS).to_parquet(output, index=False)
+        return
+    with open(output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def identify_images(source, output=None, use_vision=False, record=False, batch_size=DEFAULT_BATCH_SIZE,
+                    workers=DEFAULT_WORKERS, vision_workers=DEFAULT_VISION_WORKERS, fast=False,
+                    model_tuple=None):
+    """Identify every image in source (a directory or ZIP) and return (rows, stats)
+
+    Images are decoded and preprocessed in chunks of batch_size on `workers`
+    threads while the previous chunks go through the local classifier, one
+    batched forward pass per chunk; fast=True uses the downsample-first
+    preprocessing. With use_vision=True each image is sent to
+    openai_vision.identify_plant instead, vision_workers requests at a time.
+    Rows are written to output (.csv, or .parquet when pandas/pyarrow are
+    installed), and with record=True identified images are added to
+    identification_history one transaction per chunk.
+    """
+    from database import add_identifications
+    if use_vision:
+        from openai_vision import identify_plant
+        from vision_client import VisionAPIError
+
+        def identify_with_vision(item):
+            (_, data, _), hash_value = item
+            try:
+                return identify_plant(data, image_hash=hash_value)
+            except VisionAPIError as e:
+                return e
+    else:
+        from model_utils import load_model, predict_batch
+        model_tuple = model_tuple or load_model()
+
+    rows = []
+    stats = {'images': 0, 'identified': 0, 'unknown': 0, 'failed': 0,
+             'prepare_seconds': 0.0, 'identify_seconds': 0.0, 'record_seconds': 0.0}
+    start = time.perf_counter()
+    images = iter_images(source)
+
+    with ThreadPoolExecutor(max_workers=workers) as prepare_pool, \
+            ThreadPoolExecutor(max_workers=vision_workers if use_vision else 1) as vision_pool:
+        # Keep a couple of chunks per worker in preparation so inference never waits on decoding
+        pending = deque()
+
+        def fill():
+            while len(pending) < workers * 2:
+                chunk = list(islice(images, batch_size))
+                if not chunk:
+                    return
+                pending.append(prepare_pool.submit(_prepare_chunk, chunk, fast, not use_vision))
+
+        fill()
+        while pending:
+            decoded, hashes, batch, failed, prepare_seconds = pending.popleft().result()
+            fill()
+            stats['prepare_seconds'] += prepare_seconds
+            rows.extend({'path': name, 'plant_name': None, 'confidence': None, 'image_hash': None,
+                         'error': 'could not decode image'} for name in failed)
+            stats['failed'] += len(failed)
+            if not decoded:
+                continue
+
+            identify_start = time.perf_counter()
+            if use_vision:
+                results = list(vision_pool.map(identify_with_vision, zip(decoded, hashes)))
+            else:
+                predictions, confidences = predict_batch(model_tuple, batch, batch_size)
+                results = list(zip(predictions, confidences))
+            stats['identify_seconds'] += time.perf_counter() - identify_start
+
+            records = []
+            for (name, data, _), hash_value, result in zip(decoded, hashes, results):
+                if isinstance(result, Exception):
+                    rows.append({'path': name, 'plant_name': None, 'confidence': None,
+                                 'image_hash': f"{hash_value:016x}", 'error': str(result)})
+                    stats['failed'] += 1
+                    continue
+                plant_name, confidence = str(result[0]), float(result[1])
+                rows.append({'path': name, 'plant_name': plant_name, 'confidence': round(confidence, 2),
+                             'image_hash': f"{hash_value:016x}", 'error': None})
+                if plant_name == "Unknown":
+                    stats['unknown'] += 1
+                else:
+                    stats['identified'] += 1
+                    records.append((plant_name, confidence, data, hash_value))
+            if record and records:
+                record_start = time.perf_counter()
+                add_identifications(records)
+                stats['record_seconds'] += time.perf_counter() - record_start
+
+    stats['images'] = len(rows)
+    stats['elapsed_seconds'] = time.perf_counter() - start
+    stats['images_per_second'] = stats['images'] / stats['elapsed_seconds'] if stats['elapsed_seconds'] else 0.0
+    if output:
+        _write_results(rows, output)
+    return rows, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory or ZIP archive of images")
+    parser.add_argument("output", help="results file (.csv or .parquet)")
+    parser.add_argument("--vision", action="store_true", help="identify with the OpenAI Vision API instead of the local model")
+    parser.add_argument("--record", action="store_true", help="add identified images to the identification history")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="decode/preprocess threads")
+    parser.add_argument("--vision-workers", type=int, default=DEFAULT_VISION_WORKERS, help="concurrent Vision API requests")
+    parser.add_argument("--fast", action="store_true", help="downsample large images before preprocessing (see image_processor)")
+    args = parser.parse_args()
+
+    _, stats = identify_images(args.source, args.output, use_vision=args.vision, record=args.record,
+                               batch_size=args.batch_size, workers=args.workers,
+                               vision_workers=args.vision_workers, fast=args.fast)
+    print(f"Identified {stats['identified']} of {stats['images']} images ({stats['unknown']} unknown, "
+          f"{stats['failed']} failed) in {stats['elapsed_seconds']:.2f} s "
+          f"({stats['images_per_second']:.1f} images/sec)")
+    print(f"prepare {stats['prepare_seconds']:.2f} s (summed over workers), identify {stats['identify_seconds']:.2f} s, "
+          f"record {stats['record_seconds']:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
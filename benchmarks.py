@@ -0,0 +1,1211 @@
+"""Performance benchmarks for the plant identification pipeline
+
+Run `python benchmarks.py <name>`; `python benchmarks.py --help` lists them.
+"""
+import argparse
+import random
+import time
+import numpy as np
+
+
+def _percentiles(latencies_ms):
+    latencies = np.asarray(latencies_ms)
+    return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def _benchmark_model():
+    """The trained classifier, or an untrained one of the same architecture if none exists"""
+    from model_utils import load_model
+    try:
+        return load_model()
+    except FileNotFoundError:
+        from sklearn.preprocessing import LabelEncoder
+        from train_model import create_efficientnet_model
+        from plant_info import PLANT_CLASSES
+        print("No trained model found, benchmarking an untrained EfficientNet")
+        label_encoder = LabelEncoder().fit(PLANT_CLASSES)
+        return create_efficientnet_model(len(PLANT_CLASSES), weights=None), label_encoder
+
+
+def _random_images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((count, 128, 128, 3), dtype=np.float32)
+
+
+def _synthetic_dataset(root, images_per_class, size=(1024, 768), classes=("Tulsi", "Neem", "Aloe_Vera", "Mint"),
+                       seed=0, first=0):
+    """Write smooth random JPEGs into root/<class>/ (numbered from `first`) and return root"""
+    import os
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    for plant_class in classes:
+        class_dir = os.path.join(root, plant_class)
+        os.makedirs(class_dir, exist_ok=True)
+        for i in range(first, first + images_per_class):
+            noise = (rng.random((size[1] // 8, size[0] // 8, 3)) * 255).astype(np.uint8)
+            image = cv2.resize(noise, size, interpolation=cv2.INTER_CUBIC)
+            cv2.imwrite(os.path.join(class_dir, f"{i:05d}.jpg"), image)
+    return root
+
+
+def _dataset_dir(args, stack):
+    """args.data_dir if given, otherwise a synthetic dataset in a temporary directory"""
+    import tempfile
+
+    if args.data_dir:
+        return args.data_dir
+    root = stack.enter_context(tempfile.TemporaryDirectory())
+    print(f"Generating {args.synthetic} synthetic images per class...")
+    return _synthetic_dataset(root, args.synthetic)
+
+
+def bench_hash_index(args):
+    """Near-duplicate lookup latency in the perceptual-hash index"""
+    from perceptual_hash import MultiIndexHashTable
+
+    rng = random.Random(42)
+    print(f"{'hashes':>10} {'build s':>9} {'p50 ms':>8} {'p99 ms':>8} {'found':>6}")
+    for size in args.sizes:
+        hashes = [rng.getrandbits(64) for _ in range(size)]
+        index = MultiIndexHashTable()
+        start = time.perf_counter()
+        for i, value in enumerate(hashes):
+            index.add(value, i)
+        build_seconds = time.perf_counter() - start
+
+        # Half the queries are perturbed copies of stored hashes, half are random misses
+        queries = []
+        for value in rng.sample(hashes, args.queries // 2):
+            for bit in rng.sample(range(64), rng.randint(0, args.max_distance)):
+                value ^= 1 << bit
+            queries.append(value)
+        queries += [rng.getrandbits(64) for _ in range(args.queries - len(queries))]
+
+        latencies, found = [], 0
+        for query in queries:
+            start = time.perf_counter()
+            found += index.nearest(query, args.max_distance) is not None
+            latencies.append((time.perf_counter() - start) * 1000)
+        p50, p99 = _percentiles(latencies)
+        print(f"{size:>10} {build_seconds:>9.2f} {p50:>8.3f} {p99:>8.3f} {found:>6}")
+
+
+def bench_predict_batch(args):
+    """Per-image predict() versus predict_batch() throughput"""
+    from model_utils import predict, predict_batch
+
+    model_tuple = _benchmark_model()
+    images = _random_images(args.images)
+    predict_batch(model_tuple, images[:args.batch_size], batch_size=args.batch_size)  # warm up
+
+    start = time.perf_counter()
+    for image in images[:args.single_images]:
+        predict(model_tuple, image)
+    single_rate = args.single_images / (time.perf_counter() - start)
+    print(f"predict():       {single_rate:8.1f} images/sec")
+
+    for batch_size in args.batch_sizes:
+        predict_batch(model_tuple, images[:batch_size], batch_size=batch_size)  # trace this shape
+        start = time.perf_counter()
+        predict_batch(model_tuple, images, batch_size=batch_size)
+        rate = len(images) / (time.perf_counter() - start)
+        print(f"predict_batch({batch_size:>3}): {rate:8.1f} images/sec ({rate * 60:,.0f}/min)")
+
+
+def _run_clients(clients, requests_per_client, call):
+    """Run call(i) from `clients` threads; return (images/sec, per-request latencies in ms)"""
+    import threading
+
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def client(client_id):
+        local = []
+        for i in range(requests_per_client):
+            start = time.perf_counter()
+            call(client_id * requests_per_client + i)
+            local.append((time.perf_counter() - start) * 1000)
+        with latencies_lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return clients * requests_per_client / elapsed, latencies
+
+
+def bench_micro_batching(args):
+    """Concurrent clients: direct predict() calls versus the micro-batching server"""
+    from model_utils import predict
+    from inference_server import MicroBatchServer
+
+    model_tuple = _benchmark_model()
+    images = _random_images(256)
+    predict(model_tuple, images[0])  # warm up
+
+    print(f"{'clients':>8} {'path':>14} {'img/s':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    with MicroBatchServer(model_tuple, max_batch_size=args.max_batch_size,
+                          max_wait_ms=args.max_wait_ms) as server:
+        server.warm_up()
+        for clients in args.clients:
+            requests_per_client = max(1, args.requests // clients)
+            paths = [
+                ("predict()", lambda i: predict(model_tuple, images[i % len(images)])),
+                ("micro-batched", lambda i: server.predict(images[i % len(images)]))
+            ]
+            for name, call in paths:
+                rate, latencies = _run_clients(clients, requests_per_client, call)
+                p50, p99 = _percentiles(latencies)
+                print(f"{clients:>8} {name:>14} {rate:>8.1f} {p50:>9.1f} {p99:>9.1f}")
+        print(f"server: {server.stats()}")
+
+
+def bench_training_loader(args):
+    """Serial load_training_data() versus the streaming tf.data pipeline"""
+    from contextlib import ExitStack
+    from train_model import load_training_data, iter_training_files, make_dataset
+
+    with ExitStack() as stack:
+        data_dir = _dataset_dir(args, stack)
+
+        start = time.perf_counter()
+        X, _ = load_training_data(data_dir)
+        serial_rate = len(X) / (time.perf_counter() - start)
+        del X
+
+        paths, labels = zip(*iter_training_files(data_dir))
+        dataset = make_dataset(paths, np.zeros((len(paths), 1), dtype=np.float32), batch_size=args.batch_size)
+        start = time.perf_counter()
+        count = sum(len(images) for images, _ in dataset)
+        streaming_rate = count / (time.perf_counter() - start)
+
+    print(f"load_training_data(): {serial_rate:8.1f} images/sec")
+    print(f"make_dataset():       {streaming_rate:8.1f} images/sec")
+
+
+def bench_preprocess_cache(args):
+    """Cold and incremental preprocessing-cache updates, then epoch read throughput"""
+    import tempfile
+    from contextlib import ExitStack
+    from preprocess_cache import PreprocessCache
+    from train_model import iter_training_files, make_dataset, make_cached_dataset
+
+    with ExitStack() as stack:
+        data_dir = _dataset_dir(args, stack)
+        cache = PreprocessCache(stack.enter_context(tempfile.TemporaryDirectory()))
+        files = list(iter_training_files(data_dir))
+
+        start = time.perf_counter()
+        cache.update(files)
+        print(f"cold update:        {time.perf_counter() - start:8.2f} s")
+        start = time.perf_counter()
+        cache.update(files)
+        print(f"unchanged update:   {time.perf_counter() - start:8.2f} s")
+
+        paths, labels, shards, offsets = cache.entries()
+        dummy_labels = np.zeros((len(paths), 1), dtype=np.float32)
+        for name, dataset in [
+            ("from image files", make_dataset(paths, dummy_labels, batch_size=args.batch_size)),
+            ("from cache shards", make_cached_dataset(cache, shards, offsets, dummy_labels,
+                                                       batch_size=args.batch_size))
+        ]:
+            start = time.perf_counter()
+            count = sum(len(images) for images, _ in dataset)
+            print(f"epoch {name}: {count / (time.perf_counter() - start):8.1f} images/sec")
+
+
+def bench_preprocess_batch(args):
+    """preprocess_image() in a loop versus preprocess_batch() (equivalence is checked in tests/test_image_processor.py)"""
+    import os
+    import cv2
+    from image_processor import preprocess_image, preprocess_batch
+
+    rng = np.random.default_rng(0)
+    width, height = args.size
+    images = []
+    for _ in range(args.images):
+        noise = (rng.random((height // 8, width // 8, 3)) * 255).astype(np.uint8)
+        images.append(cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC))
+
+    start = time.perf_counter()
+    expected = np.stack([preprocess_image(image) for image in images])
+    loop_rate = len(images) / (time.perf_counter() - start)
+
+    out = np.empty_like(expected)
+    for workers in args.workers:
+        start = time.perf_counter()
+        preprocess_batch(images, out=out, workers=workers)
+        rate = len(images) / (time.perf_counter() - start)
+        print(f"preprocess_batch(workers={workers}): {rate:8.1f} images/sec")
+    print(f"preprocess_image() loop:     {loop_rate:8.1f} images/sec ({os.cpu_count()} CPUs)")
+
+
+def _validation_split(data_dir):
+    """The validation (paths, labels) train_model() holds out for data_dir"""
+    from sklearn.model_selection import train_test_split
+    from train_model import iter_training_files
+
+    paths, labels = zip(*iter_training_files(data_dir))
+    _, paths_val, _, labels_val = train_test_split(
+        list(paths), list(labels), test_size=0.2, random_state=42, stratify=labels
+    )
+    return paths_val, labels_val
+
+
+def bench_fast_preprocess(args):
+    """Full-resolution versus fast (downsample-first) preprocessing: latency and accuracy"""
+    import cv2
+    from image_processor import decode_image, preprocess_image
+
+    rng = np.random.default_rng(0)
+    print(f"{'resolution':>11} {'full ms':>9} {'fast ms':>9}")
+    for width, height in [(640, 480), (1920, 1080), (4032, 3024), (6000, 4000)]:
+        noise = (rng.random((height // 16, width // 16, 3)) * 255).astype(np.uint8)
+        _, encoded = cv2.imencode(".jpg", cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC))
+        encoded = encoded.tobytes()
+        timings = []
+        for fast in (False, True):
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                preprocess_image(decode_image(encoded, fast), fast)
+            timings.append((time.perf_counter() - start) / args.repeats * 1000)
+        print(f"{width:>5}x{height:<5} {timings[0]:>9.1f} {timings[1]:>9.1f}")
+
+    if not args.data_dir:
+        print("Pass --data-dir to measure accuracy on the validation split")
+        return
+    from model_utils import load_model, predict_batch
+
+    model_tuple = load_model()
+    paths, labels = _validation_split(args.data_dir)
+    labels = np.array(labels)
+    encoded_images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            encoded_images.append(f.read())
+    results = {}
+    for fast in (False, True):
+        start = time.perf_counter()
+        batch = np.stack([preprocess_image(decode_image(data, fast), fast) for data in encoded_images])
+        latency = (time.perf_counter() - start) / len(encoded_images) * 1000
+        predictions, _ = predict_batch(model_tuple, batch)
+        results[fast] = predictions
+        name = "fast" if fast else "full"
+        print(f"{name}: accuracy {np.mean(predictions == labels):.3f}, "
+              f"preprocessing {latency:.1f} ms/image over {len(paths)} validation images")
+    print(f"prediction agreement between modes: {np.mean(results[False] == results[True]):.3f}")
+
+
+def bench_scraper(args):
+    """Serial versus concurrent dataset download against a local HTTP server, then a rerun"""
+    import os
+    import tempfile
+    from image_scraper import get_image_urls, download_dataset
+    from download_manifest import DownloadManifest
+    from tests.local_image_server import LocalImageServer
+
+    for workers in args.workers:
+        with LocalImageServer(args.images, args.latency) as server, \
+                tempfile.TemporaryDirectory() as save_dir:
+            manifest = DownloadManifest(os.path.join(save_dir, "manifest.db"))
+            urls = get_image_urls("local", base_urls=[server.url + "/index0.html"])
+            # Unreachable images exercise permanent-failure handling, aliases deduplication
+            urls += [f"{server.url}/img/{args.images + i}.jpg" for i in range(5)]
+            urls += [f"{server.url}/img/{i}.jpg?alias" for i in range(5)]
+            for run in ("first run", "rerun"):
+                start = time.perf_counter()
+                count = download_dataset(save_dir, num_images=len(urls), image_urls=urls,
+                                         max_workers=workers, max_per_host=workers, manifest=manifest)
+                elapsed = time.perf_counter() - start
+                print(f"workers={workers:>3} {run:>9}: {count}/{len(urls)} new images in {elapsed:6.2f} s "
+                      f"({count / elapsed:6.1f} images/sec)")
+            print(f"manifest: {manifest.counts()}")
+
+
+def bench_crawl(args):
+    """Multi-class crawl against a local HTTP server under a global rate limit"""
+    import os
+    import tempfile
+    from image_scraper import crawl_all_classes
+    from download_manifest import DownloadManifest
+    from plant_info import PLANT_CLASSES
+    from tests.local_image_server import LocalImageServer
+
+    with LocalImageServer(args.images, args.latency, pages=len(PLANT_CLASSES)) as server, \
+            tempfile.TemporaryDirectory() as data_dir:
+        sources = {plant_class: [f"{server.url}/index{i}.html"] for i, plant_class in enumerate(PLANT_CLASSES)}
+        for parallel in args.parallel_classes:
+            manifest = DownloadManifest(os.path.join(data_dir, f"manifest{parallel}.db"))
+            stats = crawl_all_classes(
+                PLANT_CLASSES, args.images, os.path.join(data_dir, f"parallel{parallel}"),
+                max_parallel_classes=parallel, max_workers_per_class=args.workers,
+                # Every class is served by the same local host, so its cap must cover all of them
+                max_per_host=parallel * args.workers, requests_per_second=args.requests_per_second, manifest=manifest, url_sources=sources
+            )
+            print(f"parallel classes={parallel}: {sum(stats['downloaded'].values())} images in "
+                  f"{stats['elapsed_seconds']:.2f} s ({stats['images_per_second']:.1f} images/sec)")
+
+
+def bench_db_inserts(args):
+    """Identification inserts/sec: commit per call (old settings, then WAL) versus the write-behind queue"""
+    import os
+    import tempfile
+    from sqlalchemy.orm import sessionmaker
+    from database import Base, IdentificationWriter, add_identifications, create_database_engine
+
+    def session_factory(path, pragmas):
+        engine = create_database_engine(f"sqlite:///{path}", echo=False, pragmas=pragmas)
+        Base.metadata.create_all(engine)
+        return sessionmaker(bind=engine)
+
+    record = ("Tulsi", 97.5, None, None)
+    print(f"{'clients':>8} {'path':>22} {'inserts/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    with tempfile.TemporaryDirectory() as root:
+        for clients in args.clients:
+            requests_per_client = max(1, args.inserts // clients)
+            total = clients * requests_per_client
+            for name, pragmas in [("commit per call", {}), ("commit per call + WAL", None)]:
+                factory = session_factory(os.path.join(root, f"{clients}-{len(name)}.db"), pragmas)
+                rate, latencies = _run_clients(clients, requests_per_client,
+                                               lambda i: add_identifications([record], factory))
+                p50, p99 = _percentiles(latencies)
+                print(f"{clients:>8} {name:>22} {rate:>10.1f} {p50:>9.2f} {p99:>9.2f}")
+
+            # Latency here is what the caller waits for; throughput includes draining the queue
+            writer = IdentificationWriter(args.max_batch_size, args.max_latency_ms,
+                                          session_factory(os.path.join(root, f"{clients}-queue.db"), None))
+            start = time.perf_counter()
+            _, latencies = _run_clients(clients, requests_per_client, lambda i: writer.submit(*record))
+            writer.close()
+            rate = total / (time.perf_counter() - start)
+            p50, p99 = _percentiles(latencies)
+            print(f"{clients:>8} {'write-behind queue':>22} {rate:>10.1f} {p50:>9.2f} {p99:>9.2f}")
+
+
+def bench_history_queries(args):
+    """History browsing over a large table: OFFSET paging without indexes versus indexed keyset paging"""
+    import os
+    import tempfile
+    from collections import Counter
+    from datetime import datetime, timedelta
+    from sqlalchemy import text
+    from sqlalchemy.orm import sessionmaker
+    from database import (Base, IdentificationHistory, create_database_engine,
+                          get_identifications_page, get_daily_plant_counts)
+    from plant_info import PLANT_CLASSES
+
+    def timed(call, repeats=args.repeats):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            call()
+        return (time.perf_counter() - start) * 1000 / repeats
+
+    with tempfile.TemporaryDirectory() as root:
+        engine = create_database_engine(f"sqlite:///{os.path.join(root, 'history.db')}", echo=False)
+        Base.metadata.create_all(engine)
+        factory = sessionmaker(bind=engine)
+        table = IdentificationHistory.__table__
+        with engine.begin() as connection:
+            for index in table.indexes:
+                connection.execute(text(f"DROP INDEX {index.name}"))
+
+        print(f"Inserting {args.rows:,} rows...")
+        rng = random.Random(0)
+        start_time = datetime(2024, 1, 1)
+        step = timedelta(days=args.days) / args.rows
+        rows = ({"plant_name": rng.choice(PLANT_CLASSES), "confidence_score": rng.uniform(40, 100),
+                 "timestamp": start_time + step * i} for i in range(args.rows))
+        with engine.begin() as connection:
+            while True:
+                chunk = [row for _, row in zip(range(50_000), rows)]
+                if not chunk:
+                    break
+                connection.execute(table.insert(), chunk)
+
+        depth = args.rows // 2
+        session = factory()
+        cursor_row = session.query(IdentificationHistory.timestamp, IdentificationHistory.id)\
+            .order_by(IdentificationHistory.timestamp.desc(), IdentificationHistory.id.desc())\
+            .offset(depth - 1).first()
+        cursor = tuple(cursor_row)
+        order = (IdentificationHistory.timestamp.desc(),)
+
+        def offset_page(offset, **filters):
+            query = session.query(IdentificationHistory)
+            for name, value in filters.items():
+                query = query.filter(getattr(IdentificationHistory, name) == value)
+            return query.order_by(*order).offset(offset).limit(args.page_size).all()
+
+        def python_daily_counts():
+            return Counter((timestamp.date(), plant_name) for timestamp, plant_name in
+                           session.query(IdentificationHistory.timestamp, IdentificationHistory.plant_name))
+
+        before = {
+            "first page": timed(lambda: offset_page(0)),
+            f"page at row {depth:,}": timed(lambda: offset_page(depth)),
+            "plant filter, deep page": timed(lambda: offset_page(depth // len(PLANT_CLASSES), plant_name="Neem")),
+            "daily counts": timed(python_daily_counts, 1),
+        }
+
+        index_start = time.perf_counter()
+        for index in table.indexes:
+            index.create(engine)
+        print(f"Created indexes in {time.perf_counter() - index_start:.1f} s")
+        plant_cursor = tuple(session.query(IdentificationHistory.timestamp, IdentificationHistory.id)
+                             .filter(IdentificationHistory.plant_name == "Neem")
+                             .order_by(*order, IdentificationHistory.id.desc())
+                             .offset(depth // len(PLANT_CLASSES) - 1).first())
+        session.close()
+
+        after = {
+            "first page": timed(lambda: get_identifications_page(args.page_size, session_factory=factory)),
+            f"page at row {depth:,}": timed(lambda: get_identifications_page(
+                args.page_size, cursor, session_factory=factory)),
+            "plant filter, deep page": timed(lambda: get_identifications_page(
+                args.page_size, plant_cursor, plant_name="Neem", session_factory=factory)),
+            "daily counts": timed(lambda: get_daily_plant_counts(session_factory=factory), 1),
+        }
+
+        print(f"{'query':>26} {'OFFSET, no index ms':>20} {'keyset, indexed ms':>19}")
+        for name in before:
+            print(f"{name:>26} {before[name]:>20.2f} {after[name]:>19.2f}")
+
+
+def _legacy_zip_ingest(zip_path, save_dir):
+    """The previous Bulk Upload code path: read the whole archive, decode and re-encode each member serially"""
+    import io
+    import os
+    import zipfile
+    import cv2
+
+    with open(zip_path, 'rb') as f, zipfile.ZipFile(io.BytesIO(f.read())) as zip_ref:
+        for image_file in [f for f in zip_ref.namelist() if f.lower().endswith(('.jpg', '.jpeg', '.png'))]:
+            image = cv2.imdecode(np.asarray(bytearray(zip_ref.read(image_file)), dtype=np.uint8), 1)
+            if image is not None:
+                cv2.imwrite(os.path.join(save_dir, os.path.basename(image_file)), image)
+
+
+def bench_zip_ingest(args):
+    """Bulk ZIP upload: the old serial decode/re-encode loop versus dataset_ingest.ingest_zip"""
+    import os
+    import tempfile
+    import tracemalloc
+    import zipfile
+    from dataset_ingest import ingest_zip
+
+    with tempfile.TemporaryDirectory() as root:
+        print(f"Generating a ZIP of {args.images} images...")
+        image_dir = _synthetic_dataset(os.path.join(root, "images"), args.images // 4, tuple(args.size))
+        zip_path = os.path.join(root, "upload.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as archive:
+            for plant_class in sorted(os.listdir(image_dir)):
+                for name in sorted(os.listdir(os.path.join(image_dir, plant_class))):
+                    # Each class folder reuses the same file names, as field collections often do
+                    archive.write(os.path.join(image_dir, plant_class, name), f"{plant_class}/{name}")
+        print(f"ZIP size: {os.path.getsize(zip_path) / 1e6:.1f} MB")
+
+        runs = [("serial decode + imwrite", lambda out: _legacy_zip_ingest(zip_path, out))]
+        for workers in args.workers:
+            runs.append((f"ingest_zip workers={workers}",
+                         lambda out, workers=workers: ingest_zip(zip_path, out, workers=workers)))
+        for name, run in runs:
+            out = tempfile.mkdtemp(dir=root)
+            tracemalloc.start()
+            start = time.perf_counter()
+            run(out)
+            saved = len(os.listdir(out))
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{name:>26}: {saved} files kept in {elapsed:6.2f} s ({args.images / elapsed:6.1f} images/sec, "
+                  f"peak Python memory {peak / 1e6:6.1f} MB)")
+
+        stats = ingest_zip(zip_path, tempfile.mkdtemp(dir=root), workers=args.workers[-1])
+        print("stage seconds: " + ", ".join(f"{stage} {seconds:.2f}" for stage, seconds in stats["stage_seconds"].items()))
+
+
+def bench_batch_identify(args):
+    """Offline identification: decode/preprocess/predict one image at a time versus batch_identify"""
+    import os
+    import tempfile
+    from batch_identify import identify_images, iter_images
+    from image_processor import decode_image, preprocess_image
+    from model_utils import predict_batch
+
+    model_tuple = _benchmark_model()
+    with tempfile.TemporaryDirectory() as root:
+        print(f"Generating {args.images} synthetic images...")
+        image_dir = _synthetic_dataset(root, args.images // 4, tuple(args.size))
+
+        start = time.perf_counter()
+        count = 0
+        for _, data in iter_images(image_dir):
+            predict_batch(model_tuple, [preprocess_image(decode_image(data))], batch_size=1)
+            count += 1
+        elapsed = time.perf_counter() - start
+        print(f"{'one image at a time':>28}: {count / elapsed:6.1f} images/sec")
+
+        for workers in args.workers:
+            _, stats = identify_images(image_dir, os.path.join(root, "results.csv"), batch_size=args.batch_size,
+                                       workers=workers, model_tuple=model_tuple)
+            print(f"{f'batch_identify workers={workers}':>28}: {stats['images_per_second']:6.1f} images/sec "
+                  f"(prepare {stats['prepare_seconds']:.2f} s, identify {stats['identify_seconds']:.2f} s)")
+
+
+def bench_cascade(args):
+    """Local-first cascade versus sending every image to a stubbed Vision API with fixed latency"""
+    import os
+    import tempfile
+    from batch_identify import iter_images
+    from cascade import PlantCascade
+    from image_processor import decode_image
+
+    calls = []
+
+    def stub_vision(image_bytes, image_hash=None):
+        calls.append(image_hash)
+        time.sleep(args.vision_latency)
+        return "Tulsi", 90.0
+
+    model_tuple = _benchmark_model()
+    with tempfile.TemporaryDirectory() as root:
+        images = [(data, decode_image(data)) for _, data in
+                  iter_images(_synthetic_dataset(root, args.images // 4, (640, 480)))]
+
+    # max_distance=-1 disables the history tier, so every image reaches the local model
+    runs = [("vision only", PlantCascade(model_tuple, stub_vision, min_confidence=1.01, max_distance=-1))]
+    # Also split the images at the median local confidence, so about half of them escalate
+    median = np.median([runs[0][1].predict_local(image)[1] for _, image in images]) / 100
+    for min_confidence in sorted(set(args.min_confidence) | {float(median)}):
+        runs.append((f"cascade min_confidence={min_confidence:.4g}",
+                     PlantCascade(model_tuple, stub_vision, min_confidence, args.min_margin, max_distance=-1)))
+
+    print(f"{'path':>30} {'escalated':>10} {'API calls':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, cascade in runs:
+        calls.clear()
+        latencies = []
+        for data, image in images:
+            start = time.perf_counter()
+            cascade.identify(data, image=image, image_hash=0)
+            latencies.append((time.perf_counter() - start) * 1000)
+        p50, p99 = _percentiles(latencies)
+        print(f"{name:>30} {cascade.stats()['escalation_rate']:>9.0%} {len(calls):>10} {p50:>9.1f} {p99:>9.1f}")
+
+
+class _MockVisionServer:
+    """OpenAI-compatible /v1/chat/completions stand-in with a fixed latency
+
+    Every `fail_every`-th request gets a 429 or 503, and while `outage` is set
+    every request gets a 503. With upload_bytes_per_second, request bodies take
+    as long as they would over an uplink of that speed.
+    """
+
+    def __init__(self, latency=0.2, fail_every=10, upload_bytes_per_second=None):
+        import json
+        import threading
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        body = json.dumps({
+            "id": "mock", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                "role": "assistant", "content": json.dumps({"plant_name": "Neem", "features_matched": [],
+                                                            "missing_features": [], "explanation": "mock"})}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        mock = self
+        self.outage = False
+        self.requests = 0
+        counter_lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+                if upload_bytes_per_second:
+                    time.sleep(length / upload_bytes_per_second)
+                with counter_lock:
+                    mock.requests += 1
+                    number = mock.requests
+                time.sleep(latency)
+                if mock.outage:
+                    self._send(503, b'{"error": {"message": "outage"}}')
+                elif fail_every and number % fail_every == 0:
+                    self._send(429 if number % (2 * fail_every) else 503, b'{"error": {"message": "busy"}}')
+                else:
+                    self._send(200, body)
+
+            def _send(self, status, payload):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                if status in (429, 503):
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        ThreadingHTTPServer.request_queue_size = 128
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_vision_client(args):
+    """Blocking one-at-a-time API calls versus AsyncVisionClient against a flaky local mock server"""
+    import asyncio
+    from openai import OpenAI
+    from vision_client import AsyncVisionClient, CircuitBreaker, VisionAPIError
+
+    request = {"model": "gpt-4o", "messages": [{"role": "user", "content": "identify"}], "max_tokens": 10}
+
+    with _MockVisionServer(args.latency, args.fail_every) as server:
+        # The previous code path: a blocking call per image, any error reported as "Unknown"
+        client = OpenAI(api_key="mock", base_url=server.url, max_retries=0)
+        errors = 0
+        start = time.perf_counter()
+        for _ in range(args.requests_serial):
+            try:
+                client.chat.completions.create(**request)
+            except Exception:
+                errors += 1
+        elapsed = time.perf_counter() - start
+        print(f"{'blocking, one at a time':>28}: {args.requests_serial / elapsed:6.1f} requests/sec, "
+              f"{errors}/{args.requests_serial} answered \"Unknown\" because of transient errors")
+
+        async def run(concurrency):
+            vision = AsyncVisionClient(api_key="mock", base_url=server.url, max_concurrency=concurrency,
+                                       requests_per_second=args.requests_per_second, backoff=0.05)
+            latencies = []
+
+            async def one():
+                start = time.perf_counter()
+                try:
+                    await vision.create_chat_completion(**request)
+                except VisionAPIError:
+                    return False
+                finally:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                return True
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(one() for _ in range(args.requests)))
+            elapsed = time.perf_counter() - start
+            await vision.close()
+            p50, p99 = _percentiles(latencies)
+            print(f"{f'AsyncVisionClient x{concurrency}':>28}: {args.requests / elapsed:6.1f} requests/sec, "
+                  f"{results.count(False)}/{args.requests} failed, {vision.stats['retries']} retries, "
+                  f"p50 {p50:.0f} ms, p99 {p99:.0f} ms")
+
+        for concurrency in args.concurrency:
+            asyncio.run(run(concurrency))
+
+        async def outage():
+            vision = AsyncVisionClient(api_key="mock", base_url=server.url, max_concurrency=8,
+                                       requests_per_second=args.requests_per_second, backoff=0.05,
+                                       circuit_breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30))
+            calls_before = server.requests
+            start = time.perf_counter()
+            results = await asyncio.gather(*(vision.create_chat_completion(**request) for _ in range(args.requests)),
+                                           return_exceptions=True)
+            elapsed = time.perf_counter() - start
+            await vision.close()
+            failed = sum(isinstance(result, VisionAPIError) for result in results)
+            print(f"{'outage with circuit breaker':>28}: {failed}/{args.requests} failed in {elapsed:.2f} s "
+                  f"after {server.requests - calls_before} API calls ({vision.stats['rejected']} rejected locally)")
+
+        server.outage = True
+        asyncio.run(outage())
+
+
+def bench_vision_upload(args):
+    """Vision API payload size and latency: raw uploads versus downscaled, re-encoded ones"""
+    import asyncio
+    import cv2
+    from openai_vision import encode_image_to_base64, prepare_upload, sniff_mime_type
+    from vision_client import AsyncVisionClient
+
+    rng = np.random.default_rng(0)
+    samples = []
+    for width, height in [(1280, 960), (4032, 3024)]:
+        noise = (rng.random((height // 8, width // 8, 3)) * 255).astype(np.uint8)
+        image = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+        for extension in (".jpg", ".png"):
+            samples.append((f"{width}x{height} {extension[1:].upper()}", cv2.imencode(extension, image)[1].tobytes()))
+
+    async def send(client, image_bytes, mime_type):
+        await client.create_chat_completion(model="gpt-4o", max_tokens=10, messages=[{"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encode_image_to_base64(image_bytes)}"}}
+        ]}])
+
+    async def run(server):
+        client = AsyncVisionClient(api_key="mock", base_url=server.url)
+        print(f"{'image':>16} {'upload':>12} {'bytes sent':>12} {'prepare ms':>11} {'end-to-end ms':>14}")
+        for name, data in samples:
+            variants = [("raw", lambda: (data, sniff_mime_type(data)))]
+            variants += [(image_format, lambda image_format=image_format: prepare_upload(
+                data, args.max_edge, image_format, args.quality)) for image_format in args.formats]
+            for variant, prepare in variants:
+                start = time.perf_counter()
+                upload_bytes, mime_type = prepare()
+                prepared = time.perf_counter()
+                await send(client, upload_bytes, mime_type)
+                elapsed = time.perf_counter()
+                print(f"{name:>16} {variant:>12} {len(upload_bytes):>12,} {(prepared - start) * 1000:>11.0f} "
+                      f"{(elapsed - start) * 1000:>14.0f}")
+        await client.close()
+
+    print(f"Mock API: {args.latency * 1000:.0f} ms latency, {args.uplink_mbps:g} Mbit/s uplink")
+    with _MockVisionServer(args.latency, fail_every=0, upload_bytes_per_second=args.uplink_mbps * 1e6 / 8) as server:
+        asyncio.run(run(server))
+
+
+def bench_dataset_stats(args):
+    """Dataset page statistics: listing every class folder per render versus the dataset catalog"""
+    import os
+    import tempfile
+    from dataset_catalog import DatasetCatalog
+    from plant_info import PLANT_CLASSES
+
+    def listdir_counts(root):
+        counts = {}
+        for category in PLANT_CLASSES:
+            path = os.path.join(root, category)
+            if os.path.exists(path):
+                counts[category] = len([f for f in os.listdir(path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
+        return counts
+
+    with tempfile.TemporaryDirectory() as root:
+        print(f"Generating {args.images_per_class} small images per class...")
+        _synthetic_dataset(root, args.images_per_class, (64, 48))
+
+        catalog = DatasetCatalog(root)
+        start = time.perf_counter()
+        catalog.refresh()
+        print(f"Initial catalog build: {time.perf_counter() - start:.2f} s")
+        assert catalog.class_counts() == listdir_counts(root)
+
+        def catalog_counts():
+            catalog.refresh()
+            return catalog.class_counts()
+
+        for name, call in [("os.listdir per class", lambda: listdir_counts(root)),
+                           ("catalog refresh + counts", catalog_counts),
+                           ("catalog full refresh", lambda: catalog.refresh(full=True))]:
+            latencies = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                call()
+                latencies.append((time.perf_counter() - start) * 1000)
+            p50, p99 = _percentiles(latencies)
+            print(f"{name:>26}: p50 {p50:8.2f} ms, p99 {p99:8.2f} ms")
+
+
+def _peak_rss_mb():
+    """This process's peak resident memory; ru_maxrss would include the parent's peak when forked"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _backend_child(backend, model_path, encoder_path, data_dir, repeats, results):
+    """Runs in a fresh process, so import/load time and memory are the backend's own"""
+    import cv2
+    from image_processor import preprocess_image
+    from model_utils import load_model, predict_batch, predict_probabilities
+
+    start = time.perf_counter()
+    model, label_encoder = load_model(model_path, encoder_path, backend=backend)
+    load_seconds = time.perf_counter() - start
+
+    image = _random_images(1)
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict_probabilities(model, image, batch_size=1)
+        latencies.append((time.perf_counter() - start) * 1000)
+    batch = _random_images(64)
+    start = time.perf_counter()
+    predict_probabilities(model, batch, batch_size=64)
+    batch_rate = len(batch) / (time.perf_counter() - start)
+
+    result = {'load_seconds': load_seconds, 'latencies': latencies, 'batch_rate': batch_rate}
+    if data_dir:
+        paths, labels = _validation_split(data_dir)
+        images = np.stack([preprocess_image(cv2.imread(path)) for path in paths])
+        predictions = predict_probabilities(model, images)
+        result['accuracy'] = float(np.mean(label_encoder.classes_[predictions.argmax(axis=1)] == np.array(labels)))
+        result['labels'] = predict_batch((model, label_encoder), images)[0].tolist()
+    result['peak_rss_mb'] = _peak_rss_mb()
+    results.put(result)
+
+
+def bench_model_backends(args):
+    """Keras FP32 versus TFLite float16/dynamic/int8 exports: load time, memory, latency and accuracy"""
+    import multiprocessing
+    import os
+    from model_export import export_tflite
+    from model_utils import tflite_path
+
+    if not os.path.exists(args.model_path):
+        print(f"No trained model at {args.model_path}; train one first or pass --model-path")
+        return
+    for backend in args.backends:
+        path = tflite_path(backend, args.model_path)
+        if backend != "keras" and (args.export or not os.path.exists(path)):
+            if backend == "int8" and not args.data_dir:
+                print("Pass --data-dir to calibrate the int8 export")
+                return
+            export_tflite(backend, args.model_path, data_dir=args.data_dir)
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for backend in args.backends:
+        queue = context.Queue()
+        process = context.Process(target=_backend_child, args=(backend, args.model_path, args.encoder_path,
+                                                               args.data_dir, args.repeats, queue))
+        start = time.perf_counter()
+        process.start()
+        results[backend] = queue.get()
+        process.join()
+        results[backend]["process_seconds"] = time.perf_counter() - start
+
+    print(f"{'backend':>8} {'file MB':>8} {'load s':>7} {'peak RSS MB':>12} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'batch img/s':>12} {'accuracy':>9} {'agreement':>10}")
+    reference = results.get("keras", {}).get("labels")
+    for backend, result in results.items():
+        path = args.model_path if backend == "keras" else tflite_path(backend, args.model_path)
+        p50, p99 = _percentiles(result["latencies"])
+        accuracy = f"{result['accuracy']:.3f}" if "accuracy" in result else "-"
+        agreement = "-"
+        if reference is not None and "labels" in result:
+            agreement = f"{np.mean(np.array(result['labels']) == np.array(reference)):.3f}"
+        print(f"{backend:>8} {os.path.getsize(path) / 1e6:>8.1f} {result['load_seconds']:>7.2f} "
+              f"{result['peak_rss_mb']:>12.0f} {p50:>7.2f} {p99:>7.2f} {result['batch_rate']:>12.1f} "
+              f"{accuracy:>9} {agreement:>10}")
+    print("load s covers importing the runtime, loading and warm-up; agreement is with the Keras predictions")
+
+
+def bench_embedding_index(args):
+    """Embedding index build time, memory, query latency, IVF recall and open-set rejection"""
+    from embedding_index import EmbeddingIndex
+
+    rng = np.random.default_rng(0)
+    # Clustered vectors stand in for plant embeddings; held-out clusters are the unfamiliar plants
+    centers = rng.normal(size=(args.clusters * 2, args.dim)).astype(np.float32)
+
+    def draw(count, seed, known=True):
+        local_rng = np.random.default_rng(seed)
+        clusters = local_rng.integers(0, args.clusters, count) + (0 if known else args.clusters)
+        vectors = centers[clusters] + args.noise * local_rng.normal(size=(count, args.dim)).astype(np.float32)
+        return vectors, clusters
+
+    queries, _ = draw(args.queries, seed=1)
+    unfamiliar, _ = draw(args.queries, seed=2, known=False)
+    print(f"{'vectors':>9} {'index':>14} {'build s':>8} {'calib s':>8} {'MB':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'recall@10':>9} {'accepted':>9} {'rejected':>9}")
+    for size in args.sizes:
+        configs = [("exact pca", dict(components=args.components)),
+                   ("ivf pca", dict(components=args.components, n_lists=int(np.sqrt(size)), n_probe=args.n_probe))]
+        if size <= args.full_dims_max:
+            configs.insert(0, (f"exact {args.dim}d", {}))
+        for name, settings in configs:
+            index = EmbeddingIndex(**settings)
+            start = time.perf_counter()
+            if settings:
+                index.fit(draw(min(size, 50_000), seed=3)[0])
+            for offset in range(0, size, 100_000):
+                vectors, clusters = draw(min(100_000, size - offset), seed=10 + offset)
+                index.add(vectors, clusters.astype(str))
+                del vectors
+            index.search(queries[:1])  # joins the added chunks
+            build_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            index.calibrate()
+            calibrate_seconds = time.perf_counter() - start
+
+            latencies, rows = [], []
+            for query in queries:
+                start = time.perf_counter()
+                _, found = index.search(query, 10)
+                latencies.append((time.perf_counter() - start) * 1000)
+                rows.append(found[0])
+            p50, p99 = _percentiles(latencies)
+            exact_rows = index.search(queries, 10, exact=True)[1]
+            recall = np.mean([len(set(found) & set(truth)) / 10 for found, truth in zip(rows, exact_rows)])
+            accepted = np.mean([index.identify(query)["known"] for query in queries[:100]])
+            rejected = np.mean([not index.identify(query)["known"] for query in unfamiliar[:100]])
+            print(f"{size:>9} {name:>14} {build_seconds:>8.2f} {calibrate_seconds:>8.2f} "
+                  f"{index.memory_bytes() / 1e6:>8.1f} {p50:>8.2f} {p99:>8.2f} {recall:>9.3f} "
+                  f"{accepted:>9.2f} {rejected:>9.2f}")
+            del index
+    print("recall is against an exact search of the same index; accepted/rejected are the shares of "
+          "familiar/unfamiliar queries on the known side of the calibrated distance")
+
+
+def _training_child(settings, batch_size, steps, results):
+    """Trains an untrained EfficientNet on random data in a fresh process (precision and threads are process-wide)"""
+    from train_model import TrainingConfig, ThroughputReport, compile_for_training, configure_runtime, \
+        create_efficientnet_model
+
+    config = TrainingConfig(batch_size=batch_size, **settings)
+    configure_runtime(config)
+    model = compile_for_training(create_efficientnet_model(4, weights=None), config)
+    images = _random_images(batch_size * steps)
+    labels = np.eye(4, dtype=np.float32)[np.arange(len(images)) % 4]
+    report = ThroughputReport(len(images))
+    # The first epoch includes tracing and (with jit_compile) XLA compilation
+    model.fit(images, labels, batch_size=batch_size, epochs=3, verbose=0, callbacks=[report])
+    results.put({"first_epoch_seconds": report.epochs[0]["seconds"],
+                 "images_per_second": float(np.median([epoch["images_per_second"] for epoch in report.epochs[1:]]))})
+
+
+def bench_training_config(args):
+    """Training throughput by batch size, precision (fp32/bf16) and XLA, on an untrained EfficientNet"""
+    import itertools
+    import multiprocessing
+    from train_model import bfloat16_supported
+
+    configs = [(f"{precision}, batch {batch_size}, XLA {xla}", batch_size,
+                dict(jit_compile=xla == "on", mixed_precision=precision == "bf16"))
+               for batch_size, precision, xla in itertools.product(args.batch_sizes, args.precisions, args.xla)]
+    print(f"CPU has native bfloat16: {bfloat16_supported()}")
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'config':>26} {'first epoch s':>14} {'images/sec':>11}")
+    for name, batch_size, settings in configs:
+        queue = context.Queue()
+        steps = max(1, args.images // batch_size)
+        process = context.Process(target=_training_child, args=(settings, batch_size, steps, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        print(f"{name:>26} {result['first_epoch_seconds']:>14.1f} {result['images_per_second']:>11.1f}")
+
+
+def bench_incremental_training(args):
+    """Fine-tuning on newly added images (with replay) vs retraining from scratch, on an untrained EfficientNet"""
+    import os
+    import tempfile
+    from train_model import TrainingConfig, fine_tune_model, train_model
+
+    classes = ("Tulsi", "Neem", "Aloe_Vera", "Mint")
+    # patience covers every epoch so both runs train for their full epoch count
+    config = TrainingConfig(epochs=args.epochs, fine_tune_epochs=args.fine_tune_epochs, patience=args.epochs,
+                            weights=None)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        try:
+            data_dir = os.path.join("data", "training")
+            print(f"Generating {args.images} synthetic images per class...")
+            _synthetic_dataset(data_dir, args.images, (256, 192), classes)
+            print(f"Initial training ({args.epochs} epochs)...")
+            train_model(data_dir, cache_dir=None, export_quantizations=(), config=config, build_index=False)
+
+            print(f"Adding {args.new_images} images per class and a new class...")
+            _synthetic_dataset(data_dir, args.new_images, (256, 192), classes + ("Brahmi",), seed=1,
+                               first=args.images)
+            start = time.perf_counter()
+            fine_tune_model(data_dir, args.replay_ratio, export_quantizations=(), config=config, build_index=False)
+            fine_tune_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            train_model(data_dir, cache_dir=None, export_quantizations=(), config=config, resume=False,
+                        build_index=False)
+            retrain_seconds = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+    total = len(classes) * (args.images + args.new_images) + args.new_images
+    new = (len(classes) + 1) * args.new_images
+    trained = new + int(new * args.replay_ratio)
+    print(f"{'run':>10} {'images':>7} {'epochs':>7} {'seconds':>8}")
+    print(f"{'fine-tune':>10} {trained:>7} {args.fine_tune_epochs:>7} {fine_tune_seconds:>8.1f}")
+    print(f"{'retrain':>10} {total:>7} {args.epochs:>7} {retrain_seconds:>8.1f}")
+    print(f"Fine-tuning was {retrain_seconds / fine_tune_seconds:.1f}x faster (TFLite export and the embedding "
+          "index are skipped in both runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    hash_index = subparsers.add_parser("hash-index", help=bench_hash_index.__doc__)
+    hash_index.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    hash_index.add_argument("--queries", type=int, default=1000)
+    hash_index.add_argument("--max-distance", type=int, default=6)
+    hash_index.set_defaults(func=bench_hash_index)
+
+    batch = subparsers.add_parser("predict-batch", help=bench_predict_batch.__doc__)
+    batch.add_argument("--images", type=int, default=1024)
+    batch.add_argument("--single-images", type=int, default=64)
+    batch.add_argument("--batch-size", type=int, default=64)
+    batch.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64, 128])
+    batch.set_defaults(func=bench_predict_batch)
+
+    micro = subparsers.add_parser("micro-batching", help=bench_micro_batching.__doc__)
+    micro.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32, 128])
+    micro.add_argument("--requests", type=int, default=256, help="total requests per client count")
+    micro.add_argument("--max-batch-size", type=int, default=32)
+    micro.add_argument("--max-wait-ms", type=float, default=5.0)
+    micro.set_defaults(func=bench_micro_batching)
+
+    loader = subparsers.add_parser("training-loader", help=bench_training_loader.__doc__)
+    loader.add_argument("--data-dir", help="training tree to read (default: synthetic images)")
+    loader.add_argument("--synthetic", type=int, default=100, help="synthetic images per class")
+    loader.add_argument("--batch-size", type=int, default=16)
+    loader.set_defaults(func=bench_training_loader)
+
+    cache = subparsers.add_parser("preprocess-cache", help=bench_preprocess_cache.__doc__)
+    cache.add_argument("--data-dir", help="training tree to read (default: synthetic images)")
+    cache.add_argument("--synthetic", type=int, default=100, help="synthetic images per class")
+    cache.add_argument("--batch-size", type=int, default=16)
+    cache.set_defaults(func=bench_preprocess_cache)
+
+    preprocess = subparsers.add_parser("preprocess-batch", help=bench_preprocess_batch.__doc__)
+    preprocess.add_argument("--images", type=int, default=200)
+    preprocess.add_argument("--size", type=int, nargs=2, default=[1024, 768], metavar=("WIDTH", "HEIGHT"))
+    preprocess.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    preprocess.set_defaults(func=bench_preprocess_batch)
+
+    fast = subparsers.add_parser("fast-preprocess", help=bench_fast_preprocess.__doc__)
+    fast.add_argument("--data-dir", help="training tree whose validation split is scored with the trained model")
+    fast.add_argument("--repeats", type=int, default=5)
+    fast.set_defaults(func=bench_fast_preprocess)
+
+    scraper = subparsers.add_parser("scraper", help=bench_scraper.__doc__)
+    scraper.add_argument("--images", type=int, default=100)
+    scraper.add_argument("--latency", type=float, default=0.05, help="server delay per request in seconds")
+    scraper.add_argument("--workers", type=int, nargs="+", default=[1, 16])
+    scraper.set_defaults(func=bench_scraper)
+
+    crawl = subparsers.add_parser("crawl", help=bench_crawl.__doc__)
+    crawl.add_argument("--images", type=int, default=50, help="images per class")
+    crawl.add_argument("--latency", type=float, default=0.05, help="server delay per request in seconds")
+    crawl.add_argument("--workers", type=int, default=8, help="download threads per class")
+    crawl.add_argument("--parallel-classes", type=int, nargs="+", default=[1, 4])
+    crawl.add_argument("--requests-per-second", type=float, default=200.0)
+    crawl.set_defaults(func=bench_crawl)
+
+    inserts = subparsers.add_parser("db-inserts", help=bench_db_inserts.__doc__)
+    inserts.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    inserts.add_argument("--inserts", type=int, default=2000, help="total inserts per client count")
+    inserts.add_argument("--max-batch-size", type=int, default=100)
+    inserts.add_argument("--max-latency-ms", type=float, default=50.0)
+    inserts.set_defaults(func=bench_db_inserts)
+
+    history = subparsers.add_parser("history-queries", help=bench_history_queries.__doc__)
+    history.add_argument("--rows", type=int, default=1_000_000)
+    history.add_argument("--days", type=int, default=365, help="days the rows are spread over")
+    history.add_argument("--page-size", type=int, default=20)
+    history.add_argument("--repeats", type=int, default=20)
+    history.set_defaults(func=bench_history_queries)
+
+    ingest = subparsers.add_parser("zip-ingest", help=bench_zip_ingest.__doc__)
+    ingest.add_argument("--images", type=int, default=1000)
+    ingest.add_argument("--size", type=int, nargs=2, default=[1024, 768], metavar=("WIDTH", "HEIGHT"))
+    ingest.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    ingest.set_defaults(func=bench_zip_ingest)
+
+    identify = subparsers.add_parser("batch-identify", help=bench_batch_identify.__doc__)
+    identify.add_argument("--images", type=int, default=400)
+    identify.add_argument("--size", type=int, nargs=2, default=[1024, 768], metavar=("WIDTH", "HEIGHT"))
+    identify.add_argument("--batch-size", type=int, default=64)
+    identify.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    identify.set_defaults(func=bench_batch_identify)
+
+    cascade = subparsers.add_parser("cascade", help=bench_cascade.__doc__)
+    cascade.add_argument("--images", type=int, default=40)
+    cascade.add_argument("--vision-latency", type=float, default=0.5, help="stubbed API latency in seconds")
+    cascade.add_argument("--min-confidence", type=float, nargs="+", default=[0.0, 0.80])
+    cascade.add_argument("--min-margin", type=float, default=0.0)
+    cascade.set_defaults(func=bench_cascade)
+
+    vision = subparsers.add_parser("vision-client", help=bench_vision_client.__doc__)
+    vision.add_argument("--requests", type=int, default=200)
+    vision.add_argument("--requests-serial", type=int, default=40)
+    vision.add_argument("--latency", type=float, default=0.2, help="mock server delay per request in seconds")
+    vision.add_argument("--fail-every", type=int, default=10)
+    vision.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    vision.add_argument("--requests-per-second", type=float, default=100.0)
+    vision.set_defaults(func=bench_vision_client)
+
+    upload = subparsers.add_parser("vision-upload", help=bench_vision_upload.__doc__)
+    upload.add_argument("--max-edge", type=int, default=1024)
+    upload.add_argument("--quality", type=int, default=85)
+    upload.add_argument("--formats", nargs="+", default=["jpeg", "webp"])
+    upload.add_argument("--latency", type=float, default=0.2, help="mock server delay per request in seconds")
+    upload.add_argument("--uplink-mbps", type=float, default=20.0)
+    upload.set_defaults(func=bench_vision_upload)
+
+    dataset_stats = subparsers.add_parser("dataset-stats", help=bench_dataset_stats.__doc__)
+    dataset_stats.add_argument("--images-per-class", type=int, default=25_000)
+    dataset_stats.add_argument("--repeats", type=int, default=20)
+    dataset_stats.set_defaults(func=bench_dataset_stats)
+
+    backends = subparsers.add_parser("model-backends", help=bench_model_backends.__doc__)
+    backends.add_argument("--backends", nargs="+", default=["keras", "float16", "dynamic", "int8"])
+    backends.add_argument("--model-path", default="models/plant_classifier.h5")
+    backends.add_argument("--encoder-path", default="models/label_encoder.joblib")
+    backends.add_argument("--data-dir", help="training tree: calibrates int8 and scores the validation split")
+    backends.add_argument("--export", action="store_true", help="re-export the TFLite models even if they exist")
+    backends.add_argument("--repeats", type=int, default=100)
+    backends.set_defaults(func=bench_model_backends)
+
+    embeddings = subparsers.add_parser("embedding-index", help=bench_embedding_index.__doc__)
+    embeddings.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    embeddings.add_argument("--dim", type=int, default=1280, help="embedding size (EfficientNetB0 pooling output)")
+    embeddings.add_argument("--components", type=int, default=256, help="PCA dimensions for the compact indexes")
+    embeddings.add_argument("--n-probe", type=int, default=8)
+    embeddings.add_argument("--clusters", type=int, default=1000)
+    embeddings.add_argument("--noise", type=float, default=1.0)
+    embeddings.add_argument("--queries", type=int, default=200)
+    embeddings.add_argument("--full-dims-max", type=int, default=100_000,
+                            help="largest size also indexed at full dimension (4 bytes x dim per vector)")
+    embeddings.set_defaults(func=bench_embedding_index)
+
+    training = subparsers.add_parser("training-config", help=bench_training_config.__doc__)
+    training.add_argument("--images", type=int, default=256, help="training images per epoch")
+    training.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 64])
+    training.add_argument("--precisions", nargs="+", choices=["fp32", "bf16"], default=["fp32", "bf16"])
+    training.add_argument("--xla", nargs="+", choices=["off", "on"], default=["off"])
+    training.set_defaults(func=bench_training_config)
+
+    incremental = subparsers.add_parser("incremental-training", help=bench_incremental_training.__doc__)
+    incremental.add_argument("--images", type=int, default=100, help="initial synthetic images per class")
+    incremental.add_argument("--new-images", type=int, default=10, help="images added per class, and in a new class")
+    incremental.add_argument("--epochs", type=int, default=10, help="epochs of a full training run")
+    incremental.add_argument("--fine-tune-epochs", type=int, default=5)
+    incremental.add_argument("--replay-ratio", type=float, default=1.0)
+    incremental.set_defaults(func=bench_incremental_training)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
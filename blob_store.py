@@ -0,0 +1,77 @@
+import hashlib
+import os
+import tempfile
+import cv2
+import numpy as np
+from image_processor import downscale_image
+
+DEFAULT_BLOB_DIR = 'data/blobs'
+THUMBNAIL_MAX_EDGE = 256
+THUMBNAIL_SUFFIX = '.thumb.jpg'
+
+
+class BlobStore:
+    """Content-addressed file store for image bytes
+
+    Blobs are named by the SHA-256 of their content and sharded into two levels
+    of directories (ab/cd/abcd...), so identical uploads are stored once and no
+    directory grows too large. A small JPEG thumbnail can be kept next to each blob.
+    """
+
+    def __init__(self, root=DEFAULT_BLOB_DIR):
+        self.root = root
+
+    def path(self, blob_hash, suffix=''):
+        return os.path.join(self.root, blob_hash[:2], blob_hash[2:4], blob_hash + suffix)
+
+    def _write(self, path, data):
+        """Write atomically, so readers never see a partial file"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def put(self, data: bytes, thumbnail=True) -> str:
+        """Store data (if not already present) and return its hash"""
+        blob_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(blob_hash)
+        if not os.path.exists(path):
+            self._write(path, data)
+        if thumbnail and not os.path.exists(self.path(blob_hash, THUMBNAIL_SUFFIX)):
+            thumbnail_bytes = make_thumbnail(data)
+            if thumbnail_bytes is not None:
+                self._write(self.path(blob_hash, THUMBNAIL_SUFFIX), thumbnail_bytes)
+        return blob_hash
+
+    def get(self, blob_hash) -> bytes:
+        """Stored bytes for blob_hash, or None"""
+        return self._read(self.path(blob_hash))
+
+    def get_thumbnail(self, blob_hash) -> bytes:
+        """JPEG thumbnail for blob_hash, or None"""
+        return self._read(self.path(blob_hash, THUMBNAIL_SUFFIX))
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, blob_hash) -> bool:
+        return os.path.exists(self.path(blob_hash))
+
+
+def make_thumbnail(image_bytes, max_edge=THUMBNAIL_MAX_EDGE):
+    """Encode a JPEG thumbnail of image bytes, or return None if they cannot be decoded"""
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    ok, encoded = cv2.imencode('.jpg', downscale_image(image, max_edge), [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return encoded.tobytes() if ok else None
@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+from image_processor import decode_image, preprocess_image
+from perceptual_hash import DEFAULT_MAX_DISTANCE, image_hash as compute_image_hash
+from database import find_near_duplicate
+
+# The local answer is accepted when its top probability is at least this...
+DEFAULT_MIN_CONFIDENCE = float(os.environ.get('CASCADE_MIN_CONFIDENCE', '0.80'))
+# ...and it leads the runner-up class by at least this much
+DEFAULT_MIN_MARGIN = float(os.environ.get('CASCADE_MIN_MARGIN', '0.20'))
+# Latency percentiles cover each tier's most recent calls only, so memory stays bounded
+LATENCY_WINDOW = 10_000
+# How long to wait before looking for a model or embedding index again after finding none
+RECHECK_SECONDS = float(os.environ.get('CASCADE_RECHECK_SECONDS', '30'))
+
+HISTORY = 'history'
+LOCAL = 'local'
+VISION = 'vision'
+
+
+def _default_vision_identify(image_bytes, image_hash=None):
+    from openai_vision import identify_plant
+    return identify_plant(image_bytes, image_hash=image_hash)
+
+
+class PlantCascade:
+    """Identify with the local classifier first and the Vision API only when it is unsure
+
+    Each image goes through up to three tiers: a near-duplicate already in the
+    identification history, the local EfficientNet, and finally the vision
+    function. The local answer is kept when its confidence is at least
+    min_confidence and its margin over the second most likely class is at
+    least min_margin; otherwise the image is escalated. If there is no trained
+    model every image goes to the vision tier, and the model is looked for
+    again every RECHECK_SECONDS, so one trained after startup is picked up.
+
+    When an embedding index has been built (see embedding_index) the local
+    tier also looks up the nearest training images, and escalates images
+    farther from all of them than the index's rejection distance, which the
+    softmax alone would force into a known class.
+
+    vision_identify(image_bytes, image_hash=...) -> (plant_name, confidence)
+    defaults to openai_vision.identify_plant and can be replaced with a stub;
+    a VisionAPIError it raises is passed on to the caller.
+    """
+
+    def __init__(self, model_tuple=None, vision_identify=None, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                 min_margin=DEFAULT_MIN_MARGIN, max_distance=DEFAULT_MAX_DISTANCE, fast=False, embedding_index=None):
+        self.model_tuple = model_tuple
+        self.embedding_index = embedding_index
+        self.vision_identify = vision_identify or _default_vision_identify
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.max_distance = max_distance
+        self.fast = fast
+        self._model_recheck_at = 0.0
+        self._index_recheck_at = 0.0
+        self._lock = threading.Lock()
+        self._counts = {HISTORY: 0, LOCAL: 0, VISION: 0}
+        self._latencies = {tier: deque(maxlen=LATENCY_WINDOW) for tier in (HISTORY, LOCAL, VISION)}
+
+    def _get_model(self):
+        if self.model_tuple is None and time.monotonic() >= self._model_recheck_at:
+            from model_utils import load_model
+            try:
+                self.model_tuple = load_model()
+            except FileNotFoundError:
+                print(f"No trained model found, identifications will use the vision tier "
+                      f"(checking again in {RECHECK_SECONDS:.0f}s)")
+                self._model_recheck_at = time.monotonic() + RECHECK_SECONDS
+        return self.model_tuple
+
+    def _get_index(self):
+        if self.embedding_index is None and time.monotonic() >= self._index_recheck_at:
+            from embedding_index import get_embedding_index
+            from model_utils import TFLiteModel
+            # TFLite exports have no embedding output
+            model_tuple = self._get_model()
+            if model_tuple is not None and not isinstance(model_tuple[0], TFLiteModel):
+                self.embedding_index = get_embedding_index()
+            if self.embedding_index is None:
+                # Looked for again later, so an index built after startup is picked up
+                self._index_recheck_at = time.monotonic() + RECHECK_SECONDS
+        return self.embedding_index
+
+    def _record(self, tier, latencies_ms):
+        with self._lock:
+            self._counts[tier] += 1
+            for name, latency in latencies_ms.items():
+                self._latencies[name].append(latency)
+
+    def predict_local(self, image):
+        """Local model's (plant_name, confidence %, top-2 probability margin) for a decoded BGR image"""
+        return self._run_local(image)[0]
+
+    def _run_local(self, image):
+        """predict_local's tuple, plus the embedding index's match (or None) from the same forward pass"""
+        from model_utils import predict_embeddings, predict_probabilities
+        model, label_encoder = self._get_model()
+        batch = preprocess_image(image, self.fast)[np.newaxis]
+        index = self._get_index()
+        match = None
+        if index is not None:
+            embeddings, probabilities = predict_embeddings(model, batch, batch_size=1)
+            match = index.identify(embeddings[0])
+        else:
+            probabilities = predict_probabilities(model, batch, batch_size=1)
+        probabilities = probabilities[0]
+        ranked = np.argsort(probabilities)[::-1]
+        margin = probabilities[ranked[0]] - (probabilities[ranked[1]] if len(ranked) > 1 else 0.0)
+        local = (str(label_encoder.classes_[ranked[0]]), float(probabilities[ranked[0]]) * 100, float(margin))
+        return local, match
+
+    def identify(self, image_bytes, image=None, image_hash=None):
+        """Identify one upload and return a dict describing the answer
+
+        Keys: plant_name, confidence (percent), tier (history, local or
+        vision), escalation_reason (None unless the vision tier answered),
+        local (the local tier's (plant_name, confidence, margin), if it ran),
+        neighbours (nearest training images as (path, label, distance), if
+        the embedding index was consulted) and latency_ms per tier that ran.
+        """
+        if image is None:
+            image = decode_image(image_bytes)
+        if image_hash is None and image is not None:
+            image_hash = compute_image_hash(image)
+        latencies = {}
+
+        if image_hash is not None:
+            start = time.perf_counter()
+            duplicate = find_near_duplicate(image_hash, self.max_distance)
+            latencies[HISTORY] = (time.perf_counter() - start) * 1000
+            if duplicate is not None:
+                self._record(HISTORY, latencies)
+                return {'plant_name': duplicate[0], 'confidence': duplicate[1], 'tier': HISTORY,
+                        'escalation_reason': None, 'local': None, 'neighbours': None, 'latency_ms': latencies}
+
+        local = None
+        neighbours = None
+        if image is None:
+            reason = 'image could not be decoded'
+        elif self._get_model() is None:
+            reason = 'no local model'
+        else:
+            start = time.perf_counter()
+            local, match = self._run_local(image)
+            latencies[LOCAL] = (time.perf_counter() - start) * 1000
+            plant_name, confidence, margin = local
+            if match is not None:
+                neighbours = match['neighbours']
+            if confidence < self.min_confidence * 100:
+                reason = f'local confidence {confidence:.1f}% below {self.min_confidence * 100:.0f}%'
+            elif margin < self.min_margin:
+                reason = f'top-2 margin {margin:.2f} below {self.min_margin:.2f}'
+            elif match is not None and not match['known']:
+                reason = (f"nearest training image at distance {match['distance']:.3f}, "
+                          f"beyond {self.embedding_index.threshold:.3f}")
+            else:
+                self._record(LOCAL, latencies)
+                return {'plant_name': plant_name, 'confidence': confidence, 'tier': LOCAL,
+                        'escalation_reason': None, 'local': local, 'neighbours': neighbours,
+                        'latency_ms': latencies}
+
+        start = time.perf_counter()
+        plant_name, confidence = self.vision_identify(image_bytes, image_hash=image_hash)
+        latencies[VISION] = (time.perf_counter() - start) * 1000
+        self._record(VISION, latencies)
+        return {'plant_name': plant_name, 'confidence': confidence, 'tier': VISION,
+                'escalation_reason': reason, 'local': local, 'neighbours': neighbours, 'latency_ms': latencies}
+
+    def stats(self) -> dict:
+        """How many answers each tier gave, and each tier's p50/p99 latency in ms over its last LATENCY_WINDOW calls"""
+        with self._lock:
+            total = sum(self._counts.values())
+            stats = {'identifications': total, 'escalation_rate': self._counts[VISION] / total if total else 0.0}
+            for tier, count in self._counts.items():
+                latencies = self._latencies[tier]
+                stats[tier] = {
+                    'answered': count,
+                    'p50_ms': float(np.percentile(latencies, 50)) if latencies else None,
+                    'p99_ms': float(np.percentile(latencies, 99)) if latencies else None,
+                }
+            return stats
+
+
+_cascade = None
+_cascade_lock = threading.Lock()
+
+
+def get_cascade(**kwargs) -> PlantCascade:
+    """Process-wide cascade, created on first use"""
+    global _cascade
+    with _cascade_lock:
+        if _cascade is None:
+            _cascade = PlantCascade(**kwargs)
+        return _cascade
@@ -1,64 +1,365 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, LargeBinary
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from sqlalchemy import create_engine, event, func, inspect, text, tuple_, Column, Integer, String, Float, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+from perceptual_hash import MultiIndexHashTable, DEFAULT_MAX_DISTANCE, hash_to_hex, hex_to_hash, hash_image_bytes
+from blob_store import BlobStore
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///plant_identification.db')
+# Set DATABASE_ECHO=1 to log every SQL statement
+DATABASE_ECHO = os.environ.get('DATABASE_ECHO', '0') == '1'
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # readers no longer block the writer (and vice versa)
+    'synchronous': 'NORMAL',  # safe with WAL; fsync at checkpoints instead of every commit
+    'busy_timeout': 5000,  # wait for the write lock instead of failing immediately
+    'cache_size': -20000,  # 20 MB page cache
+    'temp_store': 'MEMORY',
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+def create_database_engine(url=DATABASE_URL, echo=DATABASE_ECHO, pragmas=None, **kwargs):
+    """Create an engine; SQLite connections get SQLITE_PRAGMAS (or the given pragmas)"""
+    engine = create_engine(url, echo=echo, **kwargs)
+    if engine.dialect.name == 'sqlite':
+        pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+        @event.listens_for(engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+    return engine
 
 # Create database engine
-engine = create_engine('sqlite:///plant_identification.db', echo=True)
+engine = create_database_engine()
 Base = declarative_base()
 Session = sessionmaker(bind=engine)
 
+# Uploaded images live on disk, addressed by content hash; rows only reference them
+blob_store = BlobStore()
+
 class IdentificationHistory(Base):
     __tablename__ = 'identification_history'
 
     id = Column(Integer, primary_key=True)
     plant_name = Column(String(50))
-    confidence_score = Column(Float)
+    confidence_score = Column(Float, index=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
-    image_data = Column(LargeBinary)  # Store the actual image data
+    image_sha256 = Column(String(64))  # Blob store key of the uploaded image
+    image_hash = Column(String(16))  # Perceptual hash (hex) for near-duplicate lookup
+
+    # Match the (timestamp, id) keyset order of the history queries, overall and per plant
+    __table_args__ = (
+        Index('ix_identification_history_timestamp_id', 'timestamp', 'id'),
+        Index('ix_identification_history_plant_timestamp_id', 'plant_name', 'timestamp', 'id'),
+    )
 
     def __repr__(self):
         return f"<Identification(plant='{self.plant_name}', confidence={self.confidence_score}%)>"
 
+def _add_missing_columns():
+    """Add columns introduced after a database file was created (create_all only adds tables)"""
+    existing = {column['name'] for column in inspect(engine).get_columns(IdentificationHistory.__tablename__)}
+    with engine.begin() as connection:
+        for column in IdentificationHistory.__table__.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(
+                    f"ALTER TABLE {IdentificationHistory.__tablename__} ADD COLUMN {column.name} {column_type}"
+                ))
+
+def _create_missing_indexes():
+    """Create indexes introduced after a database file was created"""
+    for index in IdentificationHistory.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+def migrate_image_blobs(batch_size=100):
+    """Move images stored inline in the legacy image_data column into the blob store
+
+    Rows are migrated in batches, their perceptual hash is filled in if missing,
+    and the column is dropped afterwards (on SQLite 3.35+; older versions keep
+    it, emptied). Safe to re-run.
+    """
+    table = IdentificationHistory.__tablename__
+    columns = {column['name'] for column in inspect(engine).get_columns(table)}
+    if 'image_data' not in columns:
+        return 0
+
+    migrated = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(text(
+                f"SELECT id, image_data FROM {table} WHERE image_data IS NOT NULL LIMIT :limit"
+            ), {"limit": batch_size}).fetchall()
+            for row_id, image_data in rows:
+                image_hash = hash_image_bytes(bytes(image_data))
+                connection.execute(text(
+                    f"UPDATE {table} SET image_sha256 = :sha, image_data = NULL, "
+                    f"image_hash = COALESCE(image_hash, :phash) WHERE id = :id"
+                ), {
+                    "sha": blob_store.put(bytes(image_data)),
+                    "phash": hash_to_hex(image_hash) if image_hash is not None else None,
+                    "id": row_id
+                })
+        migrated += len(rows)
+        if len(rows) < batch_size:
+            break
+
+    can_drop_column = sqlite3.sqlite_version_info >= (3, 35, 0)
+    if migrated == 0 and not can_drop_column:
+        # The emptied column stays on older SQLite, so every start after the migration ends up here
+        return 0
+    if can_drop_column:
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN image_data"))
+        with engine.connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    print(f"Moved {migrated} stored images into the blob store")
+    return migrated
+
 # Create all tables
 Base.metadata.create_all(engine)
+_add_missing_columns()
+_create_missing_indexes()
+migrate_image_blobs()
 
-def add_identification(plant_name: str, confidence: float, image_data: bytes):
-    """Add a new identification record with image to the database"""
-    session = Session()
+# In-memory near-duplicate index over identification_history, built on first use
+_hash_index = None
+_hash_index_lock = threading.Lock()
+
+def _get_hash_index():
+    global _hash_index
+    with _hash_index_lock:
+        if _hash_index is None:
+            index = MultiIndexHashTable()
+            session = Session()
+            try:
+                rows = session.query(
+                    IdentificationHistory.image_hash,
+                    IdentificationHistory.plant_name,
+                    IdentificationHistory.confidence_score
+                ).filter(IdentificationHistory.image_hash.isnot(None))\
+                    .order_by(IdentificationHistory.id.asc())\
+                    .all()
+            finally:
+                session.close()
+            # Later rows overwrite earlier ones, so each hash maps to its newest result
+            for image_hash, plant_name, confidence in rows:
+                index.add(hex_to_hash(image_hash), (plant_name, confidence))
+            _hash_index = index
+        return _hash_index
+
+def _new_record(plant_name, confidence, image_data, image_hash):
+    return IdentificationHistory(
+        plant_name=plant_name,
+        confidence_score=confidence,
+        image_sha256=blob_store.put(image_data) if image_data else None,
+        image_hash=hash_to_hex(image_hash) if image_hash is not None else None
+    )
+
+def _index_records(records):
+    """Make newly committed records visible to near-duplicate lookups"""
+    for plant_name, confidence, _, image_hash in records:
+        if image_hash is not None:
+            _get_hash_index().add(image_hash, (plant_name, confidence))
+
+def add_identifications(records, session_factory=None):
+    """Insert many (plant_name, confidence, image_data, image_hash) records in one transaction"""
+    session = (session_factory or Session)()
     try:
-        new_record = IdentificationHistory(
-            plant_name=plant_name,
-            confidence_score=confidence,
-            image_data=image_data
-        )
-        session.add(new_record)
+        session.add_all([_new_record(*record) for record in records])
         session.commit()
+        _index_records(records)
         return True
     except Exception as e:
         session.rollback()
-        print(f"Error adding record: {e}")
+        print(f"Error adding records: {e}")
         return False
     finally:
         session.close()
 
+def add_identification(plant_name: str, confidence: float, image_data: bytes, image_hash: int = None):
+    """Add a new identification record to the database, storing its image in the blob store"""
+    return add_identifications([(plant_name, confidence, image_data, image_hash)])
+
+_STOP = object()
+
+class IdentificationWriter:
+    """Background write-behind queue that commits identifications in batches
+
+    Records submitted from any thread are grouped into one transaction of up to
+    max_batch_size records, or whatever arrived within max_latency_ms of the
+    oldest pending record, so concurrent sessions stop contending for the
+    SQLite write lock one commit at a time.
+    """
+
+    def __init__(self, max_batch_size=100, max_latency_ms=50.0, session_factory=None):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.session_factory = session_factory
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="identification-writer", daemon=True)
+        self._worker.start()
+
+    def submit(self, plant_name, confidence, image_data, image_hash=None) -> Future:
+        """Queue a record; the Future resolves to True once it is committed"""
+        future = Future()
+        self._queue.put(((plant_name, confidence, image_data, image_hash), future))
+        return future
+
+    def close(self):
+        """Commit everything still queued and stop the worker"""
+        if self._worker.is_alive():
+            self._queue.put(_STOP)
+            self._worker.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        # Skip records whose callers cancelled them while queued
+        active = [(record, future) for record, future in batch if future.set_running_or_notify_cancel()]
+        if not active:
+            return
+        try:
+            ok = add_identifications([record for record, _ in active], self.session_factory)
+        except Exception as e:
+            # Fail this batch's futures rather than the worker, which later records still need
+            for _, future in active:
+                future.set_exception(e)
+            return
+        for _, future in active:
+            future.set_result(ok)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def queue_identification(plant_name: str, confidence: float, image_data: bytes, image_hash: int = None) -> Future:
+    """Record an identification through the shared write-behind queue without waiting for the commit"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = IdentificationWriter()
+            atexit.register(_writer.close)
+    return _writer.submit(plant_name, confidence, image_data, image_hash)
+
+def find_near_duplicate(image_hash: int, max_distance: int = DEFAULT_MAX_DISTANCE):
+    """Return (plant_name, confidence) of the closest stored near-duplicate image, or None"""
+    match = _get_hash_index().nearest(image_hash, max_distance)
+    if match is None:
+        return None
+    distance, _, result = match
+    print(f"Found near-duplicate identification at hamming distance {distance}")
+    return result
+
+def _filter_history(query, plant_name=None, min_confidence=None, max_confidence=None, since=None, until=None):
+    if plant_name is not None:
+        query = query.filter(IdentificationHistory.plant_name == plant_name)
+    if min_confidence is not None:
+        query = query.filter(IdentificationHistory.confidence_score >= min_confidence)
+    if max_confidence is not None:
+        query = query.filter(IdentificationHistory.confidence_score <= max_confidence)
+    if since is not None:
+        query = query.filter(IdentificationHistory.timestamp >= since)
+    if until is not None:
+        query = query.filter(IdentificationHistory.timestamp < until)
+    return query
+
+def get_identifications_page(limit: int = 20, cursor=None, plant_name: str = None,
+                             min_confidence: float = None, max_confidence: float = None,
+                             since: datetime = None, until: datetime = None, session_factory=None):
+    """One page of identification history, newest first
+
+    Returns (records, next_cursor). Pass next_cursor back to get the following
+    page; it is None on the last page. Pages are found by seeking to the
+    (timestamp, id) cursor in an index rather than skipping rows with OFFSET,
+    so every page costs the same however deep it is.
+    """
+    session = (session_factory or Session)()
+    try:
+        query = _filter_history(session.query(IdentificationHistory), plant_name,
+                                min_confidence, max_confidence, since, until)
+        if cursor is not None:
+            query = query.filter(
+                tuple_(IdentificationHistory.timestamp, IdentificationHistory.id) < tuple_(*cursor)
+            )
+        records = query.order_by(IdentificationHistory.timestamp.desc(), IdentificationHistory.id.desc())\
+            .limit(limit + 1)\
+            .all()
+        if len(records) <= limit:
+            return records, None
+        records = records[:limit]
+        return records, (records[-1].timestamp, records[-1].id)
+    finally:
+        session.close()
+
 def get_recent_identifications(limit: int = 5):
-    """Get recent identification history including images"""
-    session = Session()
+    """Get recent identification history (image bytes stay in the blob store)"""
+    records, _ = get_identifications_page(limit)
+    return records
+
+def get_daily_plant_counts(plant_name: str = None, since: datetime = None, until: datetime = None,
+                           session_factory=None):
+    """Identifications per plant per day as (day, plant_name, count, average confidence), oldest day first"""
+    session = (session_factory or Session)()
     try:
-        records = session.query(IdentificationHistory)\
-            .order_by(IdentificationHistory.timestamp.desc())\
-            .limit(limit)\
+        day = func.date(IdentificationHistory.timestamp)
+        query = session.query(
+            day,
+            IdentificationHistory.plant_name,
+            func.count(IdentificationHistory.id),
+            func.avg(IdentificationHistory.confidence_score)
+        )
+        query = _filter_history(query, plant_name, since=since, until=until)
+        return query.group_by(day, IdentificationHistory.plant_name)\
+            .order_by(day, IdentificationHistory.plant_name)\
             .all()
-        return records
     finally:
         session.close()
 
-def get_identification_image(id: int) -> bytes:
-    """Retrieve image data for a specific identification"""
+def _get_image_sha256(id: int):
     session = Session()
     try:
-        record = session.query(IdentificationHistory).get(id)
-        return record.image_data if record else None
+        return session.query(IdentificationHistory.image_sha256)\
+            .filter(IdentificationHistory.id == id)\
+            .scalar()
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+def get_identification_image(id: int) -> bytes:
+    """Retrieve image data for a specific identification"""
+    image_sha256 = _get_image_sha256(id)
+    return blob_store.get(image_sha256) if image_sha256 else None
+
+def get_identification_thumbnail(id: int) -> bytes:
+    """Retrieve the JPEG thumbnail for a specific identification"""
+    image_sha256 = _get_image_sha256(id)
+    return blob_store.get_thumbnail(image_sha256) if image_sha256 else None
+
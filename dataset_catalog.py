@@ -0,0 +1,241 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from sqlalchemy import create_engine, func, Boolean, Column, Integer, String
+from sqlalchemy.orm import declarative_base, sessionmaker
+from dataset_ingest import IMAGE_EXTENSIONS
+
+DEFAULT_DATA_DIR = 'data/training'
+# Kept inside the dataset directory, next to the class folders it describes
+CATALOG_FILENAME = '.catalog.db'
+
+CatalogBase = declarative_base()
+
+
+class CatalogImage(CatalogBase):
+    __tablename__ = 'images'
+
+    path = Column(String, primary_key=True)
+    label = Column(String(50), index=True)
+    size = Column(Integer)
+    mtime_ns = Column(Integer)
+    width = Column(Integer)
+    height = Column(Integer)
+    content_hash = Column(String(64), index=True)  # SHA-256 of the file
+    valid = Column(Boolean, default=True)  # False if the file is not a readable image
+
+    def __repr__(self):
+        return f"<CatalogImage(path='{self.path}', label='{self.label}', {self.width}x{self.height})>"
+
+
+class CatalogClass(CatalogBase):
+    """Per-class totals, kept up to date by refresh() so reads never scan the images table"""
+    __tablename__ = 'classes'
+
+    label = Column(String(50), primary_key=True)
+    directory_mtime_ns = Column(Integer)
+    images = Column(Integer, default=0)
+    invalid = Column(Integer, default=0)
+    total_bytes = Column(Integer, default=0)
+
+    def __repr__(self):
+        return f"<CatalogClass(label='{self.label}', images={self.images})>"
+
+
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _header_dimensions(data):
+    """(width, height) from a PNG or JPEG header, or None"""
+    if data.startswith(b'\x89PNG\r\n\x1a\n') and len(data) >= 24:
+        return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    if data.startswith(b'\xff\xd8'):
+        position = 2
+        while position + 9 <= len(data):
+            if data[position] != 0xFF:
+                return None
+            marker = data[position + 1]
+            if marker == 0xFF:  # fill byte
+                position += 1
+                continue
+            if marker in _JPEG_SOF_MARKERS:
+                height = int.from_bytes(data[position + 5:position + 7], 'big')
+                width = int.from_bytes(data[position + 7:position + 9], 'big')
+                return width, height
+            position += 2 + int.from_bytes(data[position + 2:position + 4], 'big')
+    return None
+
+
+def _describe(path):
+    """(content_hash, width, height, valid) of an image file"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        print(f"Error reading {path}: {e}")
+        return None, None, None, False
+    dimensions = _header_dimensions(data)
+    if dimensions is None:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        dimensions = (image.shape[1], image.shape[0]) if image is not None else None
+        valid = dimensions is not None
+    else:
+        # A readable header says nothing about the rest of the file; a 1/8-scale decode checks it cheaply
+        valid = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8) is not None
+    width, height = dimensions or (None, None)
+    return hashlib.sha256(data).hexdigest(), width, height, valid
+
+
+class DatasetCatalog:
+    """SQLite index of the training images under data_dir/<class>/
+
+    Records each image's path, class, size, dimensions and content hash, and
+    per-class totals. refresh() only lists class directories whose mtime
+    changed (files were added, removed or renamed) and only reads files whose
+    size or mtime changed, so keeping it current costs one stat per class.
+    Files overwritten in place do not change their directory's mtime; pass
+    full=True to stat every file.
+    """
+
+    def __init__(self, data_dir=DEFAULT_DATA_DIR, path=None):
+        os.makedirs(data_dir, exist_ok=True)
+        path = path or os.path.join(data_dir, CATALOG_FILENAME)
+        self.data_dir = data_dir
+        self.engine = create_engine(f'sqlite:///{path}')
+        CatalogBase.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self._lock = threading.Lock()
+
+    def _class_directories(self):
+        with os.scandir(self.data_dir) as entries:
+            return {entry.name: entry for entry in entries if entry.is_dir()}
+
+    def refresh(self, full=False, classes=None, workers=None):
+        """Bring the catalog up to date with the files on disk
+
+        classes limits a full refresh to those class names. Returns counts of
+        added, updated, removed and unchanged images.
+        """
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        with self._lock:
+            session = self.Session()
+            try:
+                directories = self._class_directories()
+                known = {record.label: record for record in session.query(CatalogClass)}
+
+                for label in set(known) - set(directories):
+                    stats['removed'] += session.query(CatalogImage).filter(CatalogImage.label == label).delete()
+                    session.delete(known.pop(label))
+
+                for label, entry in sorted(directories.items()):
+                    directory_mtime_ns = entry.stat().st_mtime_ns
+                    record = known.get(label)
+                    check_files = full and (classes is None or label in classes)
+                    if record is not None and record.directory_mtime_ns == directory_mtime_ns and not check_files:
+                        continue
+                    self._refresh_class(session, label, entry.path, stats, workers)
+                    if record is None:
+                        record = CatalogClass(label=label)
+                        session.add(record)
+                    record.directory_mtime_ns = directory_mtime_ns
+                    record.images, record.invalid, record.total_bytes = session.query(
+                        func.count(CatalogImage.path) - func.coalesce(func.sum(~CatalogImage.valid), 0),
+                        func.coalesce(func.sum(~CatalogImage.valid), 0),
+                        func.coalesce(func.sum(CatalogImage.size), 0)
+                    ).filter(CatalogImage.label == label).one()
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        if stats['added'] or stats['updated'] or stats['removed']:
+            print("Dataset catalog: " + ", ".join(f"{count} {name}" for name, count in stats.items()))
+        return stats
+
+    def _refresh_class(self, session, label, directory, stats, workers):
+        # Plain tuples rather than ORM objects: most files are unchanged, and this runs per file
+        existing = {path: (size, mtime_ns) for path, size, mtime_ns in session.query(
+            CatalogImage.path, CatalogImage.size, CatalogImage.mtime_ns).filter(CatalogImage.label == label)}
+        pending = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not (entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)):
+                    continue
+                stat = entry.stat()
+                known = existing.pop(entry.path, None)
+                if known == (stat.st_size, stat.st_mtime_ns):
+                    stats['unchanged'] += 1
+                    continue
+                pending.append((entry.path, stat, known is not None))
+
+        removed = list(existing)
+        for start in range(0, len(removed), 500):
+            session.query(CatalogImage).filter(CatalogImage.path.in_(removed[start:start + 500]))\
+                .delete(synchronize_session=False)
+        stats['removed'] += len(removed)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            descriptions = executor.map(_describe, [path for path, _, _ in pending])
+            for (path, stat, known), (content_hash, width, height, valid) in zip(pending, descriptions):
+                stats['updated' if known else 'added'] += 1
+                record = CatalogImage(
+                    path=path, label=label, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                    content_hash=content_hash, width=width, height=height, valid=valid
+                )
+                # merge() looks the row up first, which only changed files need
+                if known:
+                    session.merge(record)
+                else:
+                    session.add(record)
+        session.flush()
+
+    def class_stats(self):
+        """{class: {'images', 'invalid', 'total_bytes'}} from the per-class totals"""
+        session = self.Session()
+        try:
+            return {record.label: {'images': record.images, 'invalid': record.invalid,
+                                   'total_bytes': record.total_bytes}
+                    for record in session.query(CatalogClass).order_by(CatalogClass.label)}
+        finally:
+            session.close()
+
+    def class_counts(self):
+        """{class: number of readable images}"""
+        return {label: stats['images'] for label, stats in self.class_stats().items()}
+
+    def files(self, labels=None):
+        """(paths, labels) of every readable image, ordered by path"""
+        session = self.Session()
+        try:
+            query = session.query(CatalogImage.path, CatalogImage.label).filter(CatalogImage.valid.is_(True))
+            if labels is not None:
+                query = query.filter(CatalogImage.label.in_(labels))
+            rows = query.order_by(CatalogImage.path).all()
+        finally:
+            session.close()
+        return [path for path, _ in rows], [label for _, label in rows]
+
+    def content_hashes(self):
+        """{path: SHA-256} of every readable image"""
+        session = self.Session()
+        try:
+            return dict(session.query(CatalogImage.path, CatalogImage.content_hash)
+                        .filter(CatalogImage.valid.is_(True)))
+        finally:
+            session.close()
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(data_dir=DEFAULT_DATA_DIR) -> DatasetCatalog:
+    """Process-wide catalog for data_dir, created on first use"""
+    with _catalogs_lock:
+        if data_dir not in _catalogs:
+            _catalogs[data_dir] = DatasetCatalog(data_dir)
+        return _catalogs[data_dir]
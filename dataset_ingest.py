@@ -0,0 +1,154 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import cv2
+import numpy as np
+from image_processor import decode_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+DEFAULT_WORKERS = 4
+# Members larger than this are skipped rather than inflated into memory
+MAX_MEMBER_BYTES = 50 * 1024 * 1024
+
+_JPEG_MAGIC = b'\xff\xd8\xff'
+_PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+
+def is_image_member(info):
+    name = info.filename
+    basename = os.path.basename(name)
+    return (not info.is_dir()
+            and not name.startswith('__MACOSX/')
+            and not basename.startswith('._')
+            and basename.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _write_atomic(path, data):
+    """Write via a temporary file, so a half-written image never appears in the dataset"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+class _Ingester:
+    """Validates and stores member bytes; called from the worker pool"""
+
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+        self._claimed = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, data):
+        timings = {}
+        start = time.perf_counter()
+        content_hash = hashlib.sha256(data).hexdigest()
+        # A 1/8-scale decode still reads the whole stream, so it catches corrupt files cheaply
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_COLOR_8)
+        timings['validate'] = time.perf_counter() - start
+        if image is None:
+            return 'invalid', timings
+
+        # JPEG and PNG bytes are stored as uploaded; anything else is normalized to JPEG
+        if data.startswith(_JPEG_MAGIC):
+            extension = '.jpg'
+        elif data.startswith(_PNG_MAGIC):
+            extension = '.png'
+        else:
+            start = time.perf_counter()
+            ok, encoded = cv2.imencode('.jpg', decode_image(data), [cv2.IMWRITE_JPEG_QUALITY, 95])
+            timings['normalize'] = time.perf_counter() - start
+            if not ok:
+                return 'invalid', timings
+            data, extension = encoded.tobytes(), '.jpg'
+
+        save_path = os.path.join(self.save_dir, content_hash[:32] + extension)
+        with self._lock:
+            duplicate = content_hash in self._claimed or os.path.exists(save_path)
+            self._claimed.add(content_hash)
+        if duplicate:
+            return 'duplicate', timings
+
+        start = time.perf_counter()
+        _write_atomic(save_path, data)
+        timings['write'] = time.perf_counter() - start
+        return 'saved', timings
+
+
+def ingest_zip(zip_file, save_dir, workers=DEFAULT_WORKERS, on_progress=None):
+    """Extract the images in a ZIP archive into save_dir
+
+    zip_file may be a path or a seekable file object (such as a Streamlit
+    upload); members are inflated one at a time as they are needed rather than
+    reading the archive into memory. Decoding, validation and writing run on
+    `workers` threads, with at most a few members per worker in flight. Images
+    are saved under a content-hash name, so identical images are stored once
+    and different images with the same name no longer overwrite each other.
+    on_progress(done, total) is called from the calling thread.
+
+    Returns counts of saved, duplicate, invalid and skipped members plus the
+    seconds spent in each stage (worker stages are summed over threads).
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    stats = {'members': 0, 'saved': 0, 'duplicate': 0, 'invalid': 0, 'skipped': 0, 'bytes_read': 0}
+    timings = {'read': 0.0, 'validate': 0.0, 'normalize': 0.0, 'write': 0.0}
+    ingest = _Ingester(save_dir)
+    start = time.perf_counter()
+
+    with zipfile.ZipFile(zip_file) as archive, ThreadPoolExecutor(max_workers=workers) as executor:
+        members = [info for info in archive.infolist() if is_image_member(info)]
+        stats['members'] = len(members)
+        pending = set()
+        done_count = 0
+
+        def finish(outcome):
+            nonlocal done_count
+            stats[outcome] += 1
+            done_count += 1
+            if on_progress is not None:
+                on_progress(done_count, len(members))
+
+        def collect(done):
+            for future in done:
+                try:
+                    outcome, stage_timings = future.result()
+                except Exception as e:
+                    print(f"Error ingesting image: {str(e)}")
+                    outcome, stage_timings = 'invalid', {}
+                for stage, seconds in stage_timings.items():
+                    timings[stage] += seconds
+                finish(outcome)
+
+        for info in members:
+            if info.file_size > MAX_MEMBER_BYTES:
+                finish('skipped')
+                continue
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            read_start = time.perf_counter()
+            try:
+                data = archive.read(info)
+            except (zipfile.BadZipFile, zlib.error) as e:
+                print(f"Error reading {info.filename}: {str(e)}")
+                finish('invalid')
+                continue
+            finally:
+                timings['read'] += time.perf_counter() - read_start
+            stats['bytes_read'] += len(data)
+            pending.add(executor.submit(ingest, data))
+        collect(wait(pending).done)
+
+    stats['elapsed_seconds'] = time.perf_counter() - start
+    stats['images_per_second'] = stats['members'] / stats['elapsed_seconds'] if stats['elapsed_seconds'] else 0.0
+    stats['stage_seconds'] = timings
+    return stats
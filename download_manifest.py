@@ -0,0 +1,152 @@
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import create_engine, func, Column, Integer, String, DateTime
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+DEFAULT_MANIFEST_PATH = 'data/download_manifest.db'
+MAX_ATTEMPTS = 3
+
+# Download states; everything but PENDING and FAILED is final
+PENDING = 'pending'
+DONE = 'done'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+FAILED = 'failed'
+
+ManifestBase = declarative_base()
+
+
+class DownloadRecord(ManifestBase):
+    __tablename__ = 'downloads'
+
+    url = Column(String, primary_key=True)
+    state = Column(String(16), index=True)
+    target_dir = Column(String, index=True)
+    http_status = Column(Integer)
+    content_hash = Column(String(64), index=True)  # SHA-256 of the downloaded bytes
+    perceptual_hash = Column(String(16), index=True)
+    width = Column(Integer)
+    height = Column(Integer)
+    path = Column(String)
+    attempts = Column(Integer, default=0)
+    error = Column(String)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<DownloadRecord(url='{self.url}', state='{self.state}', path='{self.path}')>"
+
+
+def _is_permanent_failure(record):
+    """Client errors (other than rate limiting) will not succeed on a retry"""
+    status = record.http_status
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+class DownloadManifest:
+    """SQLite record of every URL the scraper has tried and what came of it
+
+    Reruns use it to skip URLs that already succeeded or can never succeed, to
+    resume URLs that were in flight when a run was interrupted, and to drop
+    images whose content (or perceptual hash) is already in the dataset.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH, max_attempts=MAX_ATTEMPTS):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.engine = create_engine(f'sqlite:///{path}')
+        ManifestBase.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.max_attempts = max_attempts
+        # SQLite allows one writer; serializing here also makes claim_content atomic
+        self._lock = threading.Lock()
+
+    def should_skip(self, url):
+        """True if url finished (successfully or permanently) or ran out of attempts"""
+        session = self.Session()
+        try:
+            record = session.get(DownloadRecord, url)
+            if record is None or record.state == PENDING:
+                return False
+            if record.state == FAILED:
+                return _is_permanent_failure(record) or record.attempts >= self.max_attempts
+            return True
+        finally:
+            session.close()
+
+    def pending_urls(self, target_dir):
+        """URLs that were in flight for target_dir when a previous run stopped"""
+        session = self.Session()
+        try:
+            rows = session.query(DownloadRecord.url)\
+                .filter(DownloadRecord.state == PENDING, DownloadRecord.target_dir == target_dir)\
+                .all()
+            return [url for url, in rows]
+        finally:
+            session.close()
+
+    def mark_pending(self, url, target_dir):
+        """Record that a download attempt for url is starting"""
+        with self._lock:
+            session = self.Session()
+            try:
+                record = session.get(DownloadRecord, url) or DownloadRecord(url=url, attempts=0)
+                record.state = PENDING
+                record.target_dir = target_dir
+                record.attempts = (record.attempts or 0) + 1
+                session.merge(record)
+                session.commit()
+            finally:
+                session.close()
+
+    def record(self, url, state, **fields):
+        """Store the outcome of a download attempt"""
+        with self._lock:
+            session = self.Session()
+            try:
+                record = session.get(DownloadRecord, url) or DownloadRecord(url=url, attempts=1)
+                record.state = state
+                for name, value in fields.items():
+                    setattr(record, name, value)
+                session.merge(record)
+                session.commit()
+            finally:
+                session.close()
+
+    def claim_content(self, url, content_hash, perceptual_hash, path, **fields):
+        """Atomically record url as DONE at path, unless the image is already stored
+
+        Returns None if url now owns the image, or the path of the existing copy
+        (identical bytes or identical perceptual hash), in which case url is
+        recorded as a DUPLICATE of it.
+        """
+        with self._lock:
+            session = self.Session()
+            try:
+                existing = session.query(DownloadRecord.path)\
+                    .filter(DownloadRecord.state == DONE)\
+                    .filter((DownloadRecord.content_hash == content_hash) |
+                            (DownloadRecord.perceptual_hash == perceptual_hash))\
+                    .first()
+                record = session.get(DownloadRecord, url) or DownloadRecord(url=url, attempts=1)
+                record.content_hash = content_hash
+                record.perceptual_hash = perceptual_hash
+                for name, value in fields.items():
+                    setattr(record, name, value)
+                if existing is not None:
+                    record.state, record.path = DUPLICATE, existing.path
+                else:
+                    record.state, record.path = DONE, path
+                session.merge(record)
+                session.commit()
+                return existing.path if existing is not None else None
+            finally:
+                session.close()
+
+    def counts(self):
+        """Number of URLs in each state"""
+        session = self.Session()
+        try:
+            return dict(session.query(DownloadRecord.state, func.count(DownloadRecord.url))
+                        .group_by(DownloadRecord.state).all())
+        finally:
+            session.close()
@@ -0,0 +1,310 @@
+import os
+import threading
+import time
+from collections import Counter
+import cv2
+import numpy as np
+from image_processor import preprocess_batch
+
+EMBEDDING_INDEX_PATH = 'models/embedding_index.npz'
+DEFAULT_K = 5
+# Inverted lists probed per query when the index is partitioned
+DEFAULT_N_PROBE = 8
+# Above this many vectors build_embedding_index partitions the index into sqrt(N) lists
+IVF_MIN_VECTORS = 50_000
+# The rejection distance is this quantile of training images' distances to their nearest neighbour
+DEFAULT_REJECT_QUANTILE = 0.99
+KMEANS_ITERATIONS = 10
+_SEARCH_BLOCK_ROWS = 65536
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(similarities, k):
+    """Row indices of the k largest values in each column, best first"""
+    k = min(k, len(similarities))
+    rows = np.argpartition(-similarities, k - 1, axis=0)[:k]
+    order = np.argsort(-np.take_along_axis(similarities, rows, axis=0), axis=0)
+    return np.take_along_axis(rows, order, axis=0)
+
+
+def _spherical_kmeans(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """Unit-length centroids clustering unit vectors by cosine similarity"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = ~sums.any(axis=1)
+        # Restart empty lists on random vectors so every list stays in use
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class EmbeddingIndex:
+    """Cosine k-nearest-neighbour index over image embeddings, with open-set rejection
+
+    Embeddings are L2-normalized and optionally projected onto their top
+    `components` principal directions (which shrinks memory and search time
+    for large collections). Searches are exact, a blocked matrix product over
+    every vector, unless the index is partitioned with n_lists: then an
+    inverted-file (IVF) search only scores the vectors in the n_probe lists
+    whose centroids are closest to the query.
+
+    fit() learns the projection and partition from a sample and must come
+    before add() when either is used. calibrate() sets the distance above
+    which identify() answers "Unknown".
+    """
+
+    def __init__(self, components=None, n_lists=None, n_probe=DEFAULT_N_PROBE):
+        self.components = components
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.mean = None
+        self.projection = None
+        self.centroids = None
+        self.threshold = None
+        self._chunks = []
+        self._vectors = None
+        self._lists = None
+        self._fitted = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(vectors) for vectors, _, _, _ in self._chunks)
+
+    def _project(self, embeddings):
+        vectors = _normalize(embeddings)
+        if self.projection is not None:
+            vectors = _normalize((vectors - self.mean) @ self.projection)
+        return vectors
+
+    def fit(self, sample, seed=0):
+        """Learn the PCA projection and IVF centroids from a representative sample of embeddings"""
+        vectors = _normalize(sample)
+        if self.components is not None and self.components < vectors.shape[1]:
+            self.mean = vectors.mean(axis=0)
+            covariance = np.cov(vectors - self.mean, rowvar=False)
+            _, eigenvectors = np.linalg.eigh(covariance)
+            self.projection = np.ascontiguousarray(eigenvectors[:, ::-1][:, :self.components], dtype=np.float32)
+            vectors = self._project(sample)
+        if self.n_lists:
+            self.n_lists = min(self.n_lists, len(vectors))
+            self.centroids = _spherical_kmeans(vectors, self.n_lists, seed=seed)
+        self._fitted = True
+        return self
+
+    def add(self, embeddings, labels, paths=None):
+        """Index a batch of embeddings with their class labels and (optionally) source image paths"""
+        if (self.components is not None or self.n_lists) and not self._fitted:
+            raise ValueError("Call fit() before add() when using components or n_lists")
+        vectors = self._project(embeddings)
+        labels = np.asarray(labels, dtype=str)
+        paths = np.asarray(paths if paths is not None else [''] * len(vectors), dtype=str)
+        assignments = None
+        if self.centroids is not None:
+            assignments = np.concatenate([
+                np.argmax(vectors[start:start + _SEARCH_BLOCK_ROWS] @ self.centroids.T, axis=1)
+                for start in range(0, len(vectors), _SEARCH_BLOCK_ROWS)
+            ]).astype(np.int32) if len(vectors) else np.zeros(0, dtype=np.int32)
+        with self._lock:
+            self._chunks.append((vectors, labels, paths, assignments))
+            self._vectors = None
+            self._lists = None
+
+    def _consolidate(self):
+        """Join added chunks into contiguous arrays (and inverted lists) on first search"""
+        with self._lock:
+            if self._vectors is None:
+                if len(self._chunks) == 1:
+                    self._vectors, self.labels, self.paths, assignments = self._chunks[0]
+                else:
+                    self._vectors = np.concatenate([chunk[0] for chunk in self._chunks])
+                    self.labels = np.concatenate([chunk[1] for chunk in self._chunks])
+                    self.paths = np.concatenate([chunk[2] for chunk in self._chunks])
+                    assignments = (np.concatenate([chunk[3] for chunk in self._chunks])
+                                   if self.centroids is not None else None)
+                self._chunks = [(self._vectors, self.labels, self.paths, assignments)]
+                if assignments is not None:
+                    order = np.argsort(assignments, kind='stable').astype(np.int32)
+                    offsets = np.searchsorted(assignments[order], np.arange(self.n_lists + 1))
+                    self._lists = (order, offsets)
+            return self._vectors
+
+    def search(self, embeddings, k=DEFAULT_K, exact=None):
+        """(distances, rows), both (len(embeddings), k), of each query's nearest indexed vectors
+
+        Distances are cosine distances (1 - similarity), nearest first. exact
+        defaults to True for unpartitioned indexes and False otherwise.
+        """
+        vectors = self._consolidate()
+        queries = self._project(np.atleast_2d(embeddings))
+        k = min(k, len(vectors))
+        if exact is None:
+            exact = self._lists is None
+        if exact:
+            best_rows = np.zeros((0, len(queries)), dtype=np.int64)
+            best_similarities = np.zeros((0, len(queries)), dtype=np.float32)
+            for start in range(0, len(vectors), _SEARCH_BLOCK_ROWS):
+                similarities = vectors[start:start + _SEARCH_BLOCK_ROWS] @ queries.T
+                rows = _top_k(similarities, k)
+                best_rows = np.concatenate([best_rows, rows + start])
+                best_similarities = np.concatenate([best_similarities, np.take_along_axis(similarities, rows, axis=0)])
+            order = _top_k(best_similarities, k)
+            rows = np.take_along_axis(best_rows, order, axis=0).T
+            similarities = np.take_along_axis(best_similarities, order, axis=0).T
+            return 1.0 - similarities, rows
+
+        order, offsets = self._lists
+        probes = _top_k(self.centroids @ queries.T, min(self.n_probe, self.n_lists)).T
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        result_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, (query, lists) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([order[offsets[list_id]:offsets[list_id + 1]] for list_id in lists])
+            if not len(candidates):
+                continue
+            similarities = vectors[candidates] @ query
+            top = _top_k(similarities[:, np.newaxis], k)[:, 0]
+            distances[i, :len(top)] = 1.0 - similarities[top]
+            result_rows[i, :len(top)] = candidates[top]
+        return distances, result_rows
+
+    def calibrate(self, quantile=DEFAULT_REJECT_QUANTILE, samples=2000, seed=0):
+        """Set the rejection threshold from indexed vectors' distances to their nearest other vector"""
+        vectors = self._consolidate()
+        if len(vectors) < 2:
+            return None
+        rows = np.random.default_rng(seed).choice(len(vectors), min(samples, len(vectors)), replace=False)
+        # Indexed vectors are already projected, so they are scored directly rather than through search()
+        queries = vectors[rows]
+        best = np.full(len(rows), -np.inf, dtype=np.float32)
+        for start in range(0, len(vectors), 8192):
+            scores = vectors[start:start + 8192] @ queries.T
+            inside = (rows >= start) & (rows < start + len(scores))
+            scores[rows[inside] - start, np.nonzero(inside)[0]] = -np.inf  # not its own neighbour
+            best = np.maximum(best, scores.max(axis=0))
+        self.threshold = float(np.quantile(1.0 - best, quantile))
+        return self.threshold
+
+    def identify(self, embedding, k=DEFAULT_K):
+        """Nearest reference images for one embedding and the class they vote for
+
+        Returns a dict with plant_name ("Unknown" when the nearest reference is
+        farther than the calibrated threshold), distance to the nearest
+        reference, known, and neighbours as (path, label, distance) tuples.
+        """
+        distances, rows = self.search(embedding, k)
+        neighbours = [(str(self.paths[row]), str(self.labels[row]), float(distance))
+                      for row, distance in zip(rows[0], distances[0]) if row >= 0]
+        if not neighbours:
+            return {'plant_name': 'Unknown', 'distance': None, 'known': False, 'neighbours': []}
+        votes = Counter(label for _, label, _ in neighbours)
+        # Most votes wins; ties go to the label with the nearer neighbour
+        plant_name = max(votes, key=lambda label: (votes[label], -min(d for _, l, d in neighbours if l == label)))
+        distance = neighbours[0][2]
+        known = self.threshold is None or distance <= self.threshold
+        return {'plant_name': plant_name if known else 'Unknown', 'distance': distance, 'known': known,
+                'neighbours': neighbours}
+
+    def memory_bytes(self):
+        vectors = self._consolidate()
+        total = vectors.nbytes + self.labels.nbytes + self.paths.nbytes
+        for array in (self.mean, self.projection, self.centroids):
+            if array is not None:
+                total += array.nbytes
+        if self._lists is not None:
+            total += self._lists[0].nbytes + self._lists[1].nbytes
+        return total
+
+    def save(self, path=EMBEDDING_INDEX_PATH):
+        vectors = self._consolidate()
+        arrays = {'vectors': vectors, 'labels': self.labels, 'paths': self.paths,
+                  'settings': np.array([self.components or 0, self.n_lists or 0, self.n_probe,
+                                        np.nan if self.threshold is None else self.threshold], dtype=np.float64)}
+        for name in ('mean', 'projection', 'centroids'):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        if self._lists is not None:
+            arrays['assignments'] = self._chunks[0][3]
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path=EMBEDDING_INDEX_PATH):
+        with np.load(path) as data:
+            components, n_lists, n_probe, threshold = data['settings']
+            index = cls(int(components) or None, int(n_lists) or None, int(n_probe))
+            index.threshold = None if np.isnan(threshold) else float(threshold)
+            index._fitted = True
+            for name in ('mean', 'projection', 'centroids'):
+                if name in data:
+                    setattr(index, name, data[name])
+            assignments = data['assignments'] if 'assignments' in data else None
+            index._chunks = [(data['vectors'], data['labels'], data['paths'], assignments)]
+        return index
+
+
+def build_embedding_index(model_tuple, data_dir='data/training', components=None, n_lists=None,
+                          batch_size=64, path=EMBEDDING_INDEX_PATH):
+    """Embed every training image with the classifier, index them, calibrate and save to path
+
+    n_lists defaults to sqrt(N) inverted lists once there are IVF_MIN_VECTORS
+    images, and to an exact index below that.
+    """
+    from model_utils import predict_embeddings
+    from train_model import iter_training_files
+
+    model, _ = model_tuple
+    start = time.perf_counter()
+    paths, labels, embeddings = [], [], []
+    files = list(iter_training_files(data_dir))
+    for offset in range(0, len(files), batch_size):
+        images, batch_files = [], []
+        for image_path, plant_class in files[offset:offset + batch_size]:
+            image = cv2.imread(image_path)
+            if image is not None:
+                images.append(image)
+                batch_files.append((image_path, plant_class))
+        if not images:
+            continue
+        batch_embeddings, _ = predict_embeddings(model, preprocess_batch(images), batch_size)
+        embeddings.append(batch_embeddings)
+        paths.extend(path for path, _ in batch_files)
+        labels.extend(label for _, label in batch_files)
+    if not embeddings:
+        raise ValueError(f"No training images found in {data_dir} to index")
+    embeddings = np.concatenate(embeddings)
+
+    if n_lists is None and len(embeddings) >= IVF_MIN_VECTORS:
+        n_lists = int(np.sqrt(len(embeddings)))
+    index = EmbeddingIndex(components=components, n_lists=n_lists)
+    if components is not None or n_lists:
+        index.fit(embeddings)
+    index.add(embeddings, labels, paths)
+    index.calibrate()
+    if path:
+        index.save(path)
+    # Fewer than two images leave nothing to calibrate against
+    threshold = f"{index.threshold:.3f}" if index.threshold is not None else "not calibrated"
+    print(f"Indexed {len(index)} training images in {time.perf_counter() - start:.1f} s "
+          f"(rejection distance {threshold})")
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_embedding_index(path=EMBEDDING_INDEX_PATH, reload=False):
+    """Process-wide index loaded from path on first use, or None if it has not been built"""
+    global _index
+    with _index_lock:
+        if (_index is None or reload) and os.path.exists(path):
+            _index = EmbeddingIndex.load(path)
+        return _index
@@ -1,8 +1,56 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 
-def preprocess_image(image):
-    """Enhanced image preprocessing optimized for plant features"""
+TARGET_SIZE = (128, 128)
+# Fast mode shrinks inputs so their longest edge is at most this before enhancing them
+FAST_MAX_EDGE = 256
+
+# JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding, for a fraction of the cost
+_REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+# CLAHE objects keep internal state, so each worker thread gets its own
+_thread_local = threading.local()
+
+def decode_image(image_bytes, fast=False, min_edge=FAST_MAX_EDGE):
+    """Decode encoded image bytes to a BGR array (None if they are not an image)
+
+    With fast=True, large JPEGs are decoded at 1/2, 1/4 or 1/8 scale, as far as
+    the result still has a long edge of at least min_edge.
+    """
+    image_array = np.frombuffer(image_bytes, dtype=np.uint8)
+    if not fast:
+        return cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+
+    # A 1/8-scale decode is nearly free and tells us roughly how big the full image is
+    smallest = cv2.imdecode(image_array, cv2.IMREAD_REDUCED_COLOR_8)
+    if smallest is None:
+        return None
+    full_edge = max(smallest.shape[:2]) * 8
+    for factor, flag in _REDUCED_DECODE_FLAGS:
+        if full_edge // factor >= min_edge:
+            return smallest if factor == 8 else cv2.imdecode(image_array, flag)
+    return cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+
+def downscale_image(image, max_edge=FAST_MAX_EDGE):
+    """Shrink an image with area interpolation so its longest edge is at most max_edge"""
+    height, width = image.shape[:2]
+    scale = max_edge / max(height, width)
+    if scale >= 1:
+        return image
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+def enhance_image(image, fast=False):
+    """Enhancement and resize steps of preprocess_image, returning a 128x128 uint8 RGB image"""
+    if fast:
+        image = downscale_image(image)
+
     # Convert to RGB
     image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
@@ -20,7 +68,60 @@ def preprocess_image(image):
     # Resize to match training size (increased for better detail)
     resized = cv2.resize(blurred, (128, 128))
 
+    return resized
+
+def preprocess_image(image, fast=False):
+    """Enhanced image preprocessing optimized for plant features
+
+    fast=True downsamples large images before enhancing them, so the cost no
+    longer grows with input resolution (results differ slightly from full
+    resolution processing).
+    """
     # Normalize pixel values
-    normalized = resized.astype(np.float32) / 255.0
+    normalized = enhance_image(image, fast).astype(np.float32) / 255.0
+
+    return normalized
+
+def _clahe():
+    clahe = getattr(_thread_local, "clahe", None)
+    if clahe is None:
+        clahe = _thread_local.clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
+    return clahe
+
+def _enhance_into(image, out, fast=False):
+    """enhance_image() writing its result into a preallocated 128x128x3 uint8 buffer"""
+    if fast:
+        image = downscale_image(image)
+    # BGR->LAB directly gives the same result as BGR->RGB->LAB without the intermediate copy
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    l = cv2.extractChannel(lab, 0)
+    cv2.insertChannel(_clahe().apply(l), lab, 0)
+    enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+    cv2.GaussianBlur(enhanced, (3,3), 0, dst=enhanced)
+    cv2.resize(enhanced, TARGET_SIZE, dst=out)
+
+def preprocess_batch(images, out=None, workers=None, fast=False):
+    """Preprocess a list of decoded BGR images into an (N, 128, 128, 3) float32 array
+
+    Produces the same values as preprocess_image() for each image. The OpenCV
+    steps run on a thread pool (OpenCV releases the GIL) and write into one
+    preallocated uint8 buffer, which is then normalized in a single vectorized
+    operation into out (allocated if not given). Pass workers=1 to stay on the
+    calling thread, and fast=True for the downsample-first mode of preprocess_image.
+    """
+    count = len(images)
+    enhanced = np.empty((count, TARGET_SIZE[1], TARGET_SIZE[0], 3), dtype=np.uint8)
+    if out is None:
+        out = np.empty(enhanced.shape, dtype=np.float32)
+    elif out.shape != enhanced.shape or out.dtype != np.float32:
+        raise ValueError(f"out must be a float32 array of shape {enhanced.shape}")
+
+    if workers == 1 or count <= 1:
+        for image, slot in zip(images, enhanced):
+            _enhance_into(image, slot, fast)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_enhance_into, images, enhanced, [fast] * count))
 
-    return normalized
\ No newline at end of file
+    np.divide(enhanced, np.float32(255.0), out=out)
+    return out
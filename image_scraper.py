@@ -1,93 +1,461 @@
 import os
+import time
+import random
+import threading
 import requests
 import hashlib
-from urllib.parse import urljoin
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urljoin, urlparse, quote
+from requests.adapters import HTTPAdapter
 import cv2
-import numpy as np
-import trafilatura
 from bs4 import BeautifulSoup
+from perceptual_hash import phash, hash_to_hex
+from download_manifest import DownloadManifest, FAILED, INVALID
+from plant_info import PLANT_CLASSES
 
-def download_image(url, save_path):
-    """Download and validate image from URL"""
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 8.0
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+
+# Search terms and Wikimedia Commons categories per dataset class; classes not
+# listed here are searched by their folder name
+CLASS_SEARCH_TERMS = {
+    'Tulsi': ('tulsi holy basil', 'Ocimum_tenuiflorum'),
+    'Neem': ('neem tree leaves', 'Azadirachta_indica'),
+    'Aloe_Vera': ('aloe vera', 'Aloe_vera'),
+    'Mint': ('mint leaves', 'Mentha'),
+}
+
+def search_terms(plant_class):
+    """(search query, Wikimedia Commons category or None) for a dataset class"""
+    return CLASS_SEARCH_TERMS.get(plant_class, (plant_class.replace('_', ' '), None))
+
+class RateLimiter:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts of `burst`"""
+
+    def __init__(self, rate=DEFAULT_REQUESTS_PER_SECOND, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+class HostLimiter:
+    """Caps the number of concurrent requests to any single host
+
+    With a RateLimiter, every request also takes a token from it, which bounds
+    the overall request rate across all threads sharing the limiter.
+    """
+
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST, rate_limiter=None):
+        self.max_per_host = max_per_host
+        self.rate_limiter = rate_limiter
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+        with semaphore:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            yield
+
+def create_session(pool_size=DEFAULT_MAX_WORKERS):
+    """HTTP session whose connection pool is shared by all download threads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = 'medicinal-plant-dataset-builder/0.1'
+    return session
+
+def _retry_delay(attempt, response=None, backoff=DEFAULT_BACKOFF):
+    """Exponential backoff with jitter, honouring a numeric Retry-After header"""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+    return min(MAX_BACKOFF, backoff * (2 ** attempt)) * (0.5 + random.random())
+
+def _fetch(session, url, save_path=None, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, limiter=None):
+    """GET url with retries on connection errors, 429 and 5xx responses
+
+    With save_path a 200 response body is streamed into that file (rewritten on
+    every attempt) and the response is returned with its body consumed;
+    otherwise the full response is returned. Returns None if the request still
+    fails after the last retry.
+    """
+    for attempt in range(retries + 1):
+        response = None
+        try:
+            if limiter is not None:
+                with limiter(url):
+                    response = _get(session, url, save_path)
+            else:
+                response = _get(session, url, save_path)
+            if response.status_code not in RETRYABLE_STATUS:
+                return response
+            error = f"HTTP {response.status_code}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = str(e)
+        if attempt < retries:
+            delay = _retry_delay(attempt, response, backoff)
+            print(f"Retrying {url} in {delay:.1f}s ({error})")
+            time.sleep(delay)
+    print(f"Giving up on {url}: {error}")
+    return None
+
+def _get(session, url, save_path):
+    if save_path is None:
+        return session.get(url, timeout=10)
+    with session.get(url, timeout=10, stream=True) as response:
+        if response.status_code == 200:
+            received = 0
+            with open(save_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    received += len(chunk)
+                    if received > MAX_IMAGE_BYTES:
+                        raise ValueError(f"image larger than {MAX_IMAGE_BYTES} bytes")
+                    f.write(chunk)
+        return response
+
+def _download_to_temp(url, temp_path, session, limiter=None, retries=DEFAULT_RETRIES):
+    """Stream url into temp_path and validate it; returns (http_status, image or None, error)"""
+    response = _fetch(session, url, temp_path, retries=retries, limiter=limiter)
+    if response is None:
+        return None, None, "request failed after retries"
+    if response.status_code != 200:
+        return response.status_code, None, f"HTTP {response.status_code}"
+
+    image = cv2.imread(temp_path, cv2.IMREAD_COLOR)
+    if image is None:
+        return 200, None, "not a decodable image"
+
+    # Validate image size
+    if image.shape[0] < 100 or image.shape[1] < 100:
+        return 200, None, "image smaller than 100x100"
+    return 200, image, None
+
+def download_image(url, save_path, session=None, limiter=None, retries=DEFAULT_RETRIES):
+    """Download and validate image from URL
+
+    The body is streamed to a temporary file next to save_path and validated
+    with OpenCV; the decoded image is then re-encoded in the format of
+    save_path's extension and moved into place, so interrupted downloads never
+    leave partial images behind.
+    """
+    session = session or create_session(1)
+    temp_path = save_path + '.part'
     try:
-        response = requests.get(url, timeout=10)
-        if response.status_code != 200:
+        _, image, _ = _download_to_temp(url, temp_path, session, limiter, retries)
+        if image is None:
             return False
 
-        # Convert to numpy array for validation
-        image_array = np.asarray(bytearray(response.content), dtype=np.uint8)
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-        
-        if image is None:
+        # Save image, re-encoded so its bytes match save_path's extension
+        ok, encoded = cv2.imencode(os.path.splitext(save_path)[1] or '.jpg', image)
+        if not ok:
             return False
-            
-        # Validate image size
-        if image.shape[0] < 100 or image.shape[1] < 100:
+        with open(temp_path, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(temp_path, save_path)
+        return True
+    except Exception as e:
+        print(f"Error downloading {url}: {str(e)}")
+        return False
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _image_extension(path):
+    """'.png' or '.jpg' from the file's magic bytes, None for any other format"""
+    with open(path, 'rb') as f:
+        header = f.read(8)
+    if header == b'\x89PNG\r\n\x1a\n':
+        return '.png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    return None
+
+def download_to_dataset(url, save_dir, manifest, session=None, limiter=None, retries=DEFAULT_RETRIES):
+    """Download url into save_dir under a content-hash filename, recording the outcome in manifest
+
+    Returns True only if a new image was added; images whose bytes or
+    perceptual hash are already in the manifest are dropped as duplicates.
+    """
+    session = session or create_session(1)
+    manifest.mark_pending(url, save_dir)
+    temp_path = os.path.join(save_dir, hashlib.md5(url.encode()).hexdigest() + '.part')
+    try:
+        status, image, error = _download_to_temp(url, temp_path, session, limiter, retries)
+        if image is None:
+            manifest.record(url, INVALID if status == 200 else FAILED, http_status=status, error=error)
             return False
 
-        # Save image
-        cv2.imwrite(save_path, image)
+        extension = _image_extension(temp_path)
+        if extension is None:
+            # WebP, GIF, BMP and the like are stored as JPEG so the extension matches the bytes
+            extension = '.jpg'
+            ok, encoded = cv2.imencode(extension, image)
+            if not ok:
+                raise ValueError("could not re-encode image as JPEG")
+            with open(temp_path, 'wb') as f:
+                f.write(encoded.tobytes())
+        content_hash = _content_hash(temp_path)
+        save_path = os.path.join(save_dir, content_hash[:32] + extension)
+        # Claimed before the file enters the dataset folder, so a failure here leaves nothing behind
+        existing_path = manifest.claim_content(
+            url, content_hash, hash_to_hex(phash(image)), save_path,
+            http_status=status, width=image.shape[1], height=image.shape[0], error=None
+        )
+        if existing_path is not None:
+            return False
+        os.replace(temp_path, save_path)
         return True
     except Exception as e:
         print(f"Error downloading {url}: {str(e)}")
+        manifest.record(url, FAILED, error=str(e))
         return False
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _scrape_page(session, base_url, limiter=None):
+    """Collect .jpg/.jpeg/.png image URLs from one page"""
+    image_urls = set()
+    try:
+        response = _fetch(session, base_url, limiter=limiter)
+        if response is not None and response.status_code == 200:
+            soup = BeautifulSoup(response.text, 'html.parser')
+            for img in soup.find_all('img'):
+                src = img.get('src')
+                if src:
+                    if not src.startswith(('http://', 'https://')):
+                        src = urljoin(base_url, src)
+                    if src.lower().endswith(('.jpg', '.jpeg', '.png')):
+                        image_urls.add(src)
+    except Exception as e:
+        print(f"Error scraping {base_url}: {str(e)}")
+    return image_urls
+
+def search_urls(query, category=None, num_pages=10):
+    """Pages to scrape for a search query: a Wikimedia Commons category plus search result pages"""
+    category = category or query.strip().replace(' ', '_').capitalize()
+    urls = [f"https://commons.wikimedia.org/wiki/Category:{quote(category)}"]
+    for page in range(1, num_pages + 1):
+        urls.append(f"https://pixabay.com/images/search/{quote(query)}/?pagi={page}")
+        urls.append(f"https://www.pexels.com/search/{quote(query)}/?page={page}")
+    return urls
 
-def get_image_urls(query, num_pages=10):
+def get_image_urls(query, num_pages=10, base_urls=None, session=None, max_workers=DEFAULT_MAX_WORKERS,
+                   limiter=None, category=None):
     """Get image URLs from web search"""
-    base_urls = [
-        "https://commons.wikimedia.org/wiki/Category:Aloe_vera",
-        "https://pixabay.com/images/search/aloe%20vera/",
-        "https://www.pexels.com/search/aloe%20vera/"
-    ]
-    
+    if base_urls is None:
+        base_urls = search_urls(query, category, num_pages)
+    session = session or create_session(max_workers)
+    limiter = limiter or HostLimiter()
+
     image_urls = set()
-    
-    for base_url in base_urls:
-        try:
-            downloaded = trafilatura.fetch_url(base_url)
-            if downloaded:
-                soup = BeautifulSoup(downloaded, 'html.parser')
-                for img in soup.find_all('img'):
-                    src = img.get('src')
-                    if src:
-                        if not src.startswith(('http://', 'https://')):
-                            src = urljoin(base_url, src)
-                        if src.lower().endswith(('.jpg', '.jpeg', '.png')):
-                            image_urls.add(src)
-        except Exception as e:
-            print(f"Error scraping {base_url}: {str(e)}")
-            continue
-            
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(base_urls) or 1)) as executor:
+        for page_urls in executor.map(lambda url: _scrape_page(session, url, limiter), base_urls):
+            image_urls.update(page_urls)
+
     return list(image_urls)
 
-def download_dataset(save_dir='data/training/Aloe_Vera', num_images=1000):
-    """Download and save dataset images"""
+def download_dataset(save_dir=None, num_images=1000, image_urls=None,
+                     max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST, session=None,
+                     manifest=None, limiter=None, on_download=None, plant_class=None, data_dir='data/training'):
+    """Download and save dataset images for one class
+
+    The class is plant_class, or the name of save_dir; save_dir defaults to
+    data_dir/<plant_class>. Without image_urls, candidates come from searching
+    the class's CLASS_SEARCH_TERMS.
+
+    Downloads run on a bounded thread pool sharing one pooled HTTP session,
+    with at most max_per_host concurrent requests to any one host. Every URL's
+    outcome goes into the download manifest, so reruns resume URLs that were
+    in flight, skip ones that finished or failed permanently, and never store
+    the same image twice. A shared limiter (HostLimiter) and an on_download(count)
+    callback let several crawls run side by side.
+    """
+    if plant_class is None and save_dir is None:
+        raise ValueError("download_dataset needs a plant_class or a save_dir")
+    plant_class = plant_class or os.path.basename(os.path.normpath(save_dir))
+    save_dir = save_dir or os.path.join(data_dir, plant_class)
     os.makedirs(save_dir, exist_ok=True)
-    
+    session = session or create_session(max_workers)
+    limiter = limiter or HostLimiter(max_per_host)
+    manifest = manifest or DownloadManifest()
+
     # Get image URLs
-    image_urls = get_image_urls('aloe vera plant')
-    
-    # Download images
+    if image_urls is None:
+        query, category = search_terms(plant_class)
+        image_urls = get_image_urls(query, session=session, max_workers=max_workers, limiter=limiter,
+                                    category=category)
+
+    # URLs interrupted mid-download last time go first
+    resumed = manifest.pending_urls(save_dir)
+    if resumed:
+        print(f"Resuming {len(resumed)} interrupted downloads")
+    urls = list(dict.fromkeys(resumed + list(image_urls)))
+
+    # Download images, keeping no more in flight than could still be needed
     count = 0
-    for url in image_urls:
-        if count >= num_images:
-            break
-            
-        # Generate filename from URL
-        filename = hashlib.md5(url.encode()).hexdigest() + '.jpg'
-        save_path = os.path.join(save_dir, filename)
-        
-        # Skip if file exists
-        if os.path.exists(save_path):
-            continue
-            
-        # Download and save image
-        if download_image(url, save_path):
-            count += 1
-            print(f"Downloaded {count} images")
-    
+    skipped = 0
+    pending = set()
+    url_iter = iter(urls)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(pending) < max_workers and count + len(pending) < num_images:
+                url = next(url_iter, None)
+                if url is None:
+                    break
+
+                if manifest.should_skip(url):
+                    skipped += 1
+                    continue
+
+                pending.add(executor.submit(download_to_dataset, url, save_dir, manifest, session, limiter))
+
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.result():
+                    count += 1
+                    if on_download is not None:
+                        on_download(count)
+                    else:
+                        print(f"Downloaded {count} images")
+
+    if skipped:
+        print(f"Skipped {skipped} URLs already handled in earlier runs")
     return count
 
+def count_images(class_dir):
+    """Number of .jpg/.jpeg/.png files already in a class folder"""
+    if not os.path.isdir(class_dir):
+        return 0
+    return sum(1 for f in os.listdir(class_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+
+class CrawlProgress:
+    """Thread-safe per-class download counters for a multi-class crawl"""
+
+    def __init__(self, targets, report_interval=5.0):
+        self.targets = dict(targets)
+        self.downloaded = {plant_class: 0 for plant_class in targets}
+        self.started = time.monotonic()
+        self.report_interval = report_interval
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, plant_class, downloaded):
+        with self._lock:
+            self.downloaded[plant_class] = downloaded
+            now = time.monotonic()
+            if now - self._last_report < self.report_interval:
+                return
+            self._last_report = now
+        self.report()
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            total = sum(self.downloaded.values())
+            return {
+                "elapsed_seconds": elapsed,
+                "downloaded": dict(self.downloaded),
+                "targets": dict(self.targets),
+                "images_per_second": total / elapsed if elapsed > 0 else 0.0
+            }
+
+    def report(self):
+        stats = self.snapshot()
+        classes = ", ".join(f"{plant_class} {stats['downloaded'][plant_class]}/{target}"
+                            for plant_class, target in stats['targets'].items())
+        print(f"[{stats['elapsed_seconds']:.0f}s] {classes} ({stats['images_per_second']:.1f} images/sec)")
+
+def crawl_all_classes(classes=PLANT_CLASSES, images_per_class=1000, data_dir='data/training',
+                      max_parallel_classes=4, max_workers_per_class=8, max_per_host=DEFAULT_MAX_PER_HOST,
+                      requests_per_second=DEFAULT_REQUESTS_PER_SECOND, num_pages=10, manifest=None,
+                      url_sources=None):
+    """Fill every class folder up to images_per_class images, crawling classes in parallel
+
+    Each class only downloads what it is short of, so classes end up balanced.
+    All crawls share one HTTP session, one per-host concurrency cap and one
+    global request-rate limit. url_sources optionally maps a class to the pages
+    to scrape for it. Returns the final CrawlProgress snapshot.
+    """
+    targets = {}
+    for plant_class in classes:
+        targets[plant_class] = max(0, images_per_class - count_images(os.path.join(data_dir, plant_class)))
+    print("Images needed per class: " + ", ".join(f"{c} {n}" for c, n in targets.items()))
+
+    progress = CrawlProgress(targets)
+    manifest = manifest or DownloadManifest()
+    session = create_session(max_parallel_classes * max_workers_per_class)
+    limiter = HostLimiter(max_per_host, RateLimiter(requests_per_second))
+
+    def crawl(plant_class):
+        if targets[plant_class] == 0:
+            return
+        query, category = search_terms(plant_class)
+        base_urls = url_sources.get(plant_class) if url_sources else None
+        image_urls = get_image_urls(query, num_pages, base_urls=base_urls, session=session,
+                                    max_workers=max_workers_per_class, limiter=limiter, category=category)
+        print(f"Found {len(image_urls)} candidate images for {plant_class}")
+        download_dataset(os.path.join(data_dir, plant_class), targets[plant_class], image_urls,
+                         max_workers=max_workers_per_class, session=session, manifest=manifest,
+                         limiter=limiter, on_download=lambda count: progress.update(plant_class, count))
+
+    with ThreadPoolExecutor(max_workers=max_parallel_classes) as executor:
+        for future in [executor.submit(crawl, plant_class) for plant_class in classes]:
+            future.result()
+
+    progress.report()
+    return progress.snapshot()
+
 if __name__ == "__main__":
-    num_downloaded = download_dataset()
-    print(f"Successfully downloaded {num_downloaded} images")
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Download training images for every plant class")
+    parser.add_argument("classes", nargs="*", default=PLANT_CLASSES)
+    parser.add_argument("--images-per-class", type=int, default=1000)
+    parser.add_argument("--parallel-classes", type=int, default=4)
+    parser.add_argument("--requests-per-second", type=float, default=DEFAULT_REQUESTS_PER_SECOND)
+    args = parser.parse_args()
+
+    stats = crawl_all_classes(args.classes, args.images_per_class,
+                              max_parallel_classes=args.parallel_classes,
+                              requests_per_second=args.requests_per_second)
+    print(f"Successfully downloaded {sum(stats['downloaded'].values())} images")
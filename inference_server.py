@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from model_utils import load_model, predict_probabilities, decode_predictions
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+
+_STOP = object()
+
+
+class MicroBatchServer:
+    """Coalesces concurrent single-image predictions into batched forward passes
+
+    Callers submit preprocessed images from any thread and get a Future back.
+    A background worker collects requests until either max_batch_size images are
+    queued or max_wait_ms has passed since the oldest one arrived, then runs them
+    through the model in a single batch.
+    """
+
+    def __init__(self, model_tuple=None, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.model_tuple = model_tuple if model_tuple is not None else load_model()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.images = 0
+
+    def start(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._worker.start()
+        return self
+
+    def stop(self):
+        """Finish queued requests, then stop the worker"""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(_STOP)
+            worker.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, processed_image) -> Future:
+        """Queue a preprocessed image; the Future resolves to (prediction, confidence)"""
+        if self._worker is None:
+            self.start()
+        future = Future()
+        self._queue.put((processed_image, future))
+        return future
+
+    def predict(self, processed_image, timeout=None):
+        """Blocking convenience wrapper around submit()"""
+        return self.submit(processed_image).result(timeout)
+
+    def _bucket_size(self, count):
+        """Round a batch up to a power of two so the compiled model sees few distinct shapes"""
+        return min(self.max_batch_size, 1 << (count - 1).bit_length())
+
+    def _pad(self, images):
+        batch = np.zeros((self._bucket_size(len(images)),) + np.shape(images[0]), dtype=np.float32)
+        batch[:len(images)] = images
+        return batch
+
+    def warm_up(self, image_shape=(128, 128, 3)):
+        """Trace the model for every padded batch size before real traffic arrives"""
+        model, _ = self.model_tuple
+        size = 1
+        while True:
+            predict_probabilities(model, np.zeros((size,) + image_shape, dtype=np.float32), batch_size=size)
+            if size >= self.max_batch_size:
+                break
+            size = self._bucket_size(size + 1)
+        return self
+
+    def _collect_batch(self):
+        """Wait for one request, then gather more until the batch is full or the wait expires"""
+        first = self._queue.get()
+        if first is _STOP:
+            return None, True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect_batch()
+            if batch:
+                self._process(batch)
+
+    def _process(self, batch):
+        # Skip requests whose callers cancelled them while queued
+        active = [(image, future) for image, future in batch if future.set_running_or_notify_cancel()]
+        if not active:
+            return
+        images = [image for image, _ in active]
+        futures = [future for _, future in active]
+        try:
+            model, label_encoder = self.model_tuple
+            probabilities = predict_probabilities(model, self._pad(images), batch_size=self.max_batch_size)
+            predictions, confidences = decode_predictions(label_encoder, probabilities[:len(images)])
+        except Exception as e:
+            print(f"Error in batched prediction: {e}")
+            for future in futures:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.images += len(futures)
+        for future, prediction, confidence in zip(futures, predictions, confidences):
+            future.set_result((prediction, float(confidence)))
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "mean_batch_size": self.images / self.batches if self.batches else 0.0
+        }
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_server(**kwargs) -> MicroBatchServer:
+    """Process-wide server, created (and the model loaded) on first use"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = MicroBatchServer(**kwargs).warm_up().start()
+        return _server
@@ -2,7 +2,13 @@ import streamlit as st
 import cv2
 import numpy as np
 import os
-from openai_vision import identify_plant
+from cascade import get_cascade
+from vision_client import VisionAPIError
+from perceptual_hash import image_hash, hash_to_hex
+from database import queue_identification
+from plant_info import PLANT_CLASSES
+from dataset_ingest import ingest_zip
+from dataset_catalog import get_catalog
 
 # Page config
 st.set_page_config(
@@ -220,8 +226,29 @@ if page == "Plant Identification":
             image = cv2.imdecode(image_array, 1)
             st.image(image, channels="BGR", use_container_width=True)
 
-            # Get prediction using OpenAI Vision
-            prediction, confidence = identify_plant(file_bytes)
+            # Near-duplicates of past uploads reuse their result; otherwise the local model answers
+            # and only uncertain images are sent to OpenAI Vision
+            upload_hash = image_hash(image)
+            result = get_cascade().identify(file_bytes, image=image, image_hash=upload_hash)
+            prediction, confidence = result["plant_name"], result["confidence"]
+            print(f"Answered by the {result['tier']} tier ({result['escalation_reason'] or 'no escalation'}), "
+                  f"latency ms {result['latency_ms']}")
+
+            # Record each upload in the history once, not on every Streamlit rerun
+            # (only once its commit succeeded; a failed write is retried on the next rerun)
+            recorded = st.session_state.setdefault("recorded_uploads", set())
+            pending = st.session_state.setdefault("pending_uploads", set())
+            upload_key = hash_to_hex(upload_hash)
+            if upload_key not in recorded and upload_key not in pending and prediction != "Unknown":
+                pending.add(upload_key)
+
+                def _on_written(future, key=upload_key):
+                    pending.discard(key)
+                    if not future.cancelled() and future.exception() is None and future.result():
+                        recorded.add(key)
+
+                queue_identification(prediction, confidence, file_bytes,
+                                     image_hash=upload_hash).add_done_callback(_on_written)
 
             # Display results with confidence score
             if prediction != "Unknown":
@@ -253,6 +280,16 @@ if page == "Plant Identification":
                 - The image shows the plant's distinctive features (leaves, stems, etc.)
                 """)
 
+            # Closest training images from the embedding index, when one has been built
+            neighbours = [n for n in (result.get("neighbours") or []) if os.path.exists(n[0])][:3]
+            if neighbours:
+                st.markdown("#### Most similar reference images")
+                for column, (path, label, distance) in zip(st.columns(len(neighbours)), neighbours):
+                    column.image(path, caption=f"{label} (distance {distance:.2f})", use_container_width=True)
+
+        except VisionAPIError as e:
+            st.error("The plant identification service is not responding right now. Please try again in a moment.")
+            print(f"Vision API unavailable: {str(e)}")
         except Exception as e:
             st.error(f"Error processing image: {str(e)}")
             print(f"Error in image processing: {str(e)}")
@@ -269,7 +306,7 @@ elif page == "Training Dataset":
 
     plant_category = st.selectbox(
         "",
-        ["Tulsi", "Neem", "Aloe_Vera", "Mint"]
+        PLANT_CLASSES
     )
 
     # File upload section with options
@@ -314,6 +351,8 @@ elif page == "Training Dataset":
                     st.error(f"Error saving {uploaded_file.name}: {str(e)}")
 
             if saved_count > 0:
+                # Files may have been overwritten in place, which the folder's mtime does not show
+                get_catalog().refresh(full=True, classes=[plant_category])
                 st.success(f"Successfully saved {saved_count} images for {plant_category}")
 
     else:  # Bulk Upload
@@ -328,57 +367,31 @@ elif page == "Training Dataset":
 
         if uploaded_zip:
             import zipfile
-            import io
 
             try:
                 save_dir = f"data/training/{plant_category}"
-                os.makedirs(save_dir, exist_ok=True)
-
-                # Create a BytesIO object from the uploaded file's bytes
-                zip_bytes = io.BytesIO(uploaded_zip.read())
-
-                # Open the zip file
-                with zipfile.ZipFile(zip_bytes) as zip_ref:
-                    # Get list of image files from zip
-                    image_files = [f for f in zip_ref.namelist()
-                                 if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-
-                    if not image_files:
-                        st.warning("No image files found in the ZIP archive.")
-                    else:
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
-                        saved_count = 0
-
-                        for i, image_file in enumerate(image_files):
-                            try:
-                                # Extract and read the image
-                                image_data = zip_ref.read(image_file)
-                                image_array = np.asarray(bytearray(image_data), dtype=np.uint8)
-                                image = cv2.imdecode(image_array, 1)
-
-                                if image is not None:
-                                    # Get the filename from the path
-                                    filename = os.path.basename(image_file)
-                                    save_path = os.path.join(save_dir, filename)
-
-                                    # Save the image
-                                    cv2.imwrite(save_path, image)
-                                    saved_count += 1
-
-                                # Update progress
-                                progress = (i + 1) / len(image_files)
-                                progress_bar.progress(progress)
-                                status_text.text(f"Processing {i+1}/{len(image_files)} images...")
-
-                            except Exception as e:
-                                st.error(f"Error processing {image_file}: {str(e)}")
-                                continue
-
-                        if saved_count > 0:
-                            st.success(f"Successfully extracted and saved {saved_count} images for {plant_category}")
-                        else:
-                            st.warning("No images were successfully processed from the ZIP file.")
+                progress_bar = st.progress(0)
+                status_text = st.empty()
+
+                def show_progress(done, total):
+                    progress_bar.progress(done / total)
+                    status_text.text(f"Processing {done}/{total} images...")
+
+                # The upload is read member by member; images are validated and saved in parallel
+                stats = ingest_zip(uploaded_zip, save_dir, on_progress=show_progress)
+
+                if stats['members'] == 0:
+                    st.warning("No image files found in the ZIP archive.")
+                elif stats['saved'] > 0:
+                    st.success(f"Successfully extracted and saved {stats['saved']} images for {plant_category}")
+                elif stats['duplicate'] > 0:
+                    st.info("All images in the ZIP file are already in the dataset.")
+                else:
+                    st.warning("No images were successfully processed from the ZIP file.")
+                if stats['duplicate'] or stats['invalid'] or stats['skipped']:
+                    st.info(f"Skipped {stats['duplicate']} duplicate, {stats['invalid']} unreadable "
+                            f"and {stats['skipped']} oversized images")
+                print(f"ZIP ingest: {stats['images_per_second']:.1f} images/sec, stage seconds {stats['stage_seconds']}")
 
             except zipfile.BadZipFile:
                 st.error("The uploaded file is not a valid ZIP archive.")
@@ -392,12 +405,14 @@ elif page == "Training Dataset":
     </div>
     """, unsafe_allow_html=True)
 
+    # Counts come from the dataset catalog, which only rescans class folders that changed
+    catalog = get_catalog()
+    catalog.refresh()
+    class_counts = catalog.class_counts()
     total_images = 0
-    for category in ["Tulsi", "Neem", "Aloe_Vera", "Mint"]:
-        path = f"data/training/{category}"
-        if os.path.exists(path):
-            image_files = [f for f in os.listdir(path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            num_images = len(image_files)
+    for category in PLANT_CLASSES:
+        if category in class_counts:
+            num_images = class_counts[category]
             total_images += num_images
             st.markdown(f"""
             <div style='background: #ffffff; padding: 1rem; border-radius: 8px; margin: 0.5rem 0; display: flex; justify-content: space-between; align-items: center; border: 1px solid #10b981;'>
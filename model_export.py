@@ -0,0 +1,96 @@
+"""Export the trained classifier to TFLite for faster CPU inference
+
+    python model_export.py                       # float16 and int8
+    python model_export.py --quantization dynamic int8 --calibration-samples 500
+
+Load an export with model_utils.load_model(backend='int8'), or set
+MODEL_BACKEND=int8 for the app, batch_identify.py and the inference server.
+"""
+import argparse
+import os
+import random
+import time
+import cv2
+import numpy as np
+from image_processor import preprocess_image
+from model_utils import MODEL_PATH, tflite_path
+
+QUANTIZATIONS = ('float16', 'dynamic', 'int8')
+DEFAULT_QUANTIZATIONS = ('float16', 'int8')
+DEFAULT_CALIBRATION_SAMPLES = 200
+
+
+def calibration_images(data_dir='data/training', samples=DEFAULT_CALIBRATION_SAMPLES, seed=0):
+    """Yield up to `samples` preprocessed training images, drawn at random across classes"""
+    from train_model import iter_training_files
+
+    paths = [path for path, _ in iter_training_files(data_dir)]
+    random.Random(seed).shuffle(paths)
+    count = 0
+    for path in paths:
+        if count >= samples:
+            return
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        count += 1
+        yield preprocess_image(image)
+
+
+def export_tflite(quantization='int8', model_path=MODEL_PATH, output_path=None, data_dir='data/training',
+                  calibration_samples=DEFAULT_CALIBRATION_SAMPLES, model=None):
+    """Convert the Keras model to a quantized TFLite file and return its path
+
+    float16 stores weights as float16; dynamic stores them as int8 and
+    quantizes activations on the fly; int8 quantizes weights and activations
+    with ranges calibrated on calibration_samples images from data_dir. Every
+    variant keeps float32 input and output, so preprocessing and decoding are
+    unchanged. model, if given, is converted instead of loading model_path.
+    """
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {', '.join(QUANTIZATIONS)}")
+    output_path = output_path or tflite_path(quantization, model_path)
+    if model is None:
+        model = tf.keras.models.load_model(model_path)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        calibration = [image[np.newaxis] for image in calibration_images(data_dir, calibration_samples)]
+        if not calibration:
+            raise ValueError(f"No training images found in {data_dir} to calibrate int8 quantization")
+        print(f"Calibrating int8 quantization on {len(calibration)} images...")
+        converter.representative_dataset = lambda: ([image] for image in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    start = time.perf_counter()
+    tflite_model = converter.convert()
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    print(f"Exported {quantization} model to {output_path} "
+          f"({len(tflite_model) / 1e6:.1f} MB, {time.perf_counter() - start:.1f} s)")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quantization", nargs="+", choices=QUANTIZATIONS, default=list(DEFAULT_QUANTIZATIONS))
+    parser.add_argument("--model", default=MODEL_PATH, help="Keras model to export")
+    parser.add_argument("--data-dir", default="data/training", help="training images for int8 calibration")
+    parser.add_argument("--calibration-samples", type=int, default=DEFAULT_CALIBRATION_SAMPLES)
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    model = tf.keras.models.load_model(args.model)
+    for quantization in args.quantization:
+        export_tflite(quantization, args.model, data_dir=args.data_dir,
+                      calibration_samples=args.calibration_samples, model=model)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,238 @@
 
 import numpy as np
 import joblib
-import tensorflow as tf
 import os
+import threading
+import time
+import weakref
+from itertools import islice
+from perceptual_hash import DEFAULT_MAX_DISTANCE
 
-def load_model():
-    """Loads the trained model"""
-    model_path = 'models/plant_classifier.h5'
-    encoder_path = 'models/label_encoder.joblib'
+# Lower the confidence threshold since we have a well-trained model
+CONFIDENCE_THRESHOLD = 0.45
+DEFAULT_BATCH_SIZE = 64
 
-    if os.path.exists(model_path) and os.path.exists(encoder_path):
-        print("Loading trained model...")
+MODEL_PATH = 'models/plant_classifier.h5'
+ENCODER_PATH = 'models/label_encoder.joblib'
+
+# 'keras' runs the .h5 through TensorFlow; the others run a TFLite export (see model_export.py)
+BACKENDS = ('keras', 'float16', 'dynamic', 'int8')
+DEFAULT_BACKEND = os.environ.get('MODEL_BACKEND', 'keras')
+
+# Compiled inference functions, one per loaded model; keyed weakly, so replaced models are freed along with them
+_forward_functions = weakref.WeakKeyDictionary()
+_embedding_functions = weakref.WeakKeyDictionary()
+
+# Models loaded in this process, keyed by (model_path, encoder_path)
+_loaded_models = {}
+_load_timings = {}
+_registry_lock = threading.Lock()
+
+def _import_tensorflow():
+    """Import TensorFlow on first use so importing this module stays cheap"""
+    import tensorflow as tf
+    return tf
+
+def tflite_path(quantization, model_path=MODEL_PATH):
+    """Where the TFLite export of model_path with the given quantization is stored"""
+    return f"{os.path.splitext(model_path)[0]}_{quantization}.tflite"
+
+def _import_interpreter():
+    """The TFLite interpreter class, from the standalone runtime when installed (it loads far faster than TensorFlow)"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = _import_tensorflow().lite.Interpreter
+    return Interpreter
+
+class TFLiteModel:
+    """A TFLite export behind the small part of the Keras model interface this module uses
+
+    Calling it with a float32 batch returns class probabilities as a numpy
+    array. The interpreter is resized when the batch size changes and is not
+    thread-safe, so calls are serialized.
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = _import_interpreter()(model_path=path, num_threads=num_threads or os.cpu_count())
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(int(d) for d in self._input['shape'][1:])
+        self.output_shape = (None,) + tuple(int(d) for d in self._output['shape'][1:])
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def __call__(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], (len(batch),) + self.input_shape[1:])
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self._input['index'], batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output['index']).copy()
+
+def _load_from_disk(model_path, encoder_path, backend='keras'):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    if backend != 'keras':
+        model_path = tflite_path(backend, model_path)
+    if not (os.path.exists(model_path) and os.path.exists(encoder_path)):
+        if backend != 'keras':
+            raise FileNotFoundError(f"No {backend} TFLite model found at {model_path}. Run model_export.py first.")
+        raise FileNotFoundError("No trained model found. Please train the model first.")
+
+    timings = {}
+    start = time.perf_counter()
+    if backend == 'keras':
+        tf = _import_tensorflow()
+    else:
+        _import_interpreter()
+    timings["import_seconds"] = time.perf_counter() - start
+
+    print(f"Loading trained model ({backend})...")
+    start = time.perf_counter()
+    if backend == 'keras':
         model = tf.keras.models.load_model(model_path)
-        label_encoder = joblib.load(encoder_path)
-        return model, label_encoder
     else:
-        raise FileNotFoundError("No trained model found. Please train the model first.")
+        model = TFLiteModel(model_path)
+    label_encoder = joblib.load(encoder_path)
+    timings["load_seconds"] = time.perf_counter() - start
+    return (model, label_encoder), timings
 
-def predict(model_tuple, processed_image):
-    """Makes a prediction with improved confidence handling"""
-    model, label_encoder = model_tuple
+def warm_up(model_tuple):
+    """Run one forward pass so graph tracing happens before the first real request"""
+    model, _ = model_tuple
+    predict_probabilities(model, np.zeros((1,) + tuple(model.input_shape[1:]), dtype=np.float32), batch_size=1)
 
-    # Add batch dimension
-    image_batch = np.expand_dims(processed_image, 0)
+def load_model(model_path=MODEL_PATH, encoder_path=ENCODER_PATH, reload=False, backend=None):
+    """Loads the trained model
 
-    # Get prediction probabilities
-    probabilities = model.predict(image_batch)[0]
-    max_prob = np.max(probabilities)
+    The model is loaded and warmed up once per process; later calls return the
+    same (model, label_encoder) tuple. Pass reload=True after retraining.
+    backend picks the Keras model or one of its TFLite exports (float16,
+    dynamic or int8), defaulting to the MODEL_BACKEND environment variable;
+    the returned model works with every prediction function here either way.
+    """
+    backend = backend or DEFAULT_BACKEND
+    key = (model_path, encoder_path, backend)
+    with _registry_lock:
+        if reload or key not in _loaded_models:
+            model_tuple, timings = _load_from_disk(model_path, encoder_path, backend)
+            start = time.perf_counter()
+            warm_up(model_tuple)
+            timings["warm_up_seconds"] = time.perf_counter() - start
+            print("Model ready: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+            _loaded_models[key] = model_tuple
+            _load_timings[key] = timings
+        return _loaded_models[key]
 
-    # Lower the confidence threshold since we have a well-trained model
-    confidence_threshold = 0.45
+def get_load_timings(model_path=MODEL_PATH, encoder_path=ENCODER_PATH, backend=None):
+    """Import/load/warm-up durations in seconds for a model loaded in this process"""
+    return dict(_load_timings.get((model_path, encoder_path, backend or DEFAULT_BACKEND), {}))
 
-    if max_prob >= confidence_threshold:
-        prediction = label_encoder.inverse_transform([np.argmax(probabilities)])[0]
-        confidence = max_prob * 100
-    else:
-        prediction = "Unknown"
-        confidence = 0.0
+def predict(model_tuple, processed_image, image_hash=None, max_distance=DEFAULT_MAX_DISTANCE):
+    """Makes a prediction with improved confidence handling
+
+    If image_hash (perceptual hash of the original image) is given and a
+    near-duplicate is already in the identification history, its stored
+    result is returned without running the model.
+    """
+    if image_hash is not None:
+        # Imported here so loading a model does not open the identification database
+        from database import find_near_duplicate
+        duplicate = find_near_duplicate(image_hash, max_distance)
+        if duplicate is not None:
+            return duplicate
+
+    predictions, confidences = predict_batch(model_tuple, [processed_image], batch_size=1)
+    return predictions[0], float(confidences[0])
+
+def _get_forward_function(model):
+    """Graph-compiled inference call, avoiding the per-call overhead of model.predict"""
+    if isinstance(model, TFLiteModel):
+        return model
+    forward = _forward_functions.get(model)
+    if forward is None:
+        tf = _import_tensorflow()
+        # A strong reference here would keep the model, its key, alive forever
+        model_ref = weakref.ref(model)
+        forward = tf.function(lambda x: model_ref()(x, training=False), reduce_retracing=True)
+        _forward_functions[model] = forward
+    return forward
+
+def _iter_batches(images, batch_size):
+    """Yield float32 arrays of up to batch_size images from an array or any iterable"""
+    if isinstance(images, np.ndarray):
+        for start in range(0, len(images), batch_size):
+            yield np.asarray(images[start:start + batch_size], dtype=np.float32)
+        return
+    iterator = iter(images)
+    while True:
+        chunk = list(islice(iterator, batch_size))
+        if not chunk:
+            return
+        yield np.stack(chunk).astype(np.float32, copy=False)
 
-    return prediction, confidence
+def predict_probabilities(model, images, batch_size=DEFAULT_BATCH_SIZE):
+    """Class probabilities for preprocessed images, shape (N, num_classes)"""
+    forward = _get_forward_function(model)
+    outputs = [np.asarray(forward(batch)) for batch in _iter_batches(images, batch_size)]
+    if not outputs:
+        return np.zeros((0, model.output_shape[-1]), dtype=np.float32)
+    return np.concatenate(outputs)
+
+def _get_embedding_function(model):
+    """Graph-compiled call returning (embeddings, probabilities): the last GlobalAveragePooling2D output and the softmax"""
+    if isinstance(model, TFLiteModel):
+        raise ValueError("Embeddings need the keras backend; TFLite exports only have the softmax output")
+    forward = _embedding_functions.get(model)
+    if forward is None:
+        tf = _import_tensorflow()
+        pooling = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)]
+        if not pooling:
+            raise ValueError("Model has no GlobalAveragePooling2D layer to take embeddings from")
+        both = tf.keras.Model(model.inputs, [pooling[-1].output, model.output])
+        forward = tf.function(lambda x: both(x, training=False), reduce_retracing=True)
+        _embedding_functions[model] = forward
+    return forward
+
+def predict_embeddings(model, images, batch_size=DEFAULT_BATCH_SIZE):
+    """Pooled EfficientNet features and class probabilities for preprocessed images, from one forward pass
+
+    Returns (embeddings, probabilities) with shapes (N, 1280) and (N, num_classes).
+    """
+    forward = _get_embedding_function(model)
+    embeddings, probabilities = [], []
+    for batch in _iter_batches(images, batch_size):
+        batch_embeddings, batch_probabilities = forward(batch)
+        embeddings.append(np.asarray(batch_embeddings))
+        probabilities.append(np.asarray(batch_probabilities))
+    if not embeddings:
+        return np.zeros((0, 0), dtype=np.float32), np.zeros((0, model.output_shape[-1]), dtype=np.float32)
+    return np.concatenate(embeddings), np.concatenate(probabilities)
+
+def decode_predictions(label_encoder, probabilities, confidence_threshold=CONFIDENCE_THRESHOLD):
+    """Map a probability matrix to (labels, confidence percentages), with "Unknown" below threshold"""
+    max_probs = probabilities.max(axis=1)
+    labels = np.asarray(label_encoder.classes_, dtype=object)[probabilities.argmax(axis=1)]
+    confident = max_probs >= confidence_threshold
+    predictions = np.where(confident, labels, "Unknown")
+    confidences = np.where(confident, max_probs * 100, 0.0)
+    return predictions, confidences
+
+def predict_batch(model_tuple, images, batch_size=DEFAULT_BATCH_SIZE, confidence_threshold=CONFIDENCE_THRESHOLD):
+    """Makes predictions for many preprocessed images at once
+
+    images may be an (N, 128, 128, 3) array or any iterable of preprocessed
+    images; they are run through the model batch_size at a time.
+    Returns (predictions, confidences) as arrays of length N.
+    """
+    model, label_encoder = model_tuple
+    probabilities = predict_probabilities(model, images, batch_size)
+    return decode_predictions(label_encoder, probabilities, confidence_threshold)
@@ -1,28 +1,104 @@
+import asyncio
 import base64
-from openai import OpenAI
-import os
 import json
+import os
 import random
+import threading
+import time
+import cv2
+import openai
+from result_cache import ResultCache, make_cache_key
+from perceptual_hash import DEFAULT_MAX_DISTANCE, hash_image_bytes
+from database import find_near_duplicate
+from vision_client import AsyncVisionClient, BackgroundLoop, VisionAPIError
+from image_processor import decode_image, downscale_image
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+MODEL = "gpt-4o"
+# Bump when response handling changes so previously cached results are not reused
+RESULT_VERSION = 1
+
+# Uploads are downscaled so their longest edge is at most this and re-encoded before sending
+UPLOAD_MAX_EDGE = int(os.environ.get("VISION_UPLOAD_MAX_EDGE", "1024"))
+UPLOAD_FORMAT = os.environ.get("VISION_UPLOAD_FORMAT", "jpeg")  # "jpeg" or "webp"
+UPLOAD_QUALITY = int(os.environ.get("VISION_UPLOAD_QUALITY", "85"))
+
+_UPLOAD_ENCODINGS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+_MIME_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+]
+
+result_cache = ResultCache()
+
+_upload_stats = {"uploads": 0, "original_bytes": 0, "sent_bytes": 0, "prepare_seconds": 0.0, "request_seconds": 0.0}
+_upload_stats_lock = threading.Lock()
+
+# One client and event loop per process, shared by every thread that identifies plants
+_client = None
+_loop = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """The process-wide AsyncVisionClient and the background loop it runs on"""
+    global _client, _loop
+    with _client_lock:
+        if _client is None:
+            try:
+                client = AsyncVisionClient()
+            except openai.OpenAIError as e:
+                raise VisionAPIError(f"Vision API client is not configured: {str(e)}")
+            _loop = BackgroundLoop()
+            _client = client
+        return _client, _loop
+
+def sniff_mime_type(image_bytes):
+    """MIME type of encoded image bytes, from their signature"""
+    for signature, mime_type in _MIME_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return mime_type
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+def prepare_upload(image_bytes, max_edge=UPLOAD_MAX_EDGE, image_format=UPLOAD_FORMAT, quality=UPLOAD_QUALITY):
+    """Downscale and re-encode an image for the API; returns (bytes, MIME type)
+
+    Large JPEGs are decoded at reduced scale directly. The original bytes are
+    sent instead when they are already small enough and no larger than the
+    re-encoded version, or when they cannot be decoded.
+    """
+    extension, mime_type, quality_flag = _UPLOAD_ENCODINGS[image_format]
+    image = decode_image(image_bytes, fast=True, min_edge=max_edge)
+    if image is None:
+        return image_bytes, sniff_mime_type(image_bytes)
+    resized = downscale_image(image, max_edge)
+    ok, encoded = cv2.imencode(extension, resized, [quality_flag, quality])
+    original_mime_type = sniff_mime_type(image_bytes)
+    keep_original = (resized is image and original_mime_type in ("image/jpeg", "image/webp")
+                     and (not ok or len(image_bytes) <= encoded.nbytes))
+    if keep_original or not ok:
+        return image_bytes, original_mime_type
+    return encoded.tobytes(), mime_type
+
+def get_upload_stats():
+    """Bytes and seconds spent on Vision API uploads in this process"""
+    with _upload_stats_lock:
+        stats = dict(_upload_stats)
+    stats["bytes_saved"] = stats["original_bytes"] - stats["sent_bytes"]
+    stats["sent_ratio"] = stats["sent_bytes"] / stats["original_bytes"] if stats["original_bytes"] else 1.0
+    return stats
 
 def encode_image_to_base64(image_bytes):
     """Convert image bytes to base64 string"""
     return base64.b64encode(image_bytes).decode('utf-8')
 
-def identify_plant(image_bytes):
-    """
-    Identify plant using OpenAI's Vision API
-    Returns (plant_name, confidence_score)
-    """
-    try:
-        print("Starting plant identification process...")
-        base64_image = encode_image_to_base64(image_bytes)
-        print("Successfully encoded image to base64")
-
-        prompt = """
+PROMPT = """
         You are a specialized medicinal plant identification expert. Your task is to identify if this image shows one of these specific medicinal plants. Please analyze the image in detail, focusing on the following plants and their distinctive characteristics:
 
         Target Plants:
@@ -64,56 +140,136 @@ def identify_plant(image_bytes):
         If you cannot identify the plant or are unsure, respond with 'Unknown' as the plant name.
         """
 
-        print("Sending request to OpenAI Vision API...")
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Latest model as of May 2024
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
+def _cached_result(image_bytes, use_cache, image_hash, max_distance):
+    """(cache_key, (plant_name, confidence) or None) from the result cache or identification history"""
+    # What is sent depends on the upload settings, so they are part of the key
+    cache_key = make_cache_key(image_bytes, MODEL, PROMPT, RESULT_VERSION,
+                               UPLOAD_MAX_EDGE, UPLOAD_FORMAT, UPLOAD_QUALITY)
+    if use_cache:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            print("Returning cached identification result")
+            return cache_key, (cached["plant_name"], cached["confidence"])
+
+        if image_hash is None:
+            image_hash = hash_image_bytes(image_bytes)
+        if image_hash is not None:
+            duplicate = find_near_duplicate(image_hash, max_distance)
+            if duplicate is not None:
+                return cache_key, duplicate
+    return cache_key, None
+
+def _field(result, name, default, valid):
+    """result[name] (default if absent), raising VisionAPIError if the model returned something else"""
+    value = result.get(name, default)
+    if not valid(value):
+        raise VisionAPIError(f"Vision API response has an invalid {name!r} field: {value!r}")
+    return value
+
+def _is_string_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+def _parse_response(content):
+    """(plant_name, confidence) from the model's JSON answer"""
+    try:
+        result = json.loads(content)
+    except (json.JSONDecodeError, TypeError) as e:
+        raise VisionAPIError(f"Could not parse the Vision API response: {str(e)}")
+    if not isinstance(result, dict):
+        raise VisionAPIError(f"Vision API response is not a JSON object: {content!r}")
+    print(f"Successfully parsed response: {result}")
+
+    plant_name = _field(result, "plant_name", "Unknown", lambda value: isinstance(value, str))
+    features_matched = _field(result, "features_matched", [], _is_string_list)
+    missing_features = _field(result, "missing_features", [], _is_string_list)
+    explanation = _field(result, "explanation", "No explanation provided", lambda value: isinstance(value, str))
+
+    print(f"Identified plant: {plant_name}")
+    print(f"Features matched: {', '.join(features_matched)}")
+    print(f"Missing features: {', '.join(missing_features)}")
+    print(f"Explanation: {explanation}")
+
+    # For identified plants, return random confidence between 96-98%
+    if plant_name != "Unknown":
+        return plant_name, random.uniform(96.0, 98.0)
+    # For unknown plants, return 0 confidence
+    return "Unknown", 0.0
+
+async def _request_identification(client, image_bytes, cache_key):
+    start = time.perf_counter()
+    # Decoding and encoding release the GIL, so this keeps the event loop free for other requests
+    upload_bytes, mime_type = await asyncio.to_thread(prepare_upload, image_bytes)
+    prepared = time.perf_counter()
+    print(f"Sending {len(upload_bytes)} bytes ({mime_type}, originally {len(image_bytes)}) to OpenAI Vision API...")
+    response = await client.create_chat_completion(
+        model=MODEL,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{encode_image_to_base64(upload_bytes)}"
                         }
-                    ]
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=1000,
-            temperature=0.1  # Lower temperature for more consistent responses
-        )
-
-        print(f"Received response from OpenAI: {response.choices[0].message.content}")
-
-        try:
-            result = json.loads(response.choices[0].message.content)
-            print(f"Successfully parsed response: {result}")
-
-            plant_name = result.get("plant_name", "Unknown")
-            features_matched = result.get("features_matched", [])
-            missing_features = result.get("missing_features", [])
-            explanation = result.get("explanation", "No explanation provided")
-
-            print(f"Identified plant: {plant_name}")
-            print(f"Features matched: {', '.join(features_matched)}")
-            print(f"Missing features: {', '.join(missing_features)}")
-            print(f"Explanation: {explanation}")
-
-            # For identified plants, return random confidence between 96-98%
-            if plant_name != "Unknown":
-                confidence = random.uniform(96.0, 98.0)
-                return plant_name, confidence
-
-            # For unknown plants, return 0 confidence
-            return "Unknown", 0.0
-
-        except (json.JSONDecodeError, KeyError, ValueError) as e:
-            print(f"Error parsing OpenAI response: {str(e)}")
-            return "Unknown", 0.0
-
-    except Exception as e:
-        print(f"Error in OpenAI API call: {str(e)}")
-        return "Unknown", 0.0
\ No newline at end of file
+                    }
+                ]
+            }
+        ],
+        response_format={"type": "json_object"},
+        max_tokens=1000,
+        temperature=0.1  # Lower temperature for more consistent responses
+    )
+    with _upload_stats_lock:
+        _upload_stats["uploads"] += 1
+        _upload_stats["original_bytes"] += len(image_bytes)
+        _upload_stats["sent_bytes"] += len(upload_bytes)
+        _upload_stats["prepare_seconds"] += prepared - start
+        _upload_stats["request_seconds"] += time.perf_counter() - prepared
+    print(f"Received response from OpenAI: {response.choices[0].message.content}")
+    plant_name, confidence = _parse_response(response.choices[0].message.content)
+
+    # Only answers the model actually gave are cached, never errors
+    result_cache.set(cache_key, {"plant_name": plant_name, "confidence": confidence})
+    return plant_name, confidence
+
+async def identify_plant_async(client, image_bytes, use_cache=True, image_hash=None,
+                               max_distance=DEFAULT_MAX_DISTANCE):
+    """Coroutine version of identify_plant() using an AsyncVisionClient created on the running loop
+
+    The client's concurrency and rate limits apply across all coroutines sharing it.
+    """
+    cache_key, result = _cached_result(image_bytes, use_cache, image_hash, max_distance)
+    if result is not None:
+        return result
+    return await _request_identification(client, image_bytes, cache_key)
+
+async def identify_plants_async(client, images, use_cache=True):
+    """Identify many image bytes concurrently; failed items are returned as their VisionAPIError"""
+    return await asyncio.gather(
+        *(identify_plant_async(client, image_bytes, use_cache) for image_bytes in images),
+        return_exceptions=True
+    )
+
+def identify_plant(image_bytes, use_cache=True, image_hash=None, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    Identify plant using OpenAI's Vision API
+    Returns (plant_name, confidence_score)
+
+    Results are cached by image content, and an upload that is a near-duplicate
+    (perceptual hash within max_distance bits) of an image already in the
+    identification history reuses that result, so repeat identifications skip
+    the API call. Pass use_cache=False to force a fresh request.
+
+    Requests go through the shared AsyncVisionClient, so calls from many
+    threads are rate limited, retried and time-limited together. Raises
+    VisionAPIError if no answer could be obtained; ("Unknown", 0.0) means the
+    model itself did not recognise the plant.
+    """
+    cache_key, result = _cached_result(image_bytes, use_cache, image_hash, max_distance)
+    if result is not None:
+        return result
+    print("Starting plant identification process...")
+    client, loop = get_client()
+    return loop.run(_request_identification(client, image_bytes, cache_key))
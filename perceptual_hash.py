@@ -0,0 +1,134 @@
+import threading
+import cv2
+import numpy as np
+
+# Images whose hashes differ in at most this many bits are treated as the same photo
+DEFAULT_MAX_DISTANCE = 6
+
+
+def _to_gray(image):
+    """Convert a decoded image (BGR uint8 or normalized float) to 8-bit grayscale"""
+    if image.dtype != np.uint8:
+        image = np.clip(image * 255.0, 0, 255).astype(np.uint8)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def dhash(image, hash_size=8):
+    """Difference hash: sign of horizontal gradients on a tiny grayscale thumbnail"""
+    gray = _to_gray(image)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return _bits_to_int(bits)
+
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """Perceptual hash: low-frequency DCT coefficients compared against their median"""
+    gray = _to_gray(image)
+    size = hash_size * highfreq_factor
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:hash_size, :hash_size]
+    bits = (low_freq > np.median(low_freq)).flatten()
+    return _bits_to_int(bits)
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def image_hash(image):
+    """Hash used to index identifications (64-bit pHash)"""
+    return phash(image)
+
+
+def hash_image_bytes(image_bytes):
+    """Decode encoded image bytes and hash them, or return None if they cannot be decoded"""
+    image_array = np.asarray(bytearray(image_bytes), dtype=np.uint8)
+    image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return image_hash(image)
+
+
+def hash_to_hex(value):
+    return f"{value:016x}"
+
+
+def hex_to_hash(value):
+    return int(value, 16)
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class MultiIndexHashTable:
+    """Multi-index hashing over 64-bit hashes for Hamming-radius queries
+
+    Each hash is split into `chunks` substrings with one lookup table per substring.
+    By the pigeonhole principle any hash within distance r of a query matches it in
+    at least one substring to within r // chunks bits, so only those buckets are
+    probed and the few candidates they hold are verified with a full popcount.
+    Inserting an existing hash replaces its payload.
+    """
+
+    def __init__(self, bits=64, chunks=4):
+        self.chunk_bits = bits // chunks
+        self.chunks = chunks
+        self._mask = (1 << self.chunk_bits) - 1
+        self._tables = [{} for _ in range(chunks)]
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def _substrings(self, value):
+        return [(value >> (i * self.chunk_bits)) & self._mask for i in range(self.chunks)]
+
+    def add(self, value, payload=None):
+        with self._lock:
+            if value not in self._payloads:
+                for table, key in zip(self._tables, self._substrings(value)):
+                    table.setdefault(key, []).append(value)
+            self._payloads[value] = payload
+
+    def _neighbours(self, key, radius):
+        """All chunk values within `radius` bits of key"""
+        keys = [key]
+        frontier = [(key, -1)]
+        for _ in range(radius):
+            next_frontier = []
+            for value, last_bit in frontier:
+                for bit in range(last_bit + 1, self.chunk_bits):
+                    flipped = value ^ (1 << bit)
+                    keys.append(flipped)
+                    next_frontier.append((flipped, bit))
+            frontier = next_frontier
+        return keys
+
+    def search(self, value, max_distance):
+        """Return (distance, hash, payload) for every entry within max_distance, closest first"""
+        radius = max_distance // self.chunks
+        candidates = set()
+        for table, key in zip(self._tables, self._substrings(value)):
+            for probe in self._neighbours(key, radius):
+                bucket = table.get(probe)
+                if bucket:
+                    candidates.update(bucket)
+        matches = []
+        for candidate in candidates:
+            distance = hamming_distance(value, candidate)
+            if distance <= max_distance:
+                matches.append((distance, candidate, self._payloads[candidate]))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def nearest(self, value, max_distance):
+        """Closest (distance, hash, payload) within max_distance, or None"""
+        matches = self.search(value, max_distance)
+        return matches[0] if matches else None
@@ -1,3 +1,6 @@
+# Plant categories, named as their folders under data/training
+PLANT_CLASSES = ["Tulsi", "Neem", "Aloe_Vera", "Mint"]
+
 def get_plant_info(plant_name):
     """Returns information about the identified plant"""
     plant_database = {
@@ -0,0 +1,174 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from sqlalchemy import create_engine, Column, Integer, String, Float
+from sqlalchemy.orm import declarative_base, sessionmaker
+from image_processor import enhance_image
+
+DEFAULT_CACHE_DIR = 'data/preprocessed'
+DEFAULT_SHARD_SIZE = 1024
+IMAGE_SHAPE = (128, 128, 3)
+
+IndexBase = declarative_base()
+
+
+class CachedImage(IndexBase):
+    __tablename__ = 'cached_images'
+
+    path = Column(String, primary_key=True)
+    mtime = Column(Float)
+    size = Column(Integer)
+    label = Column(String(50), index=True)
+    shard = Column(Integer)
+    offset = Column(Integer)
+
+    def __repr__(self):
+        return f"<CachedImage(path='{self.path}', shard={self.shard}, offset={self.offset})>"
+
+
+def _load_enhanced(path):
+    """Read and enhance one image file, or return None if it cannot be decoded"""
+    try:
+        image = cv2.imread(path)
+        return enhance_image(image) if image is not None else None
+    except Exception as e:
+        print(f"Error processing {path}: {e}")
+        return None
+
+
+class PreprocessCache:
+    """Preprocessed training images stored in fixed-size memory-mapped .npy shards
+
+    Each shard holds shard_size enhanced 128x128 RGB images as uint8 (the exact
+    values preprocess_image divides by 255). A SQLite index maps each source file
+    to its label and (shard, offset) slot and records its mtime and size, so
+    update() only re-processes files that were added or changed since the last run.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, shard_size=DEFAULT_SHARD_SIZE):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.shard_size = shard_size
+        self.engine = create_engine(f"sqlite:///{os.path.join(cache_dir, 'index.db')}")
+        IndexBase.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self._shards = {}
+
+    def _shard_path(self, shard):
+        return os.path.join(self.cache_dir, f"shard_{shard:05d}.npy")
+
+    def _shard(self, shard, writable=False):
+        """Memory-map a shard, creating it on first write"""
+        path = self._shard_path(shard)
+        cached = self._shards.get(shard)
+        if writable and cached is None and not os.path.exists(path):
+            cached = np.lib.format.open_memmap(
+                path, mode='w+', dtype=np.uint8, shape=(self.shard_size,) + IMAGE_SHAPE
+            )
+            self._shards[shard] = cached
+            return cached
+        if cached is None or (writable and not cached.flags.writeable):
+            cached = np.load(path, mmap_mode='r+' if writable else 'r')
+            if cached.shape[0] != self.shard_size:
+                raise ValueError(f"{path} holds {cached.shape[0]} images, expected shard_size={self.shard_size}")
+            self._shards[shard] = cached
+        return cached
+
+    def _free_slots(self, used):
+        """Yield unused (shard, offset) slots: holes left by removed files first, then new space"""
+        end = max((shard * self.shard_size + offset for shard, offset in used), default=-1) + 1
+        for position in range(end):
+            slot = divmod(position, self.shard_size)
+            if slot not in used:
+                yield slot
+        position = end
+        while True:
+            yield divmod(position, self.shard_size)
+            position += 1
+
+    def update(self, files, workers=None):
+        """Sync the cache with an iterable of (image_path, label) pairs
+
+        Returns counts of added, updated, removed and unchanged images.
+        """
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0}
+        session = self.Session()
+        try:
+            existing = {record.path: record for record in session.query(CachedImage)}
+            pending = []
+            seen = set()
+            for path, label in files:
+                seen.add(path)
+                stat = os.stat(path)
+                record = existing.get(path)
+                if record is not None and record.mtime == stat.st_mtime and record.size == stat.st_size \
+                        and record.label == label:
+                    stats["unchanged"] += 1
+                    continue
+                pending.append((path, label, stat))
+
+            for path in set(existing) - seen:
+                session.delete(existing.pop(path))
+                stats["removed"] += 1
+
+            used = {(record.shard, record.offset) for record in existing.values()}
+            free_slots = self._free_slots(used)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                enhanced_images = executor.map(_load_enhanced, [path for path, _, _ in pending])
+                for (path, label, stat), enhanced in zip(pending, enhanced_images):
+                    record = existing.get(path)
+                    if enhanced is None:
+                        stats["failed"] += 1
+                        if record is not None:
+                            session.delete(record)
+                        continue
+                    # Changed files are rewritten in place; new files take the next free slot
+                    if record is None:
+                        shard, offset = next(free_slots)
+                        record = CachedImage(path=path, shard=shard, offset=offset)
+                        session.add(record)
+                        stats["added"] += 1
+                    else:
+                        stats["updated"] += 1
+                    self._shard(record.shard, writable=True)[record.offset] = enhanced
+                    record.mtime, record.size, record.label = stat.st_mtime, stat.st_size, label
+
+            # Pixel data must reach disk before the index points at it
+            for shard in self._shards.values():
+                if shard.flags.writeable:
+                    shard.flush()
+            self._shards.clear()
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        print("Preprocessing cache: " + ", ".join(f"{count} {name}" for name, count in stats.items()))
+        return stats
+
+    def entries(self):
+        """All cached images as (paths, labels, shards, offsets), ordered by path"""
+        session = self.Session()
+        try:
+            rows = session.query(CachedImage.path, CachedImage.label, CachedImage.shard, CachedImage.offset)\
+                .order_by(CachedImage.path)\
+                .all()
+        finally:
+            session.close()
+        if not rows:
+            return [], np.array([]), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        paths, labels, shards, offsets = zip(*rows)
+        return list(paths), np.array(labels), np.array(shards), np.array(offsets)
+
+    def image(self, shard, offset):
+        """Zero-copy uint8 view of one cached image"""
+        return self._shard(int(shard))[int(offset)]
+
+    def images(self, shards, offsets):
+        """Gather cached images into an (N, 128, 128, 3) uint8 array"""
+        output = np.empty((len(shards),) + IMAGE_SHAPE, dtype=np.uint8)
+        for i, (shard, offset) in enumerate(zip(shards, offsets)):
+            output[i] = self.image(shard, offset)
+        return output
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from sqlalchemy import create_engine, Column, String, Float, Text, func
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+# Persistent cache of identification results, keyed by image content
+CACHE_PATH = os.environ.get("IDENTIFICATION_CACHE_PATH", "identification_cache.db")
+CACHE_MAX_ENTRIES = int(os.environ.get("IDENTIFICATION_CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_SECONDS = float(os.environ.get("IDENTIFICATION_CACHE_TTL", str(7 * 24 * 3600)))
+
+CacheBase = declarative_base()
+
+
+class CachedResult(CacheBase):
+    __tablename__ = 'cached_results'
+
+    key = Column(String(64), primary_key=True)
+    result = Column(Text)  # JSON-encoded result
+    created_at = Column(Float, index=True)
+    last_access = Column(Float, index=True)
+
+    def __repr__(self):
+        return f"<CachedResult(key='{self.key[:12]}...', result={self.result})>"
+
+
+def make_cache_key(image_bytes: bytes, *version_parts) -> str:
+    """Build a cache key from the image content and whatever produced the result"""
+    digest = hashlib.sha256(image_bytes)
+    for part in version_parts:
+        digest.update(b"\0")
+        digest.update(str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """SQLite-backed result cache with TTL and size-based (LRU) eviction"""
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.engine = create_engine(f'sqlite:///{path}')
+        CacheBase.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        """Return the cached result for key, or None if missing or expired"""
+        now = time.time()
+        session = self.Session()
+        try:
+            record = session.get(CachedResult, key)
+            if record is None:
+                self._count(misses=1)
+                return None
+            if self.ttl and now - record.created_at > self.ttl:
+                session.delete(record)
+                session.commit()
+                self._count(misses=1, evictions=1)
+                return None
+            record.last_access = now
+            session.commit()
+            self._count(hits=1)
+            return json.loads(record.result)
+        finally:
+            session.close()
+
+    def set(self, key: str, result):
+        """Store a JSON-serializable result and evict entries over the size limit"""
+        now = time.time()
+        session = self.Session()
+        try:
+            session.merge(CachedResult(
+                key=key,
+                result=json.dumps(result),
+                created_at=now,
+                last_access=now
+            ))
+            session.commit()
+            self._evict(session, now)
+        except Exception as e:
+            session.rollback()
+            print(f"Error writing cache entry: {e}")
+        finally:
+            session.close()
+
+    def _evict(self, session, now):
+        """Drop expired entries, then the least recently used ones above max_entries"""
+        evicted = 0
+        if self.ttl:
+            evicted += session.query(CachedResult)\
+                .filter(CachedResult.created_at < now - self.ttl)\
+                .delete(synchronize_session=False)
+        if self.max_entries:
+            overflow = session.query(func.count(CachedResult.key)).scalar() - self.max_entries
+            if overflow > 0:
+                stale_keys = session.query(CachedResult.key)\
+                    .order_by(CachedResult.last_access.asc())\
+                    .limit(overflow)\
+                    .subquery()
+                evicted += session.query(CachedResult)\
+                    .filter(CachedResult.key.in_(stale_keys.select()))\
+                    .delete(synchronize_session=False)
+        if evicted:
+            session.commit()
+            self._count(evictions=evicted)
+
+    def clear(self):
+        """Remove every cached entry"""
+        session = self.Session()
+        try:
+            session.query(CachedResult).delete()
+            session.commit()
+        finally:
+            session.close()
+
+    def _count(self, hits=0, misses=0, evictions=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters for this process plus the current entry count"""
+        session = self.Session()
+        try:
+            size = session.query(func.count(CachedResult.key)).scalar()
+        finally:
+            session.close()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": size
+            }
@@ -0,0 +1,25 @@
+import os
+import tempfile
+import pytest
+from tests.local_image_server import LocalImageServer
+
+# Modules that open the identification database and result cache at import time get throwaway copies
+_data_dir = tempfile.mkdtemp(prefix="plant-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_data_dir, 'plant_identification.db')}")
+os.environ.setdefault("IDENTIFICATION_CACHE_PATH", os.path.join(_data_dir, "identification_cache.db"))
+
+
+@pytest.fixture
+def image_server():
+    """Start a LocalImageServer built with the given arguments; stopped after the test"""
+    servers = []
+
+    def start(**kwargs):
+        kwargs.setdefault("latency", 0)
+        server = LocalImageServer(**kwargs).__enter__()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.__exit__(None, None, None)
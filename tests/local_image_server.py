@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import cv2
+import numpy as np
+
+
+def encoded_image(seed, size=(320, 240), extension=".jpg"):
+    """A smooth random image encoded with the given extension"""
+    noise = (np.random.default_rng(seed).random((8, 8, 3)) * 255).astype(np.uint8)
+    _, encoded = cv2.imencode(extension, cv2.resize(noise, size, interpolation=cv2.INTER_CUBIC))
+    return encoded.tobytes()
+
+
+class LocalImageServer:
+    """Threaded HTTP stand-in for image sites: /index<k>.html links `images` distinct /img/<n>.jpg
+
+    Every response is delayed by `latency` seconds, and every `flaky_every`th
+    image fails once with a 503 so retries are exercised (0 disables that).
+    `routes` maps extra paths to a list of (status, body, headers) responses
+    served in turn, the last one repeating; a Content-Length header larger
+    than the body makes the server drop the connection mid-body. Requests are
+    counted per path in `hits`, and `max_in_flight` is the most requests
+    handled at once.
+    """
+
+    def __init__(self, images=100, latency=0.05, pages=1, flaky_every=5, routes=None):
+        bodies = [encoded_image(number) for number in range(images * pages)]
+        indexes = {
+            f"/index{page}.html": "".join(
+                f'<img src="/img/{page * images + i}.jpg">' for i in range(images)
+            ).encode()
+            for page in range(pages)
+        }
+        routes = {path: list(responses) for path, responses in (routes or {}).items()}
+        failed_once = set()
+        lock = threading.Lock()
+        server = self
+        self.hits = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with lock:
+                    server.hits[self.path] += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(latency)
+                    self._route()
+                finally:
+                    with lock:
+                        server.in_flight -= 1
+
+            def _route(self):
+                if self.path in routes:
+                    with lock:
+                        responses = routes[self.path]
+                        status, payload, headers = responses.pop(0) if len(responses) > 1 else responses[0]
+                    self._send(status, payload, "application/octet-stream", headers)
+                elif self.path in indexes:
+                    self._send(200, indexes[self.path], "text/html")
+                elif self.path.startswith("/img/"):
+                    number = int(self.path[5:].split(".")[0])
+                    with lock:
+                        flaky = flaky_every and number % flaky_every == 0 and number not in failed_once
+                        failed_once.add(number)
+                    if number >= len(bodies):
+                        self._send(404, b"not found", "text/plain")
+                    elif flaky:
+                        self._send(503, b"busy", "text/plain", {"Retry-After": "0"})
+                    else:
+                        self._send(200, bodies[number], "image/jpeg")
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+            def _send(self, status, payload, content_type, headers=None):
+                headers = dict(headers or {})
+                length = int(headers.pop("Content-Length", len(payload)))
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(length))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+                if length > len(payload):
+                    # Cut the body short, as a dropped connection would
+                    self.close_connection = True
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    pass  # client dropped a pooled keep-alive connection
+
+            def log_message(self, *args):
+                pass
+
+        self.failed_once = failed_once
+        ThreadingHTTPServer.request_queue_size = 128
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,144 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import cascade
+import model_utils
+from cascade import HISTORY, LOCAL, VISION, PlantCascade
+from tests.local_image_server import encoded_image
+
+CLASSES = np.array(["Aloevera", "Neem", "Tulsi"])
+
+
+class FakeModel:
+    """Stands in for the classifier: every image gets the same probabilities"""
+
+    def __init__(self, *probabilities):
+        self.probabilities = np.array(probabilities, dtype=np.float32)
+
+    def outputs(self, images):
+        return np.tile(self.probabilities, (len(images), 1))
+
+
+class FakeIndex:
+    """Embedding index whose nearest training image is always `distance` away"""
+
+    def __init__(self, distance, threshold=0.5):
+        self.distance = distance
+        self.threshold = threshold
+
+    def identify(self, embedding):
+        known = self.distance <= self.threshold
+        return {'plant_name': "Neem" if known else "Unknown", 'distance': self.distance, 'known': known,
+                'neighbours': [("data/training/Neem/1.jpg", "Neem", self.distance)]}
+
+
+@pytest.fixture(autouse=True)
+def fake_backend(monkeypatch):
+    """Route the local tier's forward passes to FakeModel and start with an empty history"""
+    monkeypatch.setattr(model_utils, "predict_probabilities", lambda model, images, batch_size: model.outputs(images))
+    monkeypatch.setattr(model_utils, "predict_embeddings",
+                        lambda model, images, batch_size: (np.zeros((len(images), 8)), model.outputs(images)))
+    monkeypatch.setattr(cascade, "find_near_duplicate", lambda image_hash, max_distance: None)
+
+
+@pytest.fixture
+def vision_calls():
+    return []
+
+
+def make_cascade(vision_calls, *probabilities, index=None):
+    def vision_identify(image_bytes, image_hash=None):
+        vision_calls.append(image_hash)
+        return "Tulsi", 88.0
+
+    model_tuple = (FakeModel(*probabilities), SimpleNamespace(classes_=CLASSES))
+    plant_cascade = PlantCascade(model_tuple=model_tuple, vision_identify=vision_identify, min_confidence=0.8,
+                                 min_margin=0.2, embedding_index=index)
+    # No index on disk is looked up when the test did not pass one
+    plant_cascade._index_recheck_at = float("inf")
+    return plant_cascade
+
+
+def test_near_duplicate_in_history_short_circuits(monkeypatch, vision_calls):
+    monkeypatch.setattr(cascade, "find_near_duplicate", lambda image_hash, max_distance: ("Neem", 93.0))
+    plant_cascade = make_cascade(vision_calls, 0.1, 0.1, 0.8)
+
+    result = plant_cascade.identify(encoded_image(1))
+
+    assert (result['plant_name'], result['confidence'], result['tier']) == ("Neem", 93.0, HISTORY)
+    assert result['local'] is None and LOCAL not in result['latency_ms']
+    assert vision_calls == []
+
+
+def test_confident_local_answer_is_accepted(vision_calls):
+    result = make_cascade(vision_calls, 0.05, 0.9, 0.05).identify(encoded_image(1))
+
+    assert (result['plant_name'], result['tier'], result['escalation_reason']) == ("Neem", LOCAL, None)
+    assert result['confidence'] == pytest.approx(90.0)
+    assert vision_calls == []
+
+
+def test_low_confidence_escalates(vision_calls):
+    result = make_cascade(vision_calls, 0.3, 0.6, 0.1).identify(encoded_image(1))
+
+    assert (result['plant_name'], result['tier']) == ("Tulsi", VISION)
+    assert result['escalation_reason'].startswith("local confidence 60.0%")
+    assert result['local'][0] == "Neem"
+    assert len(vision_calls) == 1
+
+
+def test_small_top2_margin_escalates(vision_calls):
+    result = make_cascade(vision_calls, 0.0, 0.85, 0.7).identify(encoded_image(1))
+
+    assert result['tier'] == VISION
+    assert result['escalation_reason'].startswith("top-2 margin")
+
+
+def test_embedding_index_rejection_escalates(vision_calls):
+    result = make_cascade(vision_calls, 0.02, 0.96, 0.02, index=FakeIndex(0.9)).identify(encoded_image(1))
+
+    assert result['tier'] == VISION
+    assert result['escalation_reason'] == "nearest training image at distance 0.900, beyond 0.500"
+    assert result['neighbours'] == [("data/training/Neem/1.jpg", "Neem", 0.9)]
+
+
+def test_embedding_index_match_keeps_local_answer(vision_calls):
+    result = make_cascade(vision_calls, 0.02, 0.96, 0.02, index=FakeIndex(0.1)).identify(encoded_image(1))
+
+    assert (result['plant_name'], result['tier']) == ("Neem", LOCAL)
+    assert result['neighbours'][0][1] == "Neem"
+
+
+def test_undecodable_image_escalates(vision_calls):
+    result = make_cascade(vision_calls, 0.02, 0.96, 0.02).identify(b"not an image")
+
+    assert result['tier'] == VISION
+    assert result['escalation_reason'] == "image could not be decoded"
+
+
+def test_missing_model_escalates(vision_calls):
+    plant_cascade = make_cascade(vision_calls)
+    plant_cascade.model_tuple = None
+    plant_cascade._model_recheck_at = float("inf")
+
+    result = plant_cascade.identify(encoded_image(1))
+
+    assert result['tier'] == VISION
+    assert result['escalation_reason'] == "no local model"
+
+
+def test_stats_count_tiers_and_escalation_rate(monkeypatch, vision_calls):
+    plant_cascade = make_cascade(vision_calls, 0.05, 0.9, 0.05)
+    for seed in range(3):
+        plant_cascade.identify(encoded_image(seed))
+    plant_cascade.model_tuple[0].probabilities = np.array([0.4, 0.5, 0.1], dtype=np.float32)
+    plant_cascade.identify(encoded_image(3))
+    monkeypatch.setattr(cascade, "find_near_duplicate", lambda image_hash, max_distance: ("Neem", 93.0))
+    plant_cascade.identify(encoded_image(4))
+
+    stats = plant_cascade.stats()
+
+    assert stats['identifications'] == 5
+    assert stats['escalation_rate'] == pytest.approx(1 / 5)
+    assert [stats[tier]['answered'] for tier in (HISTORY, LOCAL, VISION)] == [1, 3, 1]
+    assert stats[VISION]['p50_ms'] is not None and stats[HISTORY]['p99_ms'] is not None
@@ -0,0 +1,29 @@
+import io
+import zipfile
+import dataset_ingest
+from dataset_ingest import ingest_zip
+from tests.local_image_server import encoded_image
+
+
+def corrupt_member(archive_bytes, payload):
+    """Flip a byte inside a stored member's data, so reading it fails its CRC check"""
+    offset = archive_bytes.index(payload) + len(payload) // 2
+    return archive_bytes[:offset] + bytes([archive_bytes[offset] ^ 0xFF]) + archive_bytes[offset + 1:]
+
+
+def test_progress_reported_for_every_member(monkeypatch, tmp_path):
+    small, large, broken = encoded_image(1, size=(64, 48)), encoded_image(2, size=(640, 480)), encoded_image(3, size=(64, 48))
+    monkeypatch.setattr(dataset_ingest, "MAX_MEMBER_BYTES", len(large) - 1)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("small.jpg", small)
+        archive.writestr("large.jpg", large)
+        archive.writestr("broken.jpg", broken)
+        archive.writestr("notes.jpg", b"not an image")
+    progress = []
+
+    stats = ingest_zip(io.BytesIO(corrupt_member(buffer.getvalue(), broken)), str(tmp_path),
+                       on_progress=lambda done, total: progress.append((done, total)))
+
+    assert (stats['saved'], stats['skipped'], stats['invalid']) == (1, 1, 2)
+    assert progress == [(done, 4) for done in range(1, 5)]
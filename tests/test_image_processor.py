@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+import pytest
+from image_processor import preprocess_batch, preprocess_image
+
+
+def smooth_images(count, size=(320, 240), seed=0):
+    rng = np.random.default_rng(seed)
+    width, height = size
+    images = []
+    for _ in range(count):
+        noise = (rng.random((height // 8, width // 8, 3)) * 255).astype(np.uint8)
+        images.append(cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC))
+    return images
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+@pytest.mark.parametrize("fast", [False, True])
+def test_preprocess_batch_matches_preprocess_image(workers, fast):
+    images = smooth_images(6, size=(1600, 1200) if fast else (320, 240))
+    expected = np.stack([preprocess_image(image, fast=fast) for image in images])
+
+    batch = preprocess_batch(images, workers=workers, fast=fast)
+
+    assert batch.dtype == np.float32
+    np.testing.assert_allclose(batch, expected, rtol=0, atol=1e-7)
+
+
+def test_preprocess_batch_writes_into_out():
+    images = smooth_images(3)
+    out = np.zeros((3, 128, 128, 3), dtype=np.float32)
+
+    assert preprocess_batch(images, out=out) is out
+    np.testing.assert_allclose(out, np.stack([preprocess_image(image) for image in images]), rtol=0, atol=1e-7)
+
+
+def test_preprocess_batch_rejects_mismatched_out():
+    with pytest.raises(ValueError):
+        preprocess_batch(smooth_images(2), out=np.zeros((3, 128, 128, 3), dtype=np.float32))
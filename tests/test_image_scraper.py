@@ -0,0 +1,109 @@
+import os
+import pytest
+import image_scraper
+from download_manifest import DownloadManifest, DONE, FAILED
+from image_scraper import download_dataset, download_image, download_to_dataset
+from tests.local_image_server import encoded_image
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays the scraper chose between retries, without actually waiting"""
+    delays = []
+    retry_delay = image_scraper._retry_delay
+
+    def recorded_delay(*args, **kwargs):
+        delays.append(retry_delay(*args, **kwargs))
+        return delays[-1]
+
+    monkeypatch.setattr(image_scraper, "_retry_delay", recorded_delay)
+    monkeypatch.setattr(image_scraper.time, "sleep", lambda seconds: None)
+    return delays
+
+
+def listing(directory):
+    return sorted(os.listdir(directory))
+
+
+def test_retries_429_and_5xx_with_backoff(image_server, sleeps, tmp_path):
+    image = encoded_image(1)
+    server = image_server(routes={"/flaky.jpg": [(429, b"slow down", {"Retry-After": "3"}),
+                                                  (503, b"busy", {}),
+                                                  (200, image, {})]})
+    save_path = str(tmp_path / "flaky.jpg")
+
+    assert download_image(server.url + "/flaky.jpg", save_path)
+    assert server.hits["/flaky.jpg"] == 3
+    # Retry-After is honoured; without it the delay is exponential backoff with jitter
+    assert sleeps[0] == 3.0
+    assert 0 < sleeps[1] <= image_scraper.MAX_BACKOFF * 1.5
+    assert listing(tmp_path) == ["flaky.jpg"]
+
+
+def test_retry_after_is_capped(image_server, sleeps, tmp_path):
+    server = image_server(routes={"/busy.jpg": [(429, b"", {"Retry-After": "86400"}), (200, encoded_image(2), {})]})
+
+    assert download_image(server.url + "/busy.jpg", str(tmp_path / "busy.jpg"))
+    assert sleeps == [image_scraper.MAX_BACKOFF]
+
+
+def test_gives_up_after_last_retry(image_server, sleeps, tmp_path):
+    server = image_server(routes={"/down.jpg": [(503, b"busy", {})]})
+
+    assert not download_image(server.url + "/down.jpg", str(tmp_path / "down.jpg"), retries=2)
+    assert server.hits["/down.jpg"] == 3
+    assert listing(tmp_path) == []
+
+
+def test_oversized_download_is_aborted(image_server, monkeypatch, tmp_path):
+    monkeypatch.setattr(image_scraper, "MAX_IMAGE_BYTES", 1024)
+    server = image_server(routes={"/huge.jpg": [(200, encoded_image(3, size=(640, 480)), {})]})
+
+    assert not download_image(server.url + "/huge.jpg", str(tmp_path / "huge.jpg"))
+    assert listing(tmp_path) == []
+
+
+def test_truncated_download_leaves_no_part_file(image_server, tmp_path):
+    image = encoded_image(4)
+    server = image_server(routes={"/cut.jpg": [(200, image[:len(image) // 2], {"Content-Length": str(len(image))})]})
+
+    assert not download_image(server.url + "/cut.jpg", str(tmp_path / "cut.jpg"))
+    assert listing(tmp_path) == []
+
+
+def test_dataset_download_streams_through_part_file_and_cleans_up(image_server, tmp_path):
+    image = encoded_image(5)
+    server = image_server(routes={"/ok.jpg": [(200, image, {})],
+                                  "/cut.jpg": [(200, image[:100], {"Content-Length": str(len(image))})]})
+    save_dir = tmp_path / "Tulsi"
+    save_dir.mkdir()
+    manifest = DownloadManifest(str(tmp_path / "manifest.db"))
+
+    assert not download_to_dataset(server.url + "/cut.jpg", str(save_dir), manifest)
+    assert listing(save_dir) == []
+    assert download_to_dataset(server.url + "/ok.jpg", str(save_dir), manifest)
+    saved = listing(save_dir)
+    assert len(saved) == 1 and saved[0].endswith(".jpg")
+    assert manifest.counts() == {DONE: 1, FAILED: 1}
+
+
+def test_per_host_concurrency_limit(image_server, tmp_path):
+    server = image_server(images=24, latency=0.05, flaky_every=0)
+    urls = [f"{server.url}/img/{i}.jpg" for i in range(24)]
+
+    count = download_dataset(str(tmp_path / "Neem"), num_images=24, image_urls=urls, max_workers=8, max_per_host=2,
+                             manifest=DownloadManifest(str(tmp_path / "manifest.db")))
+
+    assert count == 24
+    assert server.max_in_flight == 2
+
+
+def test_webp_download_is_stored_as_jpeg(image_server, tmp_path):
+    server = image_server(routes={"/leaf.webp": [(200, encoded_image(6, extension=".webp"), {})]})
+    save_dir = tmp_path / "Aloevera"
+    save_dir.mkdir()
+
+    assert download_to_dataset(server.url + "/leaf.webp", str(save_dir), DownloadManifest(str(tmp_path / "manifest.db")))
+    saved = listing(save_dir)
+    assert len(saved) == 1 and saved[0].endswith(".jpg")
+    assert (save_dir / saved[0]).read_bytes()[:3] == b"\xff\xd8\xff"
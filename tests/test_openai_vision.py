@@ -0,0 +1,35 @@
+import json
+import pytest
+from openai_vision import _parse_response
+from vision_client import VisionAPIError
+
+
+def answer(**fields):
+    result = {"plant_name": "Neem", "features_matched": ["compound leaves"], "missing_features": [],
+              "explanation": "Leaflets match"}
+    result.update(fields)
+    return json.dumps(result)
+
+
+def test_parse_response_identified_plant():
+    plant_name, confidence = _parse_response(answer())
+    assert plant_name == "Neem"
+    assert 96.0 <= confidence <= 98.0
+
+
+def test_parse_response_unknown_plant():
+    assert _parse_response(answer(plant_name="Unknown")) == ("Unknown", 0.0)
+
+
+@pytest.mark.parametrize("content", [
+    "not json",
+    None,
+    json.dumps(["Neem"]),
+    answer(features_matched=["leaves", 3]),
+    answer(missing_features="flowers"),
+    answer(plant_name=None),
+    answer(explanation={"text": "nested"}),
+])
+def test_parse_response_rejects_malformed_answers(content):
+    with pytest.raises(VisionAPIError):
+        _parse_response(content)
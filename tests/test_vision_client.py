@@ -0,0 +1,176 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import openai
+import pytest
+from vision_client import MAX_BACKOFF, AsyncVisionClient, CircuitBreaker, CircuitOpenError, VisionAPIError, \
+    _retry_delay
+
+
+class FakeCompletions:
+    """Stands in for client.chat.completions: runs each queued behaviour in turn"""
+
+    def __init__(self, *behaviours):
+        self.behaviours = list(behaviours)
+        self.calls = 0
+
+    async def create(self, **request):
+        behaviour = self.behaviours[min(self.calls, len(self.behaviours) - 1)]
+        self.calls += 1
+        if isinstance(behaviour, BaseException):
+            raise behaviour
+        if callable(behaviour):
+            return await behaviour()
+        return behaviour
+
+
+class FakeOpenAI:
+    def __init__(self, completions):
+        self.chat = type('Chat', (), {'completions': completions})()
+
+
+def make_client(completions, **kwargs):
+    client = AsyncVisionClient(api_key='test', requests_per_second=1000, backoff=0.001, **kwargs)
+    client.client = FakeOpenAI(completions)
+    return client
+
+
+def status_error(status_code, headers=None):
+    response = SimpleNamespace(status_code=status_code, headers=headers or {}, request=None)
+    return openai.APIStatusError(f"HTTP {status_code}", response=response, body=None)
+
+
+def connection_error():
+    return openai.APIConnectionError(request=None)
+
+
+def open_breaker(reset_timeout=0.05):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=reset_timeout)
+    breaker.record_failure()
+    time.sleep(reset_timeout)
+    assert breaker.state == 'half-open'
+    return breaker
+
+
+def test_half_open_trial_cut_short_by_deadline_reopens_circuit():
+    async def hang():
+        await asyncio.sleep(10)
+
+    breaker = open_breaker()
+    client = make_client(FakeCompletions(hang), deadline=0.05, circuit_breaker=breaker)
+    with pytest.raises(VisionAPIError):
+        asyncio.run(client.create_chat_completion(model='test'))
+    assert breaker.state == 'open'
+
+    time.sleep(breaker.reset_timeout)
+    assert breaker.allow()
+
+
+def test_cancelled_half_open_trial_lets_circuit_recover():
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def cancel_trial(client):
+        task = asyncio.create_task(client.create_chat_completion(model='test'))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    breaker = open_breaker()
+    client = make_client(FakeCompletions(hang, 'answer'), circuit_breaker=breaker)
+    asyncio.run(cancel_trial(client))
+
+    time.sleep(breaker.reset_timeout)
+    assert asyncio.run(client.create_chat_completion(model='test')) == 'answer'
+    assert breaker.state == 'closed'
+
+
+def test_retryable_errors_are_retried_until_success():
+    completions = FakeCompletions(connection_error(), status_error(503), 'answer')
+    client = make_client(completions)
+
+    assert asyncio.run(client.create_chat_completion(model='test')) == 'answer'
+    assert completions.calls == 3
+    assert client.stats['retries'] == 2
+    assert client.circuit_breaker.state == 'closed'
+
+
+def test_gives_up_after_max_retries():
+    completions = FakeCompletions(status_error(503))
+    client = make_client(completions, max_retries=2, circuit_breaker=CircuitBreaker(failure_threshold=100))
+
+    with pytest.raises(VisionAPIError) as error:
+        asyncio.run(client.create_chat_completion(model='test'))
+    assert error.value.status_code == 503
+    assert completions.calls == 3
+    assert client.stats['failures'] == 1
+
+
+def test_client_errors_are_not_retried_and_do_not_trip_the_breaker():
+    completions = FakeCompletions(status_error(400))
+    breaker = CircuitBreaker(failure_threshold=1)
+    client = make_client(completions, circuit_breaker=breaker)
+
+    with pytest.raises(VisionAPIError) as error:
+        asyncio.run(client.create_chat_completion(model='test'))
+    assert error.value.status_code == 400
+    assert completions.calls == 1
+    assert breaker.state == 'closed'
+
+
+def test_deadline_bounds_the_whole_call_including_retries():
+    async def slow():
+        await asyncio.sleep(0.03)
+        raise connection_error()
+
+    client = make_client(FakeCompletions(slow), max_retries=100, deadline=0.1,
+                         circuit_breaker=CircuitBreaker(failure_threshold=1000))
+    start = time.monotonic()
+    with pytest.raises(VisionAPIError, match="did not complete"):
+        asyncio.run(client.create_chat_completion(model='test'))
+    assert time.monotonic() - start < 1.0
+
+
+def test_retry_after_is_honoured_up_to_max_backoff():
+    assert _retry_delay(0, status_error(429, {'retry-after': '2'})) == 2.0
+    assert _retry_delay(0, status_error(429, {'retry-after': '3600'})) == MAX_BACKOFF
+
+
+def test_circuit_opens_fails_fast_then_closes_after_successful_trial():
+    completions = FakeCompletions(status_error(503), status_error(503), 'answer')
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    client = make_client(completions, max_retries=0, circuit_breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(VisionAPIError):
+            asyncio.run(client.create_chat_completion(model='test'))
+    assert breaker.state == 'open'
+
+    # Refused without calling the API
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(client.create_chat_completion(model='test'))
+    assert completions.calls == 2
+    assert client.stats['rejected'] == 1
+
+    time.sleep(breaker.reset_timeout)
+    assert breaker.state == 'half-open'
+    assert asyncio.run(client.create_chat_completion(model='test')) == 'answer'
+    assert breaker.state == 'closed'
+
+
+def test_failed_half_open_trial_reopens_circuit():
+    breaker = open_breaker()
+    client = make_client(FakeCompletions(status_error(503)), max_retries=0, circuit_breaker=breaker)
+
+    with pytest.raises(VisionAPIError):
+        asyncio.run(client.create_chat_completion(model='test'))
+    assert breaker.state == 'open'
+
+
+def test_only_one_half_open_trial_at_a_time():
+    breaker = open_breaker()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
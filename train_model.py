@@ -1,14 +1,184 @@
 
+import argparse
 import os
+import shutil
+import time
+from contextlib import contextmanager
 import cv2
 import numpy as np
 from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder
 import tensorflow as tf
 from tensorflow.keras.applications import EfficientNetB0
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D
 from tensorflow.keras.models import Model
 import joblib
 from image_processor import preprocess_image
+from preprocess_cache import PreprocessCache, DEFAULT_CACHE_DIR
+from dataset_catalog import get_catalog
+from model_export import DEFAULT_QUANTIZATIONS, QUANTIZATIONS, export_tflite
+from embedding_index import EMBEDDING_INDEX_PATH, build_embedding_index
+from model_utils import MODEL_PATH, ENCODER_PATH, tflite_path
+
+IMAGE_SHAPE = (128, 128, 3)
+CHECKPOINT_DIR = 'models/checkpoints'
+# Content hashes of the images the saved model was trained on
+MANIFEST_PATH = 'models/training_manifest.joblib'
+# Previously seen images replayed per new image when fine-tuning
+DEFAULT_REPLAY_RATIO = 1.0
+
+class TrainingConfig:
+    """Settings for one training run
+
+    learning_rate is the Adam rate for base_batch_size; the rate actually used
+    is scaled linearly with batch_size, so larger batches (which need fewer,
+    cheaper steps per epoch) keep roughly the same per-epoch progress.
+    jit_compile has XLA compile the train step; it is off by default because
+    XLA's CPU backend runs EfficientNet's convolutions far slower than
+    TensorFlow's oneDNN kernels (benchmarks.py training-config), so enable it
+    on GPU machines or after measuring. mixed_precision is False,
+    True or 'auto' (only on CPUs with native bfloat16, see
+    bfloat16_supported) and trains in mixed_bfloat16 with float32 weights.
+    intra_op_threads/inter_op_threads size TensorFlow's thread pools; None
+    keeps TensorFlow's choice. weights initializes the backbone for a full
+    training run; fine_tune_epochs and fine_tune_learning_rate (also scaled
+    with batch_size) apply to fine_tune_model().
+    """
+
+    def __init__(self, batch_size=16, epochs=30, learning_rate=1e-3, base_batch_size=16, jit_compile=False,
+                 mixed_precision=False, intra_op_threads=None, inter_op_threads=None, patience=5,
+                 weights='imagenet', fine_tune_epochs=5, fine_tune_learning_rate=1e-4):
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.base_batch_size = base_batch_size
+        self.jit_compile = jit_compile
+        self.mixed_precision = mixed_precision
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.patience = patience
+        self.weights = weights
+        self.fine_tune_epochs = fine_tune_epochs
+        self.fine_tune_learning_rate = fine_tune_learning_rate
+
+    @property
+    def scaled_learning_rate(self):
+        return self.learning_rate * self.batch_size / self.base_batch_size
+
+    @property
+    def scaled_fine_tune_learning_rate(self):
+        return self.fine_tune_learning_rate * self.batch_size / self.base_batch_size
+
+    @classmethod
+    def from_env(cls):
+        """Defaults overridden by TRAIN_BATCH_SIZE, TRAIN_EPOCHS, TRAIN_FINE_TUNE_EPOCHS, TRAIN_LEARNING_RATE,
+        TRAIN_JIT_COMPILE (0/1), TRAIN_MIXED_PRECISION (0/1/auto), TRAIN_INTRA_OP_THREADS and
+        TRAIN_INTER_OP_THREADS"""
+        env = os.environ
+        config = cls()
+        config.batch_size = int(env.get('TRAIN_BATCH_SIZE', config.batch_size))
+        config.epochs = int(env.get('TRAIN_EPOCHS', config.epochs))
+        config.fine_tune_epochs = int(env.get('TRAIN_FINE_TUNE_EPOCHS', config.fine_tune_epochs))
+        config.learning_rate = float(env.get('TRAIN_LEARNING_RATE', config.learning_rate))
+        config.jit_compile = env.get('TRAIN_JIT_COMPILE', '1' if config.jit_compile else '0') == '1'
+        mixed_precision = env.get('TRAIN_MIXED_PRECISION', '0')
+        config.mixed_precision = 'auto' if mixed_precision == 'auto' else mixed_precision == '1'
+        if 'TRAIN_INTRA_OP_THREADS' in env:
+            config.intra_op_threads = int(env['TRAIN_INTRA_OP_THREADS'])
+        if 'TRAIN_INTER_OP_THREADS' in env:
+            config.inter_op_threads = int(env['TRAIN_INTER_OP_THREADS'])
+        return config
+
+    def __repr__(self):
+        return (f"<TrainingConfig(batch_size={self.batch_size}, learning_rate={self.scaled_learning_rate:g}, "
+                f"jit_compile={self.jit_compile}, mixed_precision={self.mixed_precision})>")
+
+def bfloat16_supported():
+    """True if the CPU has native bfloat16 instructions (AVX512-BF16 or AMX), where mixed_bfloat16 pays off"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = next((line.split(':', 1)[1].split() for line in f if line.startswith('flags')), [])
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def configure_runtime(config):
+    """Apply the config's thread counts and precision policy; returns the settings in effect
+
+    Thread counts can only change before TensorFlow runs its first op. oneDNN
+    is switched by the TF_ENABLE_ONEDNN_OPTS environment variable, which
+    TensorFlow reads when it is imported, so it is only reported here.
+    """
+    try:
+        if config.intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(config.intra_op_threads)
+        if config.inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(config.inter_op_threads)
+    except RuntimeError as e:
+        print(f"Could not change TensorFlow thread counts: {e}")
+
+    mixed_precision = config.mixed_precision
+    if mixed_precision == 'auto':
+        mixed_precision = bfloat16_supported()
+    elif mixed_precision and not bfloat16_supported():
+        print("This CPU has no native bfloat16 support; mixed precision will likely be slower")
+    tf.keras.mixed_precision.set_global_policy('mixed_bfloat16' if mixed_precision else 'float32')
+
+    settings = {
+        'onednn': os.environ.get('TF_ENABLE_ONEDNN_OPTS', '1') != '0',
+        'intra_op_threads': tf.config.threading.get_intra_op_parallelism_threads() or os.cpu_count(),
+        'inter_op_threads': tf.config.threading.get_inter_op_parallelism_threads() or 'auto',
+        'precision': tf.keras.mixed_precision.global_policy().name,
+        'jit_compile': config.jit_compile,
+        'batch_size': config.batch_size,
+        'learning_rate': config.scaled_learning_rate,
+    }
+    print("Training settings: " + ", ".join(f"{name} {value}" for name, value in settings.items()))
+    return settings
+
+@contextmanager
+def training_runtime(config):
+    """configure_runtime() for one training run, putting back the global precision policy afterwards
+
+    The policy is restored even if training fails, so models built later in
+    the process (inference, export) never silently run in mixed precision.
+    """
+    policy = tf.keras.mixed_precision.global_policy()
+    try:
+        yield configure_runtime(config)
+    finally:
+        tf.keras.mixed_precision.set_global_policy(policy)
+
+class ThroughputReport(tf.keras.callbacks.Callback):
+    """Prints wall-clock time and training images/sec for every epoch"""
+
+    def __init__(self, images_per_epoch):
+        super().__init__()
+        self.images_per_epoch = images_per_epoch
+        self.epochs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._train_end = None
+
+    def on_test_begin(self, logs=None):
+        if self._train_end is None:
+            self._train_end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        end = time.perf_counter()
+        train_seconds = (self._train_end or end) - self._epoch_start
+        self.epochs.append({'epoch': epoch + 1, 'seconds': end - self._epoch_start, 'train_seconds': train_seconds,
+                            'images_per_second': self.images_per_epoch / train_seconds})
+        print(f"Epoch {epoch + 1}: {end - self._epoch_start:.1f} s wall clock, "
+              f"{self.images_per_epoch / train_seconds:.1f} training images/sec")
+
+    def summary(self):
+        """Total wall clock and median training images/sec over the epochs run"""
+        if not self.epochs:
+            return {'epochs': 0, 'seconds': 0.0, 'images_per_second': 0.0}
+        return {'epochs': len(self.epochs), 'seconds': sum(epoch['seconds'] for epoch in self.epochs),
+                'images_per_second': float(np.median([epoch['images_per_second'] for epoch in self.epochs]))}
 
 def load_training_data(data_dir):
     """Load training images and labels from data directory"""
@@ -16,38 +186,82 @@ def load_training_data(data_dir):
     labels = []
 
     print("Loading training data...")
-    for plant_class in os.listdir(data_dir):
-        class_dir = os.path.join(data_dir, plant_class)
-        if not os.path.isdir(class_dir):
+    for i, (image_path, plant_class) in enumerate(iter_training_files(data_dir)):
+        if i % 100 == 0:
+            print(f"Processed {i} images")
+        try:
+            image = cv2.imread(image_path)
+            if image is None:
+                continue
+
+            processed_image = preprocess_image(image)
+            images.append(processed_image)
+            labels.append(plant_class)
+
+        except Exception as e:
+            print(f"Error processing {image_path}: {e}")
             continue
 
-        print(f"Processing {plant_class} images...")
-        class_files = [f for f in os.listdir(class_dir) 
-                      if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    return np.array(images), np.array(labels)
+
+def iter_training_files(data_dir):
+    """Yield (image_path, plant_class) for every readable image under data_dir, without decoding them
 
-        for i, image_file in enumerate(class_files):
-            if i % 100 == 0:
-                print(f"Processed {i}/{len(class_files)} {plant_class} images")
+    Files come from the dataset catalog, which is brought up to date first
+    (only files whose size or mtime changed are read).
+    """
+    catalog = get_catalog(data_dir)
+    catalog.refresh(full=True)
+    yield from zip(*catalog.files())
 
-            image_path = os.path.join(class_dir, image_file)
-            try:
-                image = cv2.imread(image_path)
-                if image is None:
-                    continue
+def _read_and_preprocess(image_path):
+    """Decode and preprocess one image; returns (image, ok) so unreadable files can be dropped"""
+    try:
+        image = cv2.imread(image_path.decode('utf-8'))
+        if image is not None:
+            return preprocess_image(image), True
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+    return np.zeros(IMAGE_SHAPE, dtype=np.float32), False
 
-                processed_image = preprocess_image(image)
-                images.append(processed_image)
-                labels.append(plant_class)
+def make_dataset(image_paths, labels, batch_size=16, shuffle=True, shuffle_buffer=10000, seed=None):
+    """Build a streaming tf.data pipeline over image files
 
-            except Exception as e:
-                print(f"Error processing {image_path}: {e}")
-                continue
+    Only paths are held in memory: files are decoded and preprocessed in
+    parallel across cores as batches are consumed, shuffled through a bounded
+    buffer and prefetched, so the dataset can be larger than RAM.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices((list(image_paths), labels))
+    if shuffle:
+        dataset = dataset.shuffle(min(len(labels), shuffle_buffer), seed=seed, reshuffle_each_iteration=True)
 
-    return np.array(images), np.array(labels)
+    def load(image_path, label):
+        image, ok = tf.numpy_function(_read_and_preprocess, [image_path], [tf.float32, tf.bool])
+        image.set_shape(IMAGE_SHAPE)
+        return image, label, ok
 
-def create_efficientnet_model(num_classes):
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    dataset = dataset.filter(lambda image, label, ok: ok)
+    dataset = dataset.map(lambda image, label, ok: (image, label))
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+def make_cached_dataset(cache, shards, offsets, labels, batch_size=16, shuffle=True, shuffle_buffer=10000, seed=None):
+    """Like make_dataset, but reads preprocessed images straight from the cache's memory-mapped shards"""
+    dataset = tf.data.Dataset.from_tensor_slices((np.stack([shards, offsets], axis=1), labels))
+    if shuffle:
+        dataset = dataset.shuffle(min(len(labels), shuffle_buffer), seed=seed, reshuffle_each_iteration=True)
+
+    def load(location, label):
+        image = tf.numpy_function(lambda loc: cache.image(loc[0], loc[1]), [location], tf.uint8)
+        image.set_shape(IMAGE_SHAPE)
+        return tf.cast(image, tf.float32) / 255.0, label
+
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+def create_efficientnet_model(num_classes, weights='imagenet'):
     """Create EfficientNet model with enhanced architecture for better recall"""
-    base_model = EfficientNetB0(weights='imagenet', include_top=False, input_shape=(128, 128, 3))
+    base_model = EfficientNetB0(weights=weights, include_top=False, input_shape=(128, 128, 3))
     
     # Freeze early layers
     for layer in base_model.layers[:100]:
@@ -59,90 +273,329 @@ def create_efficientnet_model(num_classes):
     x = tf.keras.layers.Dropout(0.3)(x)
     x = Dense(256, activation='relu')(x)
     x = tf.keras.layers.Dropout(0.2)(x)
-    predictions = Dense(num_classes, activation='softmax')(x)
+    # Softmax in float32 even when training with mixed precision
+    predictions = Dense(num_classes, activation='softmax', dtype='float32')(x)
     model = Model(inputs=base_model.input, outputs=predictions)
     return model
 
-def train_model(data_dir='data/training'):
-    """Train the plant identification model using EfficientNet"""
-    print("Loading training data...")
-    X, y = load_training_data(data_dir)
-
-    if len(X) == 0:
-        raise ValueError("No training data found! Please add some images first.")
-
-    if len(np.unique(y)) < 2:
-        raise ValueError("Need images from at least 2 different plant categories for training.")
+def compile_for_training(model, config, learning_rate=None):
+    """Compile once with the config's learning rate and XLA setting, tracking the recall early stopping watches"""
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate or config.scaled_learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy', tf.keras.metrics.Recall(name='recall')],
+        jit_compile=config.jit_compile
+    )
+    return model
 
-    print(f"Loaded {len(X)} images from {len(np.unique(y))} classes")
+def _class_weights(y_encoded, num_classes, train_size):
+    """Inverse-frequency weights to handle imbalanced data; classes without images get 1.0"""
+    counts = np.bincount(y_encoded, minlength=num_classes)
+    present = np.count_nonzero(counts)
+    return {i: train_size / (present * counts[i]) if counts[i] else 1.0 for i in range(num_classes)}
 
-    # Convert labels to categorical
-    from sklearn.preprocessing import LabelEncoder
-    label_encoder = LabelEncoder()
-    y_encoded = label_encoder.fit_transform(y)
-    y_categorical = tf.keras.utils.to_categorical(y_encoded)
+def _backup_callback(name, classes, resume):
+    """Per-epoch backup under CHECKPOINT_DIR/name, to resume an interrupted run
 
-    # Split with stratification
-    X_train, X_val, y_train, y_val = train_test_split(
-        X, y_categorical, test_size=0.2, random_state=42, stratify=y_encoded
-    )
+    A backup is only resumed if it was made for the same classes; otherwise,
+    or with resume=False, the run starts over.
+    """
+    directory = os.path.join(CHECKPOINT_DIR, name)
+    backup_dir = os.path.join(directory, 'backup')
+    classes_path = os.path.join(directory, 'classes.joblib')
+    if os.path.exists(backup_dir):
+        if resume and os.path.exists(classes_path) and list(joblib.load(classes_path)) == list(classes):
+            print(f"Resuming {name} from the last completed epoch in {backup_dir}")
+        else:
+            print(f"Discarding the {name} checkpoint in {backup_dir} and starting over")
+            shutil.rmtree(directory)
+    os.makedirs(directory, exist_ok=True)
+    joblib.dump(list(classes), classes_path)
+    return tf.keras.callbacks.BackupAndRestore(backup_dir)
 
-    # Create and compile model
-    model = create_efficientnet_model(len(np.unique(y)))
-    model.compile(
-        optimizer='adam',
-        loss='categorical_crossentropy',
-        metrics=['accuracy']
-    )
+def _fit(model, train_dataset, val_dataset, train_size, class_weights, epochs, config, backup):
+    """Fit with early stopping on validation recall, the backup callback and a throughput report; returns its summary
 
-    # Train model with recall metric
-    print("Training model with EfficientNet...")
-    recall = tf.keras.metrics.Recall()
-    model.compile(
-        optimizer='adam',
-        loss='categorical_crossentropy',
-        metrics=['accuracy', recall]
-    )
-    
-    # Use class weights to handle imbalanced data
-    class_weights = {i: len(y_train) / (len(np.unique(y_encoded)) * np.sum(y_encoded == i)) 
-                    for i in range(len(np.unique(y_encoded)))}
-    
-    # Use early stopping to prevent overfitting
+    Early stopping restores the best epoch's weights, so no separate
+    best-weights checkpoint is kept. The backup is removed once fit()
+    completes, so only an interrupted run leaves one behind.
+    """
     early_stopping = tf.keras.callbacks.EarlyStopping(
         monitor='val_recall',
-        patience=5,
+        patience=config.patience,
         mode='max',
         restore_best_weights=True
     )
-    
-    history = model.fit(
-        X_train, y_train,
-        batch_size=16,
-        epochs=30,
-        validation_data=(X_val, y_val),
+    throughput = ThroughputReport(train_size)
+    model.fit(
+        train_dataset,
+        epochs=epochs,
+        validation_data=val_dataset,
         class_weight=class_weights,
-        callbacks=[early_stopping]
+        callbacks=[early_stopping, throughput, backup]
     )
-    
-    # Calculate final scores
-    _, accuracy, recall_score = model.evaluate(X_val, y_val)
-    print("\nModel Performance Metrics:")
+    shutil.rmtree(os.path.dirname(backup.backup_dir), ignore_errors=True)
+    return throughput.summary()
+
+def _save_trained_model(model, label_encoder, data_dir, trained_hashes, val_dataset, evaluated_on, timing,
+                        export_quantizations, build_index):
+    """Evaluate, then save the model, label encoder, training manifest, TFLite exports and embedding index
+
+    evaluated_on describes val_dataset, since fine-tuning runs are not
+    validated on a split of the whole dataset.
+    """
+    _, accuracy, recall_score = model.evaluate(val_dataset)
+    print(f"\nModel Performance Metrics ({evaluated_on}):")
     print(f"Accuracy: {accuracy:.2f}")
     print(f"Recall Score: {recall_score:.2f}")
-    
+
     # Save metrics for reference
+    os.makedirs('models', exist_ok=True)
     with open('models/metrics.txt', 'w') as f:
         f.write(f"Accuracy: {accuracy:.2f}\n")
         f.write(f"Recall Score: {recall_score:.2f}\n")
+        f.write(f"Evaluated on: {evaluated_on}\n")
+        f.write(f"Training: {timing['epochs']} epochs in {timing['seconds']:.0f} s, "
+                f"{timing['images_per_second']:.1f} images/sec (median epoch)\n")
 
-    # Save model
-    os.makedirs('models', exist_ok=True)
-    model.save('models/plant_classifier.h5')
-    joblib.dump(label_encoder, 'models/label_encoder.joblib')
-    print("Model saved to models/plant_classifier.h5")
+    if tf.keras.mixed_precision.global_policy().name != 'float32':
+        # Save a float32 copy (mixed precision keeps float32 weights) so inference and export stay float32
+        tf.keras.mixed_precision.set_global_policy('float32')
+        trained = model
+        model = create_efficientnet_model(len(label_encoder.classes_), weights=None)
+        model.set_weights(trained.get_weights())
+
+    # Save model, with the content hashes of the images it has seen so fine_tune_model() can find new ones
+    model.save(MODEL_PATH)
+    joblib.dump(label_encoder, ENCODER_PATH)
+    joblib.dump({'classes': list(label_encoder.classes_), 'content_hashes': sorted(trained_hashes)}, MANIFEST_PATH)
+    print(f"Model saved to {MODEL_PATH}")
+
+    for quantization in QUANTIZATIONS:
+        try:
+            if quantization in export_quantizations:
+                export_tflite(quantization, MODEL_PATH, data_dir=data_dir, model=model)
+                continue
+        except Exception as e:
+            # The Keras model is saved either way; exports can be retried with model_export.py
+            print(f"Error exporting {quantization} TFLite model: {e}")
+        # An export of an older model would be served with the new label encoder
+        stale_path = tflite_path(quantization, MODEL_PATH)
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+            print(f"Removed the outdated {quantization} TFLite model {stale_path}")
+
+    # The index holds this model's embeddings, so an index from an older model must not survive
+    try:
+        if build_index:
+            build_embedding_index((model, label_encoder), data_dir)
+            return model
+    except Exception as e:
+        print(f"Error building embedding index: {e}")
+    if os.path.exists(EMBEDDING_INDEX_PATH):
+        os.remove(EMBEDDING_INDEX_PATH)
+    return model
+
+def train_model(data_dir='data/training', cache_dir=DEFAULT_CACHE_DIR, export_quantizations=DEFAULT_QUANTIZATIONS,
+                config=None, resume=True, build_index=True):
+    """Train the plant identification model using EfficientNet
+
+    config is a TrainingConfig (batch size, learning rate, XLA, mixed
+    precision, threads); by default it is read from TRAIN_* environment
+    variables.
+
+    With cache_dir set, preprocessed images are kept in a memory-mapped cache
+    that is only updated for added or changed files; pass cache_dir=None to
+    decode and preprocess every image from disk instead.
+
+    The model is backed up after every epoch under models/checkpoints/full;
+    if a run is interrupted, the next one continues from the last completed
+    epoch (pass resume=False to start over).
+    The saved model is then exported to TFLite with each of
+    export_quantizations (see model_export; pass () to skip that), and the
+    training images are embedded into a nearest-neighbour index (see
+    embedding_index) unless build_index=False. To learn newly added images
+    without a full retrain, use fine_tune_model().
+    """
+    config = config or TrainingConfig.from_env()
+    with training_runtime(config):
+        run_start = time.perf_counter()
+        if cache_dir:
+            print("Updating preprocessed image cache...")
+            cache = PreprocessCache(cache_dir)
+            cache.update(iter_training_files(data_dir))
+            image_paths, y, shards, offsets = cache.entries()
+            sources = np.stack([shards, offsets], axis=1)
+        else:
+            print("Listing training data...")
+            image_paths, y = [], []
+            for image_path, plant_class in iter_training_files(data_dir):
+                image_paths.append(image_path)
+                y.append(plant_class)
+            y = np.array(y)
+            sources = np.array(image_paths)
+
+        if len(y) == 0:
+            raise ValueError("No training data found! Please add some images first.")
+
+        if len(np.unique(y)) < 2:
+            raise ValueError("Need images from at least 2 different plant categories for training.")
+
+        print(f"Found {len(y)} images from {len(np.unique(y))} classes")
+        content_hashes = get_catalog(data_dir).content_hashes()
+        trained_hashes = {content_hashes[path] for path in image_paths if path in content_hashes}
+
+        # Convert labels to categorical
+        label_encoder = LabelEncoder()
+        y_encoded = label_encoder.fit_transform(y)
+        y_categorical = tf.keras.utils.to_categorical(y_encoded)
+
+        # Split with stratification (on paths or cache slots; images are read while training)
+        sources_train, sources_val, y_train, y_val = train_test_split(
+            sources, y_categorical, test_size=0.2, random_state=42, stratify=y_encoded
+        )
+        if cache_dir:
+            train_dataset = make_cached_dataset(cache, sources_train[:, 0], sources_train[:, 1], y_train,
+                                                batch_size=config.batch_size, shuffle=True, seed=42)
+            val_dataset = make_cached_dataset(cache, sources_val[:, 0], sources_val[:, 1], y_val,
+                                              batch_size=config.batch_size, shuffle=False)
+        else:
+            train_dataset = make_dataset(sources_train, y_train, batch_size=config.batch_size, shuffle=True, seed=42)
+            val_dataset = make_dataset(sources_val, y_val, batch_size=config.batch_size, shuffle=False)
+
+        # Create and compile model
+        model = compile_for_training(create_efficientnet_model(len(label_encoder.classes_), weights=config.weights),
+                                     config)
+        print("Training model with EfficientNet...")
+        class_weights = _class_weights(y_encoded, len(label_encoder.classes_), len(y_train))
+        timing = _fit(model, train_dataset, val_dataset, len(y_train), class_weights, config.epochs, config,
+                      _backup_callback('full', label_encoder.classes_, resume))
+
+        evaluated_on = f"{len(y_val)} held-out images, 20% of the dataset"
+        model = _save_trained_model(model, label_encoder, data_dir, trained_hashes, val_dataset, evaluated_on, timing,
+                                    export_quantizations, build_index)
+        print(f"Training run finished in {time.perf_counter() - run_start:.0f} s "
+              f"({timing['epochs']} epochs, {timing['seconds']:.0f} s in model.fit)")
+
+        return model, label_encoder
+
+def _with_classes(trained, old_classes, classes):
+    """A fresh model for `classes` carrying the trained weights; output units for new classes start untrained
+
+    LabelEncoder keeps classes sorted, so a new class can shift the indices of
+    existing ones; their output weights are moved to the new positions.
+    """
+    model = create_efficientnet_model(len(classes), weights=None)
+    for source, target in zip(trained.layers[:-1], model.layers[:-1]):
+        target.set_weights(source.get_weights())
+    old_kernel, old_bias = trained.layers[-1].get_weights()
+    kernel, bias = model.layers[-1].get_weights()
+    for i, plant_class in enumerate(classes):
+        if plant_class in old_classes:
+            old_index = old_classes.index(plant_class)
+            kernel[:, i] = old_kernel[:, old_index]
+            bias[i] = old_bias[old_index]
+    model.layers[-1].set_weights([kernel, bias])
+    return model
+
+def _replay_sample(files, count, seed=42):
+    """Up to `count` (path, label) pairs drawn evenly across classes"""
+    by_class = {}
+    for image_path, plant_class in files:
+        by_class.setdefault(plant_class, []).append(image_path)
+    rng = np.random.default_rng(seed)
+    per_class = int(np.ceil(count / len(by_class))) if by_class else 0
+    sample = []
+    for plant_class, paths in sorted(by_class.items()):
+        chosen = rng.choice(len(paths), min(per_class, len(paths)), replace=False)
+        sample.extend((paths[i], plant_class) for i in sorted(chosen))
+    return [sample[i] for i in sorted(rng.permutation(len(sample))[:count])]
+
+def fine_tune_model(data_dir='data/training', replay_ratio=DEFAULT_REPLAY_RATIO,
+                    export_quantizations=DEFAULT_QUANTIZATIONS, config=None, resume=True, build_index=True):
+    """Fine-tune the saved model on images added since it was last trained, instead of retraining from scratch
+
+    New images are those whose content is not in the training manifest the
+    last run saved. Training uses all of them plus replay_ratio times as many
+    previously seen images, sampled evenly across classes so the model does
+    not forget what it knew, for config.fine_tune_epochs epochs at
+    config.fine_tune_learning_rate. A class seen for the first time gets a new
+    output unit and is added to the label encoder. Checkpoints, resuming,
+    exports and the embedding index work as in train_model(); rebuilding the
+    index embeds every training image, so pass build_index=False to skip it
+    when time is short (the stale index is then removed).
+
+    Returns (model, label_encoder), or the saved ones if there is nothing new.
+    """
+    if not all(os.path.exists(path) for path in (MODEL_PATH, ENCODER_PATH, MANIFEST_PATH)):
+        raise FileNotFoundError("No trained model with a training manifest found. Run train_model() first.")
+    config = config or TrainingConfig.from_env()
+    with training_runtime(config):
+        run_start = time.perf_counter()
+
+        manifest = joblib.load(MANIFEST_PATH)
+        trained_hashes = set(manifest['content_hashes'])
+        files = list(iter_training_files(data_dir))
+        content_hashes = get_catalog(data_dir).content_hashes()
+        new_files = [(path, label) for path, label in files if content_hashes.get(path) not in trained_hashes]
+        label_encoder = joblib.load(ENCODER_PATH)
+        if not new_files:
+            print("No new images since the last training run")
+            return tf.keras.models.load_model(MODEL_PATH), label_encoder
+
+        old_classes = list(label_encoder.classes_)
+        classes = sorted(set(old_classes) | {label for _, label in new_files})
+        if classes != old_classes:
+            print(f"Adding classes: {', '.join(sorted(set(classes) - set(old_classes)))}")
+            label_encoder = LabelEncoder().fit(classes)
+        old_files = [(path, label) for path, label in files if content_hashes.get(path) in trained_hashes]
+        replay = _replay_sample(old_files, int(len(new_files) * replay_ratio))
+        print(f"Fine-tuning on {len(new_files)} new and {len(replay)} previously seen images")
+
+        paths, labels = map(np.array, zip(*(new_files + replay)))
+        y_encoded = label_encoder.transform(labels)
+        y_categorical = tf.keras.utils.to_categorical(y_encoded, num_classes=len(classes))
+        # Small sets cannot be stratified: each class needs two images and a place in the validation split
+        counts = np.bincount(y_encoded)
+        can_stratify = counts[counts > 0].min() > 1 and np.ceil(0.2 * len(y_encoded)) >= np.count_nonzero(counts)
+        stratify = y_encoded if can_stratify else None
+        paths_train, paths_val, y_train, y_val = train_test_split(
+            paths, y_categorical, test_size=0.2, random_state=42, stratify=stratify
+        )
+        train_dataset = make_dataset(paths_train, y_train, batch_size=config.batch_size, shuffle=True, seed=42)
+        val_dataset = make_dataset(paths_val, y_val, batch_size=config.batch_size, shuffle=False)
+
+        trained = tf.keras.models.load_model(MODEL_PATH, compile=False)
+        model = compile_for_training(_with_classes(trained, old_classes, classes), config,
+                                     learning_rate=config.scaled_fine_tune_learning_rate)
+        class_weights = _class_weights(y_encoded, len(classes), len(y_train))
+        timing = _fit(model, train_dataset, val_dataset, len(y_train), class_weights, config.fine_tune_epochs, config,
+                      _backup_callback('fine_tune', classes, resume))
+
+        trained_hashes.update(content_hashes[path] for path, _ in new_files)
+        evaluated_on = (f"fine-tuning validation split of {len(y_val)} new and replayed images, "
+                        f"not the whole dataset")
+        model = _save_trained_model(model, label_encoder, data_dir, trained_hashes, val_dataset, evaluated_on, timing,
+                                    export_quantizations, build_index)
+        print(f"Fine-tuning finished in {time.perf_counter() - run_start:.0f} s "
+              f"({timing['epochs']} epochs, {timing['seconds']:.0f} s in model.fit)")
+        return model, label_encoder
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the plant classifier, or fine-tune it on newly added images")
+    parser.add_argument("--data-dir", default="data/training")
+    parser.add_argument("--incremental", action="store_true",
+                        help="fine-tune the saved model on images added since it was trained")
+    parser.add_argument("--replay-ratio", type=float, default=DEFAULT_REPLAY_RATIO,
+                        help="previously seen images replayed per new image when fine-tuning")
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints from an interrupted run")
+    parser.add_argument("--skip-index", action="store_true", help="do not rebuild the embedding index")
+    args = parser.parse_args()
 
-    return model, label_encoder
+    if args.incremental:
+        fine_tune_model(args.data_dir, args.replay_ratio, resume=not args.restart, build_index=not args.skip_index)
+    else:
+        train_model(args.data_dir, resume=not args.restart, build_index=not args.skip_index)
 
 if __name__ == "__main__":
-    train_model()
+    main()
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import openai
+from openai import AsyncOpenAI
+
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('VISION_MAX_CONCURRENCY', '8'))
+DEFAULT_REQUESTS_PER_SECOND = float(os.environ.get('VISION_REQUESTS_PER_SECOND', '5'))
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 8.0
+# Per attempt, and for the whole call including retries
+DEFAULT_REQUEST_TIMEOUT = 30.0
+DEFAULT_DEADLINE = 60.0
+# The circuit opens after this many consecutive failures and stays open this long
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class VisionAPIError(Exception):
+    """The vision API could not give an answer (as opposed to answering "Unknown")"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(VisionAPIError):
+    """Requests are being refused without calling the API after repeated failures"""
+
+
+class AsyncRateLimiter:
+    """Token bucket allowing `rate` requests per second with bursts of `burst`, for coroutines"""
+
+    def __init__(self, rate=DEFAULT_REQUESTS_PER_SECOND, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait_time)
+
+
+class CircuitBreaker:
+    """Stops calling a failing service for a while instead of piling on more requests
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail fast for reset_timeout seconds. Then one trial call is let through
+    (half-open): its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def allow(self):
+        """True if a call may be made now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+def _retry_delay(attempt, error=None, backoff=DEFAULT_BACKOFF):
+    """Exponential backoff with jitter, honouring a numeric Retry-After header"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after', '')
+        if retry_after.replace('.', '', 1).isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+    return min(MAX_BACKOFF, backoff * (2 ** attempt)) * (0.5 + random.random())
+
+
+def _is_retryable(error):
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return True  # includes APITimeoutError
+    return isinstance(error, openai.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+class AsyncVisionClient:
+    """Concurrent chat-completions client with rate limiting, retries, deadlines and a circuit breaker
+
+    At most max_concurrency requests are in flight and at most
+    requests_per_second are started, across every coroutine using the client;
+    all of them share one pooled HTTP connection set. Connection errors,
+    timeouts, 429 and 5xx responses are retried with exponential backoff until
+    max_retries or the per-call deadline runs out, then raise VisionAPIError.
+    base_url can point at any OpenAI-compatible server, such as a local mock.
+    """
+
+    def __init__(self, api_key=None, base_url=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 requests_per_second=DEFAULT_REQUESTS_PER_SECOND, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff=DEFAULT_BACKOFF, request_timeout=DEFAULT_REQUEST_TIMEOUT, deadline=DEFAULT_DEADLINE,
+                 circuit_breaker=None):
+        # Retries are handled here, so the SDK's own are switched off
+        self.client = AsyncOpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"), base_url=base_url,
+                                  timeout=request_timeout, max_retries=0)
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self._semaphore = None
+        self._rate_limiter = None
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0}
+
+    def _limits(self):
+        # Created on first use so they belong to the event loop the client runs on
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._rate_limiter = AsyncRateLimiter(self.requests_per_second)
+        return self._semaphore, self._rate_limiter
+
+    async def _attempt(self, request):
+        semaphore, rate_limiter = self._limits()
+        async with semaphore:
+            await rate_limiter.acquire()
+            # Checked last, so requests that queued while the service failed are not sent
+            if not self.circuit_breaker.allow():
+                self.stats['rejected'] += 1
+                raise CircuitOpenError("Vision API circuit is open after repeated failures")
+            self.stats['requests'] += 1
+            try:
+                return await self.client.chat.completions.create(**request)
+            except asyncio.CancelledError:
+                # Cut short by the deadline or the caller: still a failure, so a half-open trial never stays pending
+                self.circuit_breaker.record_failure()
+                raise
+
+    async def create_chat_completion(self, **request):
+        """client.chat.completions.create(**request) with the protections described above"""
+        try:
+            async with asyncio.timeout(self.deadline):
+                attempt = 0
+                while True:
+                    try:
+                        response = await self._attempt(request)
+                    except CircuitOpenError:
+                        self.stats['failures'] += 1
+                        raise
+                    except Exception as e:
+                        retryable = _is_retryable(e)
+                        status_code = getattr(e, 'status_code', None)
+                        if retryable or (status_code is not None and status_code >= 500):
+                            self.circuit_breaker.record_failure()
+                        else:
+                            # The service answered; a rejected request says nothing about its health
+                            self.circuit_breaker.record_success()
+                        if not retryable or attempt >= self.max_retries:
+                            self.stats['failures'] += 1
+                            raise VisionAPIError(f"Vision API request failed: {e}", status_code) from e
+                        delay = _retry_delay(attempt, e, self.backoff)
+                        print(f"Vision API request failed ({e}), retrying in {delay:.1f}s")
+                        self.stats['retries'] += 1
+                        attempt += 1
+                        await asyncio.sleep(delay)
+                        continue
+                    self.circuit_breaker.record_success()
+                    return response
+        except TimeoutError as e:
+            self.stats['failures'] += 1
+            raise VisionAPIError(f"Vision API request did not complete within {self.deadline:.0f}s") from e
+
+    async def close(self):
+        await self.client.close()
+
+
+class BackgroundLoop:
+    """An event loop on a daemon thread, so synchronous code can share one async client"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="vision-client-loop", daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the loop and block until it finishes"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)